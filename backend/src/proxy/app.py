@@ -2,15 +2,39 @@
 This is the proxy for the backend services
 """
 
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
 import auth
+import batch
+import breaker
+import calendar_view
 import calendars
+import checks
+import compression
+import conditional
 import events
 import invites
+import metrics
+import ratelimit
 import rsvp
+import tracing
+import upstream
 import users
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await upstream.startup()
+    monitor = asyncio.ensure_future(metrics.monitor_loop_lag())
+    yield
+    monitor.cancel()
+    await upstream.shutdown()
+
+
 app = FastAPI(
     title="Backend API",
     version="0.1.0",
@@ -18,8 +42,17 @@ app = FastAPI(
     redoc_url=None,
     openapi_url="/openapi.json",
     root_path="/api",
+    lifespan=lifespan,
 )
 
+tracing.configure("proxy")
+
+app.add_middleware(
+    compression.CompressionMiddleware,
+    minimum_size=upstream.get_env_int("PROXY_COMPRESSION_MIN_SIZE", 1024),
+)
+app.add_middleware(conditional.ConditionalMiddleware)
+app.add_middleware(ratelimit.RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -28,16 +61,51 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+
+
+@app.exception_handler(breaker.UpstreamUnavailable)
+async def upstream_unavailable(request: Request, exc: breaker.UpstreamUnavailable):
+    return Response(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=json.dumps({"error": str(exc)}),
+        media_type="application/json",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "singleflight": upstream.singleflight.stats(),
+        "cache": upstream.cache.stats(),
+        "retries": upstream.retry_budget.stats(),
+        "replicas": {service: pool.stats() for service, pool in upstream.pools.items()},
+        "breakers": {
+            service: circuit.stats() for service, circuit in upstream.breakers.items()
+        },
+        "users": checks.users.stats(),
+        "compression": compression.cache.stats(),
+        "rate_limits": {
+            name: buckets.stats()
+            for name, buckets in ratelimit.LIMITS.items()
+            if buckets is not None
+        },
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.metrics_response()
 
 
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(calendars.router, prefix="/shares", tags=["calendar shares"])
+app.include_router(calendar_view.router, prefix="/calendar", tags=["calendar"])
 app.include_router(events.router, prefix="/events", tags=["events"])
 app.include_router(invites.router, prefix="/invites", tags=["invites"])
 app.include_router(rsvp.router, prefix="/rsvp", tags=["rsvp"])
+app.include_router(batch.router, prefix="/batch", tags=["batch"])
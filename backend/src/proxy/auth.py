@@ -1,4 +1,6 @@
+import checks
 import httpx
+import upstream
 from fastapi import APIRouter, Response
 from pydantic import BaseModel
 
@@ -37,16 +39,19 @@ async def login(user: UserModel) -> Response:
     :return: Response with status code 200 if login is successful, 401 otherwise
     """
     try:
-        response = httpx.post(
-            "http://auth-service:8000/api/auth/login",
+        response = await upstream.post(
+            "auth",
+            "/api/auth/login",
             json={"username": user.username, "password": user.password},
         )
+        if response.status_code == 200:
+            checks.users.add(user.username, True)
         return Response(
             status_code=response.status_code,
             content=response.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=500,
             content={"error": "Internal server error"},
@@ -86,18 +91,25 @@ async def register(user: UserModel) -> Response:
     409 if user already exists
     """
     try:
-        response = httpx.post(
-            "http://auth-service:8000/api/auth/register",
+        response = await upstream.post(
+            "auth",
+            "/api/auth/register",
             json={"username": user.username, "password": user.password},
         )
+        if response.status_code == 201:
+            checks.users.add(user.username, True)
         return Response(
             status_code=response.status_code,
             content=response.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
+        # The user may have been registered all the same
+        checks.users.discard(user.username)
         return Response(
             status_code=500,
             content={"error": "Internal server error"},
             media_type="application/json",
         )
+    finally:
+        upstream.cache.invalidate("auth", "/api/users")
@@ -0,0 +1,217 @@
+"""
+Batches of sub-requests against the routes of the proxy, in one round trip.
+"""
+
+import asyncio
+import json
+from typing import Any, Literal
+
+import httpx
+import streaming
+import upstream
+from fastapi import APIRouter, Request, Response, status
+from pydantic import BaseModel, Field
+
+router = APIRouter()
+
+# Headers of the batch request that identify the client to every sub-request
+FORWARDED = ("authorization", "cookie", "x-forwarded-for", "x-user")
+
+MAX_REQUESTS = upstream.get_env_int("PROXY_BATCH_MAX_REQUESTS", 50)
+
+CONCURRENCY = upstream.get_env_int("PROXY_BATCH_CONCURRENCY", 10)
+
+TIMEOUT = upstream.get_env_int("PROXY_BATCH_TIMEOUT_MS", 5000) / 1000
+
+
+class SubRequestModel(BaseModel):
+    method: Literal["GET", "POST", "PUT", "DELETE"] = "GET"
+    path: str = Field(
+        ..., pattern=r"^/", description="Path of a proxy route, with its query"
+    )
+    headers: dict[str, str] = {}
+    body: Any = None
+
+
+class BatchModel(BaseModel):
+    requests: list[SubRequestModel]
+
+
+def phases(requests: list[SubRequestModel]) -> list[list[int]]:
+    """
+    Split a batch into the groups of sub-requests that may run at the same time.
+
+    Consecutive GETs run concurrently, while every other sub-request runs on its
+    own, after everything before it and before everything after it. A GET that
+    follows a write therefore sees the write.
+
+    :param requests: The sub-requests of the batch.
+
+    :returns: The indexes of the sub-requests of each group, in order.
+    """
+    groups: list[list[int]] = []
+    for index, sub_request in enumerate(requests):
+        if (
+            sub_request.method == "GET"
+            and groups
+            and requests[groups[-1][0]].method == "GET"
+        ):
+            groups[-1].append(index)
+        else:
+            groups.append([index])
+    return groups
+
+
+def is_batch(path: str) -> bool:
+    """
+    Check whether a path is the batch route itself, which cannot be nested.
+
+    :param path: The path of a sub-request, with or without the `/api` prefix.
+
+    :returns: Whether the path is the batch route.
+    """
+    path = path.split("?", 1)[0].rstrip("/").removeprefix("/api")
+    return path == "/batch"
+
+
+def result(response: httpx.Response) -> dict[str, Any]:
+    """
+    Describe the response to a sub-request.
+
+    :param response: The response of the proxy route.
+
+    :returns: The status, the end-to-end headers and the body, decoded from JSON
+        when possible.
+    """
+    try:
+        body = response.json()
+    except ValueError:
+        body = response.text
+    return {
+        "status": response.status_code,
+        "headers": streaming.relay_headers(response.headers),
+        "body": body,
+    }
+
+
+def error(status_code: int, message: str) -> dict[str, Any]:
+    return {"status": status_code, "headers": {}, "body": {"error": message}}
+
+
+@router.post(
+    "",
+    summary="Send a batch of requests",
+    description=f"""Send up to {MAX_REQUESTS} requests to the other routes of the
+    API in one round trip. Consecutive GETs run concurrently, other requests run in
+    order. The results are returned in the order of the requests. Requests that
+    have not completed within {TIMEOUT:g} seconds fail with 504, and requests
+    that fail without a response report 502 with the error.""",
+    responses={
+        200: {
+            "description": "The result of every request",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "results": [
+                            {
+                                "status": 200,
+                                "headers": {"content-type": "application/json"},
+                                "body": {"user": {"id": 1, "username": "Dido"}},
+                            },
+                            {
+                                "status": 404,
+                                "headers": {"content-type": "application/json"},
+                                "body": {"error": "Event not found"},
+                            },
+                        ]
+                    }
+                }
+            },
+        },
+        400: {
+            "description": "Too many requests in the batch",
+            "content": {
+                "application/json": {
+                    "example": {"error": "A batch holds at most 50 requests"}
+                }
+            },
+        },
+    },
+)
+async def send_batch(batch: BatchModel, request: Request):
+    if len(batch.requests) > MAX_REQUESTS:
+        return Response(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=json.dumps(
+                {"error": f"A batch holds at most {MAX_REQUESTS} requests"}
+            ),
+            media_type="application/json",
+        )
+
+    forwarded = {
+        name: value for name, value in request.headers.items() if name in FORWARDED
+    }
+    # Sub-requests that do not complete before the deadline keep this result
+    expired = error(status.HTTP_504_GATEWAY_TIMEOUT, "Batch deadline exceeded")
+    results = [expired] * len(batch.requests)
+    slots = asyncio.Semaphore(CONCURRENCY)
+    # Sub-requests go through the whole app, so each one is rate limited, traced
+    # and measured like a request of its own
+    transport = httpx.ASGITransport(
+        app=request.app,
+        raise_app_exceptions=False,
+        client=(request.client.host, request.client.port) if request.client else None,
+    )
+
+    async with httpx.AsyncClient(
+        transport=transport,
+        base_url="http://proxy",
+        headers={"Accept-Encoding": "identity"},
+    ) as client:
+
+        async def send(index: int) -> None:
+            sub_request = batch.requests[index]
+            if is_batch(sub_request.path):
+                results[index] = error(
+                    status.HTTP_400_BAD_REQUEST, "Batches cannot be nested"
+                )
+                return
+            async with slots:
+                try:
+                    response = await client.request(
+                        sub_request.method,
+                        sub_request.path,
+                        headers={**forwarded, **sub_request.headers},
+                        json=sub_request.body,
+                    )
+                except httpx.TimeoutException:
+                    results[index] = error(
+                        status.HTTP_504_GATEWAY_TIMEOUT, "Request timed out"
+                    )
+                    return
+                except Exception as e:
+                    # A failure to send is not the deadline, which only cancels
+                    results[index] = error(
+                        status.HTTP_502_BAD_GATEWAY, str(e) or type(e).__name__
+                    )
+                    return
+            results[index] = result(response)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + TIMEOUT
+        for group in phases(batch.requests):
+            tasks = [asyncio.ensure_future(send(index)) for index in group]
+            _, pending = await asyncio.wait(
+                tasks, timeout=max(0.0, deadline - loop.time())
+            )
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if pending:
+                break
+
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=json.dumps({"results": results}),
+        media_type="application/json",
+    )
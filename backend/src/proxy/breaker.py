@@ -0,0 +1,174 @@
+"""
+Circuit breakers that stop the proxy from calling upstream services that are down.
+"""
+
+import asyncio
+import math
+import time
+from typing import Any, Awaitable, Callable
+
+import httpx
+from resilience import RETRYABLE_STATUSES
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised instead of calling an upstream service that is known to be down.
+
+    :param service: The name of the upstream service.
+    :param retry_after: Seconds after which the client may try again.
+    """
+
+    def __init__(self, service: str, retry_after: float = 1):
+        super().__init__(f"{service}-service is unavailable")
+        self.service = service
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails requests to an upstream service fast while it is down.
+
+    The breaker opens after `failure_threshold` consecutive failures. While it is
+    open, requests fail at once and `probe` is called every `reset_timeout` seconds
+    in the background. Once a probe succeeds the breaker is half-open: up to
+    `half_open_requests` requests are let through, and it closes if they succeed
+    or opens again if one fails.
+    """
+
+    def __init__(
+        self,
+        service: str,
+        probe: Callable[[], Awaitable[bool]],
+        failure_threshold: int = 5,
+        reset_timeout: float = 5,
+        half_open_requests: int = 1,
+    ):
+        self.service = service
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_requests = half_open_requests
+        self.state = CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self._trials = 0
+        self._next_probe = 0.0
+        self._prober: asyncio.Task | None = None
+
+    def acquire(self) -> None:
+        """
+        Let a request through, or fail it if the service is down.
+
+        :raises UpstreamUnavailable: If the breaker is open, or half-open with all
+            of its trial requests in flight.
+        """
+        if self.state == CLOSED:
+            return
+        if self.state == HALF_OPEN and self._trials < self.half_open_requests:
+            self._trials += 1
+            return
+        self.rejected += 1
+        retry_after = max(1, math.ceil(self._next_probe - time.monotonic()))
+        raise UpstreamUnavailable(self.service, retry_after)
+
+    def release(self) -> None:
+        """
+        Record a request that ended without an outcome, such as a cancelled one.
+        """
+        if self.state == HALF_OPEN:
+            self._trials = max(0, self._trials - 1)
+
+    def success(self) -> None:
+        """
+        Record a request that the service handled.
+        """
+        self.failures = 0
+        if self.state == HALF_OPEN:
+            self._close()
+
+    def failure(self) -> None:
+        """
+        Record a request that failed because of the service.
+        """
+        self.failures += 1
+        if self.state == HALF_OPEN or (
+            self.state == CLOSED and self.failures >= self.failure_threshold
+        ):
+            self._open()
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened += 1
+        self._trials = 0
+        self._next_probe = time.monotonic() + self.reset_timeout
+        if self._prober is None or self._prober.done():
+            self._prober = asyncio.ensure_future(self._probe_until_up())
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self._trials = 0
+
+    async def _probe_until_up(self) -> None:
+        while self.state == OPEN:
+            await asyncio.sleep(max(0.0, self._next_probe - time.monotonic()))
+            try:
+                healthy = await self.probe()
+            except Exception:
+                healthy = False
+            if healthy:
+                self.state = HALF_OPEN
+            else:
+                self._next_probe = time.monotonic() + self.reset_timeout
+
+    async def guard(self, send: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Send a request through the breaker and record its outcome.
+
+        :param send: Sends the request and returns its response.
+
+        :returns: The response.
+        :raises UpstreamUnavailable: If the breaker does not let the request through.
+        """
+        self.acquire()
+        try:
+            response = await send()
+        except httpx.TransportError:
+            self.failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        if response.status_code in RETRYABLE_STATUSES:
+            self.failure()
+        else:
+            self.success()
+        return response
+
+    async def stop(self) -> None:
+        """
+        Stop probing the service.
+        """
+        if self._prober is not None:
+            self._prober.cancel()
+            await asyncio.gather(self._prober, return_exceptions=True)
+            self._prober = None
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Return the state of the breaker.
+
+        :returns: A dictionary with the breaker state and counters.
+        """
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
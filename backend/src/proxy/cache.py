@@ -0,0 +1,232 @@
+"""
+Bounded in-process cache for upstream GET responses.
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+import httpx
+
+CACHEABLE_STATUSES = (200, 404)
+
+# Headers that describe the encoded body, which is cached decoded
+ENCODING_HEADERS = frozenset(
+    {"content-encoding", "content-length", "transfer-encoding"}
+)
+
+
+def decoded_headers(headers: httpx.Headers) -> list[tuple[str, str]]:
+    """
+    Return the headers of a response without the ones that describe its encoding.
+
+    httpx decodes bodies as they are read, so a response rebuilt from a decoded
+    body with its original `Content-Encoding` would be decoded a second time.
+
+    :param headers: The headers of the upstream response.
+
+    :returns: The headers that still hold for the decoded body.
+    """
+    return [
+        (name, value)
+        for name, value in headers.multi_items()
+        if name.lower() not in ENCODING_HEADERS
+    ]
+
+
+@dataclass
+class CacheEntry:
+    """
+    A cached upstream response.
+    """
+
+    status_code: int
+    headers: list[tuple[str, str]]
+    content: bytes
+    expires: float
+
+    @property
+    def size(self) -> int:
+        return len(self.content) + sum(len(k) + len(v) for k, v in self.headers)
+
+
+class ResponseCache:
+    """
+    LRU cache of upstream responses, bounded by the total size of the cached bodies.
+
+    Keys are `(service, path, query)` tuples, so every query variant of a path can
+    be invalidated at once.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int, negative_ttl: float):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+        self._paths: dict[tuple[str, str], set[tuple]] = {}
+        self._invalidated: dict[tuple[str, str], float] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> httpx.Response | None:
+        """
+        Return the cached response for a key if it has not expired.
+
+        :param key: The request key.
+
+        :returns: A copy of the cached response, or None on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry.expires <= time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return httpx.Response(
+            entry.status_code, headers=entry.headers, content=entry.content
+        )
+
+    def validator(self, key: tuple) -> str | None:
+        """
+        Return the entity tag of the entry for a key, even if it has expired.
+
+        :param key: The request key.
+
+        :returns: The ETag of the cached response, or None.
+        """
+        if (entry := self._entries.get(key)) is None:
+            return None
+        return next(
+            (value for name, value in entry.headers if name.lower() == "etag"), None
+        )
+
+    def revalidate(
+        self, key: tuple, etag: str, ttl: float, started: float
+    ) -> httpx.Response | None:
+        """
+        Renew the entry for a key after upstream confirmed it is unchanged.
+
+        :param key: The request key.
+        :param etag: The entity tag upstream confirmed.
+        :param ttl: The new time to live of the entry, in seconds.
+        :param started: The monotonic time at which the request was sent.
+
+        :returns: A copy of the cached response, or None if it was evicted,
+            invalidated or replaced in the meantime.
+        """
+        if self.validator(key) != etag or started <= self._invalidated.get(
+            key[:2], 0.0
+        ):
+            return None
+        entry = self._entries[key]
+        if entry.status_code == 404:
+            ttl = min(ttl, self.negative_ttl)
+        entry.expires = time.monotonic() + ttl
+        self._entries.move_to_end(key)
+        self.revalidations += 1
+        return httpx.Response(
+            entry.status_code, headers=entry.headers, content=entry.content
+        )
+
+    def put(
+        self, key: tuple, response: httpx.Response, ttl: float, started: float
+    ) -> None:
+        """
+        Cache a response if its status is cacheable and it fits in the cache.
+
+        404 responses are cached for at most the negative TTL. Responses to
+        requests that started before the last invalidation of their path are
+        dropped, since they may predate the write that caused it.
+
+        :param key: The request key.
+        :param response: The upstream response.
+        :param ttl: The time to live of the entry, in seconds.
+        :param started: The monotonic time at which the request was sent.
+        """
+        if response.status_code not in CACHEABLE_STATUSES:
+            return
+        if response.status_code == 404:
+            ttl = min(ttl, self.negative_ttl)
+        if ttl <= 0 or started <= self._invalidated.get(key[:2], 0.0):
+            return
+        entry = CacheEntry(
+            status_code=response.status_code,
+            headers=decoded_headers(response.headers),
+            content=response.content,
+            expires=time.monotonic() + ttl,
+        )
+        if entry.size > self.max_entry_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = entry
+        self._paths.setdefault(key[:2], set()).add(key)
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, service: str, *paths: str) -> None:
+        """
+        Drop every cached query variant of the given paths.
+
+        :param service: The name of the upstream service.
+        :param paths: The paths to invalidate.
+        """
+        now = time.monotonic()
+        for path in paths:
+            self._invalidated[(service, path)] = now
+            for key in self._paths.pop((service, path), set()):
+                self._remove(key)
+        if len(self._invalidated) > 4 * len(self._paths) + 1024:
+            # Requests older than a minute have long timed out
+            self._invalidated = {
+                path: when
+                for path, when in self._invalidated.items()
+                if now - when < 60
+            }
+
+    def invalidate_missing(self, service: str) -> None:
+        """
+        Drop every cached 404 of a service, for a write whose paths are unknown.
+
+        :param service: The name of the upstream service.
+        """
+        now = time.monotonic()
+        for key in [
+            key
+            for key, entry in self._entries.items()
+            if key[0] == service and entry.status_code == 404
+        ]:
+            self._invalidated[key[:2]] = now
+            self._remove(key)
+
+    def _remove(self, key: tuple) -> None:
+        if (entry := self._entries.pop(key, None)) is None:
+            return
+        self._bytes -= entry.size
+        if (keys := self._paths.get(key[:2])) is not None:
+            keys.discard(key)
+            if not keys:
+                del self._paths[key[:2]]
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Return the cache size and hit statistics.
+
+        :returns: A dictionary with the cache statistics.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,189 @@
+"""
+The calendar of a user: the events they are (maybe) going to, which only they and
+the users they share their calendar with may see.
+"""
+
+import asyncio
+import json
+
+import checks
+import httpx
+import pagination
+import upstream
+from breaker import UpstreamUnavailable
+from events import MAX_LOOKUP
+from fastapi import APIRouter, Query, Response, status
+
+router = APIRouter()
+
+ATTENDING = ("YES", "MAYBE")
+
+
+async def can_view(username: str, viewer: str | None) -> bool:
+    """
+    Check whether a viewer may see the calendar of a user.
+
+    :param username: The owner of the calendar.
+    :param viewer: The user viewing the calendar, or None for an anonymous viewer.
+
+    :returns: Whether the owner is the viewer or shares their calendar with them.
+    """
+    if viewer is None:
+        return False
+    if viewer == username:
+        return True
+    return await checks.shares_calendar(username, viewer)
+
+
+async def get_attending(service: str, key: str, username: str) -> list[dict]:
+    """
+    Get the invites or RSVPs of a user that say they are (maybe) going.
+
+    :param service: The upstream service, `invites` or `rsvp`.
+    :param key: The key of the list in the upstream response.
+    :param username: The user whose invites or RSVPs to get.
+
+    :returns: The invites or RSVPs with status YES or MAYBE.
+    :raises UpstreamUnavailable: If the service fails to list them.
+    """
+    # Failures are raised, as an empty list would pass for a calendar without
+    # these events
+    rows = await pagination.get_all_pages(
+        service,
+        f"/api/{service}",
+        key,
+        {"username": username},
+        ttl=upstream.CACHE_TTLS[service],
+        kind="listing",
+    )
+    return [row for row in rows if row["status"] in ATTENDING]
+
+
+async def get_events(eventIds: list[int]) -> dict[int, dict]:
+    """
+    Get events by their ids, in one lookup per `MAX_LOOKUP` ids.
+
+    :param eventIds: The ids of the events.
+
+    :returns: The events that were found, by id.
+    :raises UpstreamUnavailable: If events-service fails a lookup.
+    """
+    responses = await asyncio.gather(
+        *(
+            upstream.post(
+                "events",
+                "/api/events/lookup",
+                json={"ids": eventIds[start : start + MAX_LOOKUP]},
+                kind="lookup",
+            )
+            for start in range(0, len(eventIds), MAX_LOOKUP)
+        )
+    )
+    if any(response.status_code != 200 for response in responses):
+        raise UpstreamUnavailable("events")
+    return {
+        event["id"]: event
+        for response in responses
+        for event in response.json()["events"]
+    }
+
+
+@router.get(
+    "/{username}",
+    summary="Get the calendar of a user",
+    description="""Get the events a user is (maybe) going to, through an accepted
+    invite or an RSVP. The viewer must be the user, or a user they share their
+    calendar with.""",
+    responses={
+        200: {
+            "description": "Calendar found",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "calendar": [
+                            {
+                                "id": 1,
+                                "title": "Independence!!!",
+                                "description": "Chase those Ottomans (not the couches) away!",
+                                "date": "1912-11-28",
+                                "organizer": "Ismail Qemali",
+                                "isPublic": True,
+                                "status": "YES",
+                                "source": "invite",
+                            }
+                        ]
+                    }
+                }
+            },
+        },
+        403: {
+            "description": "Calendar not shared with the viewer",
+            "content": {
+                "application/json": {
+                    "example": {"error": "Calendar not shared with viewer"}
+                }
+            },
+        },
+        500: {
+            "description": "Internal server error",
+            "content": {
+                "application/json": {"example": {"error": "Internal server error"}}
+            },
+        },
+    },
+)
+async def get_calendar(
+    username: str,
+    viewer: str = Query(
+        default=None, description="User viewing the calendar, anonymous if not given"
+    ),
+):
+    # The listings are fetched while the permission is checked, but they are only
+    # awaited once it passes, so that their failures cannot tell a viewer who may
+    # not see the calendar anything about it
+    attending = [
+        asyncio.ensure_future(get_attending("invites", "invites", username)),
+        asyncio.ensure_future(get_attending("rsvp", "responses", username)),
+    ]
+    try:
+        if not await can_view(username, viewer):
+            return Response(
+                status_code=status.HTTP_403_FORBIDDEN,
+                content=json.dumps({"error": "Calendar not shared with viewer"}),
+                media_type="application/json",
+            )
+        invites, responses = await asyncio.gather(*attending)
+        rows = [(invite, "invite") for invite in invites] + [
+            (response, "rsvp") for response in responses
+        ]
+        events = await get_events(
+            list(dict.fromkeys(row["eventId"] for row, _ in rows))
+        )
+    except httpx.TransportError:
+        return Response(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=json.dumps({"error": "Internal server error"}),
+            media_type="application/json",
+        )
+    finally:
+        for task in attending:
+            if not task.cancel() and not task.cancelled():
+                # Retrieve the failure of a listing that was never awaited
+                task.exception()
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=json.dumps(
+            {
+                "calendar": [
+                    {
+                        **events[row["eventId"]],
+                        "status": row["status"],
+                        "source": source,
+                    }
+                    for row, source in rows
+                    if row["eventId"] in events
+                ]
+            }
+        ),
+        media_type="application/json",
+    )
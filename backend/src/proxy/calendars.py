@@ -1,7 +1,11 @@
 import json
 
+import checks
 import httpx
-from fastapi import APIRouter, Response, status
+import pagination
+import streaming
+import upstream
+from fastapi import APIRouter, Query, Response, status
 from pydantic import BaseModel, Field
 
 router = APIRouter()
@@ -16,17 +20,25 @@ class CalendarShareModel(BaseModel):
     )
 
 
-def check_user_exists(username: str):
-    try:
-        response = httpx.get(f"http://auth-service:8000/api/users?username={username}")
-        return response.status_code == 200
-    except httpx.ConnectError:
-        return False
+def invalidate_shares(sharingUser: str, receivingUser: str):
+    """
+    Drop the cached share listings that a change to this share makes stale.
+    """
+    upstream.cache.invalidate(
+        "calendars",
+        "/api/shares",
+        f"/api/shares/by/{sharingUser}",
+        f"/api/shares/with/{receivingUser}",
+        f"/api/shares/by/{sharingUser}/with/{receivingUser}",
+    )
+
 
 @router.get(
     "",
     summary="Get all shared calendars",
-    description="Get all shared calendars.",
+    description=f"""Get all shared calendars, a page at a time, of `limit` or
+    {pagination.MAX_LIMIT} shared calendars, and `next` is the cursor of the next
+    page.""",
     responses={
         200: {
             "description": "All the shared calendars",
@@ -42,20 +54,31 @@ def check_user_exists(username: str):
         },
     },
 )
-async def get_calendars():
+async def get_calendars(
+    limit: int = Query(
+        default=None,
+        ge=1,
+        le=pagination.MAX_LIMIT,
+        description=f"Number of items per page, {pagination.MAX_LIMIT} by default",
+    ),
+    cursor: str = Query(
+        default=None, description="The `next` cursor of the previous page"
+    ),
+):
     """
     Get all shared calendars.
 
     :returns: A list of all shared calendars.
     """
     try:
-        response = httpx.get("http://calendars-service:8000/api/shares")
-        return Response(
-            status_code=response.status_code,
-            content=response.content,
-            media_type="application/json",
+        return await streaming.get(
+            "calendars",
+            "/api/shares",
+            params=pagination.page_params(limit, cursor),
+            ttl=upstream.CACHE_TTLS["shares"],
+            kind="listing",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
@@ -91,13 +114,13 @@ async def get_calendars_by(username: str):
     :returns: A list of shared calendars.
     """
     try:
-        response = httpx.get(f"http://calendars-service:8000/api/shares/by/{username}")
-        return Response(
-            status_code=response.status_code,
-            content=response.content,
-            media_type="application/json",
+        return await streaming.get(
+            "calendars",
+            f"/api/shares/by/{username}",
+            ttl=upstream.CACHE_TTLS["shares"],
+            kind="listing",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
@@ -133,15 +156,13 @@ async def get_calendars_with(username: str):
     :returns: A list of shared calendars.
     """
     try:
-        response = httpx.get(
-            f"http://calendars-service:8000/api/shares/with/{username}"
+        return await streaming.get(
+            "calendars",
+            f"/api/shares/with/{username}",
+            ttl=upstream.CACHE_TTLS["shares"],
+            kind="listing",
         )
-        return Response(
-            status_code=response.status_code,
-            content=response.content,
-            media_type="application/json",
-        )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
@@ -178,15 +199,15 @@ async def get_calendars_by_with(username: str, receivingUser: str):
     :returns: A list of shared calendars.
     """
     try:
-        response = httpx.get(
-            f"http://calendars-service:8000/api/shares/by/{username}/with/{receivingUser}"
-        )
-        return Response(
-            status_code=response.status_code,
-            content=response.content,
-            media_type="application/json",
+        response = await upstream.get(
+            "calendars",
+            f"/api/shares/by/{username}/with/{receivingUser}",
+            coalesce=True,
+            ttl=upstream.CACHE_TTLS["shares"],
+            kind="lookup",
         )
-    except httpx.ConnectError:
+        return streaming.relay(response)
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
@@ -229,23 +250,25 @@ async def get_calendars_by_with(username: str, receivingUser: str):
 async def share_calendar(calendar: CalendarShareModel):
     # Check that both users exist
 
-    if not check_user_exists(calendar.sharingUser):
+    if error := await checks.first_failure(
+        {
+            "Sharing user not found": checks.check_user_exists(calendar.sharingUser),
+            "Receiving user not found": checks.check_user_exists(
+                calendar.receivingUser
+            ),
+        }
+    ):
         return Response(
             status_code=status.HTTP_404_NOT_FOUND,
-            content=json.dumps({"error": "Sharing user not found"}),
-            media_type="application/json",
-        )
-    if not check_user_exists(calendar.receivingUser):
-        return Response(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content=json.dumps({"error": "Receiving user not found"}),
+            content=json.dumps({"error": error}),
             media_type="application/json",
         )
     # Share calendar
 
     try:
-        response = httpx.post(
-            "http://calendars-service:8000/api/shares",
+        response = await upstream.post(
+            "calendars",
+            "/api/shares",
             json={
                 "sharingUser": calendar.sharingUser,
                 "receivingUser": calendar.receivingUser,
@@ -256,12 +279,14 @@ async def share_calendar(calendar: CalendarShareModel):
             content=response.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
+    finally:
+        invalidate_shares(calendar.sharingUser, calendar.receivingUser)
 
 
 @router.delete(
@@ -299,32 +324,35 @@ async def share_calendar(calendar: CalendarShareModel):
 async def delete_calendar(calendar: CalendarShareModel):
     # Check that both users exist
 
-    if not check_user_exists(calendar.sharingUser):
-        return Response(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content=json.dumps({"error": "Sharing user not found"}),
-            media_type="application/json",
-        )
-    if not check_user_exists(calendar.receivingUser):
+    if error := await checks.first_failure(
+        {
+            "Sharing user not found": checks.check_user_exists(calendar.sharingUser),
+            "Receiving user not found": checks.check_user_exists(
+                calendar.receivingUser
+            ),
+        }
+    ):
         return Response(
             status_code=status.HTTP_404_NOT_FOUND,
-            content=json.dumps({"error": "Receiving user not found"}),
+            content=json.dumps({"error": error}),
             media_type="application/json",
         )
     # Delete calendar
 
     try:
-        response = httpx.delete(
-            f"http://calendars-service:8000/api/shares/{calendar.sharingUser}/{calendar.receivingUser}"
+        response = await upstream.delete(
+            "calendars", f"/api/shares/{calendar.sharingUser}/{calendar.receivingUser}"
         )
         return Response(
             status_code=response.status_code,
             content=response.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
+    finally:
+        invalidate_shares(calendar.sharingUser, calendar.receivingUser)
@@ -0,0 +1,245 @@
+"""
+Existence checks the proxy runs before forwarding writes.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable
+
+import httpx
+import upstream
+from breaker import UpstreamUnavailable
+
+
+class ExistenceCache:
+    """
+    Remembers which names are known to exist and which are known not to.
+
+    Known names are kept in an LRU for `ttl` seconds. Unknown names are kept for a
+    much shorter `negative_ttl`, so a name registered elsewhere is soon found, and
+    at most `max_negative` of them are kept.
+    """
+
+    def __init__(
+        self, max_entries: int, ttl: float, max_negative: int, negative_ttl: float
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_negative = max_negative
+        self.negative_ttl = negative_ttl
+        self._known: OrderedDict[str, float] = OrderedDict()
+        self._unknown: OrderedDict[str, float] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str) -> bool | None:
+        """
+        Return whether a name is known to exist.
+
+        :param name: The name to look up.
+
+        :returns: True or False if the answer is cached, None otherwise.
+        """
+        now = time.monotonic()
+        for entries, exists in ((self._known, True), (self._unknown, False)):
+            if (expires := entries.get(name)) is None:
+                continue
+            if expires <= now:
+                del entries[name]
+                break
+            if exists:
+                entries.move_to_end(name)
+            self.hits += 1
+            return exists
+        self.misses += 1
+        return None
+
+    def add(self, name: str, exists: bool) -> None:
+        """
+        Record whether a name exists.
+
+        :param name: The name to record.
+        :param exists: Whether the name exists.
+        """
+        self._known.pop(name, None)
+        self._unknown.pop(name, None)
+        if exists:
+            entries, limit = self._known, self.max_entries
+            entries[name] = time.monotonic() + self.ttl
+        else:
+            entries, limit = self._unknown, self.max_negative
+            entries[name] = time.monotonic() + self.negative_ttl
+        while len(entries) > limit:
+            entries.popitem(last=False)
+
+    def discard(self, name: str) -> None:
+        """
+        Forget whether a name exists, so that the next lookup asks upstream.
+
+        :param name: The name to forget.
+        """
+        self._known.pop(name, None)
+        self._unknown.pop(name, None)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Return the cache size and hit statistics.
+
+        :returns: A dictionary with the cache statistics.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "known": len(self._known),
+            "unknown": len(self._unknown),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+users = ExistenceCache(
+    max_entries=upstream.get_env_int("PROXY_USER_CACHE_SIZE", 10000),
+    ttl=upstream.get_env_int("PROXY_USER_CACHE_TTL", 300),
+    max_negative=upstream.get_env_int("PROXY_USER_CACHE_NEGATIVE_SIZE", 1024),
+    negative_ttl=upstream.get_env_int("PROXY_USER_CACHE_NEGATIVE_TTL", 5),
+)
+
+
+async def user_exists(username: str) -> bool:
+    """
+    Check whether a user exists, asking auth-service only on a cache miss.
+
+    :param username: The username to check.
+
+    :returns: Whether the user exists.
+    :raises httpx.TransportError: If auth-service is unreachable or too slow.
+    """
+    if (exists := users.get(username)) is not None:
+        return exists
+    response = await upstream.get(
+        "auth",
+        "/api/users",
+        coalesce=True,
+        params={"username": username},
+        kind="lookup",
+    )
+    exists = response.status_code == 200
+    if exists or response.status_code == 404:
+        users.add(username, exists)
+    return exists
+
+
+async def check_users_exist(usernames: list[str]) -> dict[str, bool]:
+    """
+    Check whether each of many users exists, asking auth-service once for all the
+    cache misses.
+
+    :param usernames: The usernames to check.
+
+    :returns: Whether each user exists, by username.
+    :raises UpstreamUnavailable: If auth-service is unreachable or too slow.
+    """
+    exists = {username: users.get(username) for username in set(usernames)}
+    if unknown := sorted(
+        username for username, found in exists.items() if found is None
+    ):
+        try:
+            response = await upstream.post(
+                "auth",
+                "/api/users/lookup",
+                json={"usernames": unknown},
+                kind="lookup",
+            )
+        except httpx.TransportError as exc:
+            raise UpstreamUnavailable("auth") from exc
+        if response.status_code != 200:
+            raise UpstreamUnavailable("auth")
+        found = {user["username"] for user in response.json()["users"]}
+        for username in unknown:
+            exists[username] = username in found
+            users.add(username, exists[username])
+    return exists
+
+
+async def check_user_exists(username: str) -> bool:
+    try:
+        return await user_exists(username)
+    except httpx.TransportError as exc:
+        # Not knowing is not the same as the user not existing
+        raise UpstreamUnavailable("auth") from exc
+
+
+async def check_event_exists(eventId: int) -> bool:
+    try:
+        response = await upstream.get(
+            "events",
+            f"/api/events/{eventId}",
+            coalesce=True,
+            ttl=upstream.CACHE_TTLS["events"],
+            kind="lookup",
+        )
+        return response.status_code == 200
+    except httpx.TransportError as exc:
+        raise UpstreamUnavailable("events") from exc
+
+
+async def check_public_event_exists(eventId: int) -> bool:
+    try:
+        response = await upstream.get(
+            "events",
+            f"/api/events/{eventId}",
+            coalesce=True,
+            ttl=upstream.CACHE_TTLS["events"],
+            kind="lookup",
+        )
+        return response.status_code == 200 and response.json()["event"]["isPublic"]
+    except httpx.TransportError as exc:
+        raise UpstreamUnavailable("events") from exc
+
+
+async def shares_calendar(sharingUser: str, receivingUser: str) -> bool:
+    """
+    Check whether a user shares their calendar with another user.
+
+    :param sharingUser: The user who would share their calendar.
+    :param receivingUser: The user who would receive the calendar.
+
+    :returns: Whether the calendar is shared.
+    :raises httpx.TransportError: If calendars-service is unreachable or too slow.
+    """
+    response = await upstream.get(
+        "calendars",
+        f"/api/shares/by/{sharingUser}/with/{receivingUser}",
+        coalesce=True,
+        ttl=upstream.CACHE_TTLS["shares"],
+        kind="lookup",
+    )
+    return response.status_code == 200
+
+
+async def first_failure(checks: dict[str, Awaitable[bool]]) -> str | None:
+    """
+    Run independent checks concurrently and stop at the first one that fails.
+
+    The checks still running when one fails are cancelled.
+
+    :param checks: The checks to run, keyed by the error to report if they fail.
+
+    :returns: The error of the first check that failed, or None if all passed.
+    :raises Exception: Whatever a check raised, after cancelling the others.
+    """
+    tasks = {asyncio.ensure_future(check): error for error, check in checks.items()}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if not task.result():
+                    return tasks[task]
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,332 @@
+"""
+Negotiated compression of the responses sent to clients.
+"""
+
+import zlib
+from collections import OrderedDict
+from typing import Any
+
+import upstream
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# Supported encodings, most preferred first
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+# Media types worth compressing, matched as prefixes
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+# Request headers whose entity tags may name a compressed representation
+CONDITIONAL_HEADERS = (b"if-match", b"if-none-match")
+
+GZIP_LEVEL = upstream.get_env_int("PROXY_GZIP_LEVEL", 6)
+BROTLI_QUALITY = upstream.get_env_int("PROXY_BROTLI_QUALITY", 5)
+
+
+def negotiate(header: str | None) -> str | None:
+    """
+    Pick the encoding to use from an `Accept-Encoding` header.
+
+    :param header: The value of the header, if any.
+
+    :returns: The preferred supported encoding, or None to send the body as is.
+    """
+    if not header:
+        return None
+    qualities: dict[str, float] = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """
+    Build the entity tag of a representation compressed with an encoding.
+
+    The compressed bytes differ from those the tag was computed on, so they get a
+    tag of their own. It stays strong, so that clients can use it in `If-Match`.
+
+    :param etag: The strong entity tag of the uncompressed representation.
+    :param encoding: Either `br` or `gzip`.
+
+    :returns: The strong entity tag of the compressed representation.
+    """
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def decoded_etags(header: str) -> str:
+    """
+    Strip the suffix of `encoded_etag` from the entity tags of a conditional header.
+
+    :param header: The value of an `If-Match` or `If-None-Match` header.
+
+    :returns: The header, with the tags the upstream services computed.
+    """
+    tags = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        for encoding in ("br", "gzip"):
+            if tag.endswith(f'-{encoding}"'):
+                tag = tag.removesuffix(f'-{encoding}"') + '"'
+                break
+        tags.append(tag)
+    return ", ".join(tags)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """
+    Compress a complete body.
+
+    :param body: The body to compress.
+    :param encoding: Either `br` or `gzip`.
+
+    :returns: The compressed body.
+    """
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+class StreamCompressor:
+    """
+    Compress a body sent in several chunks.
+
+    Every chunk is flushed, so the client can decode what was sent so far while
+    the rest of the body is still being produced.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(
+                GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class CompressedCache:
+    """
+    Compressed bodies of responses that carry an ETag, in an LRU bounded in bytes.
+
+    A strong ETag identifies the exact bytes of a representation, so a body only
+    has to be compressed once per encoding for as long as its ETag is current.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[tuple, bytes] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> bytes | None:
+        """
+        Return a compressed body.
+
+        :param key: The request path, query string, ETag and encoding.
+
+        :returns: The compressed body, or None if it is not cached.
+        """
+        if (body := self._entries.get(key)) is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key: tuple, body: bytes) -> None:
+        """
+        Store a compressed body, evicting the least recently used ones.
+
+        :param key: The request path, query string, ETag and encoding.
+        :param body: The compressed body.
+        """
+        if len(body) > self.max_bytes:
+            return
+        if (previous := self._entries.pop(key, None)) is not None:
+            self.size -= len(previous)
+        self._entries[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Return the cache size and hit statistics.
+
+        :returns: A dictionary with the cache statistics.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+cache = CompressedCache(
+    max_bytes=upstream.get_env_int("PROXY_COMPRESSION_CACHE_BYTES", 8 * 1024 * 1024)
+)
+
+
+def compressible(start: Message, minimum_size: int) -> bool:
+    """
+    Check whether a response should be compressed, from its status and headers.
+
+    :param start: The `http.response.start` message of the response.
+    :param minimum_size: The smallest body worth compressing, in bytes.
+
+    :returns: Whether to compress the body.
+    """
+    if start["status"] < 200 or start["status"] in (204, 304):
+        return False
+    headers = Headers(raw=start["headers"])
+    if "content-encoding" in headers:
+        return False
+    if not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+        return False
+    length = headers.get("content-length")
+    return length is None or int(length) >= minimum_size
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with the best encoding the client accepts.
+
+    Bodies smaller than `minimum_size` are sent as is. Complete bodies with an
+    ETag are compressed once and then served from `cache`, and streamed bodies
+    are compressed chunk by chunk.
+
+    A compressed response carries the tag of `encoded_etag`, and the conditional
+    headers of requests are stripped of its suffix before they reach the routes.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if_none_match = Headers(scope=scope).get("if-none-match", "")
+        # The scope is rewritten in place, since the outer middlewares read what
+        # the router adds to it, such as the route that matched
+        scope["headers"] = [
+            (
+                (name, decoded_etags(value.decode("latin-1")).encode("latin-1"))
+                if name.lower() in CONDITIONAL_HEADERS
+                else (name, value)
+            )
+            for name, value in scope["headers"]
+        ]
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        start: Message | None = None
+        pending = b""
+        compressor: StreamCompressor | None = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, pending, compressor
+            if message["type"] == "http.response.start":
+                start = message
+                if message["status"] == 304:
+                    # Keep the tag of the compressed representation the client has
+                    headers = MutableHeaders(raw=message["headers"])
+                    etag = headers.get("etag")
+                    if etag and not etag.startswith("W/"):
+                        if encoded_etag(etag, encoding) in if_none_match:
+                            headers["ETag"] = encoded_etag(etag, encoding)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is None:
+                # The headers are sent, keep going the way the first chunk went
+                if compressor is not None:
+                    body = compressor.compress(body)
+                    if not more_body:
+                        body += compressor.finish()
+                    message = {**message, "body": body}
+                await send(message)
+                return
+            if not compressible(start, self.minimum_size):
+                await send(start)
+                start = None
+                await send(message)
+                return
+            # Hold back the first chunks of a streamed body until it is known to
+            # be large enough
+            pending += body
+            if more_body and len(pending) < self.minimum_size:
+                return
+            body, pending = pending, b""
+            if not more_body and len(body) < self.minimum_size:
+                await send(start)
+                start = None
+                await send({**message, "body": body})
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = encoded_etag(etag, encoding)
+            if more_body:
+                del headers["Content-Length"]
+                compressor = StreamCompressor(encoding)
+                body = compressor.compress(body)
+            else:
+                key = (scope["path"], scope["query_string"], etag, encoding)
+                compressed = cache.get(key) if etag else None
+                if compressed is None:
+                    compressed = compress(body, encoding)
+                    if etag:
+                        cache.put(key, compressed)
+                body = compressed
+                headers["Content-Length"] = str(len(body))
+            await send(start)
+            start = None
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
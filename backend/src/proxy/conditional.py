@@ -0,0 +1,88 @@
+"""
+Conditional GET handling for the proxy.
+"""
+
+from contextvars import ContextVar
+
+from compression import decoded_etags
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# The If-None-Match header of the request being handled, with the tags of the
+# upstream services, for the routes that relay it to them
+if_none_match: ContextVar[str | None] = ContextVar("if_none_match", default=None)
+
+# Headers a 304 response keeps from the response it replaces
+NOT_MODIFIED_HEADERS = frozenset(
+    {b"etag", b"cache-control", b"content-location", b"expires", b"vary"}
+)
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    """
+    Check an `If-None-Match` header against an entity tag.
+
+    This is the weak comparison, which ignores the `W/` prefix. It must not be
+    used for `If-Match`, which the services check with the strong comparison.
+
+    :param header: The value of the header, if any.
+    :param etag: The entity tag of the response.
+
+    :returns: Whether the header lists the entity tag or is `*`.
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+class ConditionalMiddleware:
+    """
+    Answer a GET with 304 when the client already has the representation.
+
+    Responses are compared by their ETag, whether they were served from the cache
+    or by the upstream service.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        header = Headers(scope=scope).get("if-none-match")
+        if not header:
+            await self.app(scope, receive, send)
+            return
+        token = if_none_match.set(decoded_etags(header))
+        not_modified = False
+
+        async def send_conditional(message: Message) -> None:
+            nonlocal not_modified
+            if message["type"] == "http.response.start":
+                etag = Headers(raw=message["headers"]).get("etag")
+                if message["status"] == 200 and etag and etag_matches(header, etag):
+                    not_modified = True
+                    message = {
+                        "type": "http.response.start",
+                        "status": 304,
+                        "headers": [
+                            (name, value)
+                            for name, value in message["headers"]
+                            if name.lower() in NOT_MODIFIED_HEADERS
+                        ],
+                    }
+                    await send(message)
+                    await send({"type": "http.response.body", "body": b""})
+                    return
+            elif message["type"] == "http.response.body" and not_modified:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_conditional)
+        finally:
+            if_none_match.reset(token)
@@ -1,9 +1,14 @@
+import asyncio
 import datetime
 import json
+from typing import Any
 
+import checks
 import httpx
-
-from fastapi import APIRouter, Response, status
+import pagination
+import streaming
+import upstream
+from fastapi import APIRouter, Header, Query, Response, status
 from pydantic import BaseModel, Field
 
 router = APIRouter()
@@ -17,10 +22,64 @@ class EventModel(BaseModel):
     isPublic: bool
 
 
+class LookupModel(BaseModel):
+    ids: list[int]
+    fields: str | None = Field(
+        default=None, description="Comma-separated fields to return, e.g. title,date"
+    )
+
+
+ATTENDING = ("YES", "MAYBE")
+
+MAX_LOOKUP = upstream.get_env_int("PROXY_MAX_EVENT_LOOKUP", 5000)
+
+
+def filter_params(filters: dict[str, Any]) -> dict[str, Any]:
+    """
+    Build the query parameters that filter an event listing upstream.
+
+    :param filters: The filters, by their upstream name.
+
+    :returns: The parameters to send upstream, without the ones not given.
+    """
+    return {
+        name: value.isoformat() if isinstance(value, datetime.date) else value
+        for name, value in filters.items()
+        if value is not None
+    }
+
+
+async def get_participants(service: str, key: str, eventId: int) -> list[dict]:
+    """
+    Get the invites or RSVPs of an event.
+
+    :param service: The upstream service, `invites` or `rsvp`.
+    :param key: The key of the list in the upstream response.
+    :param eventId: The id of the event.
+
+    :returns: The invites or RSVPs of the event.
+    :raises UpstreamUnavailable: If the service fails to list them.
+    """
+    # Failures are raised, as an empty list would pass for an event nobody is
+    # invited to
+    return await pagination.get_all_pages(
+        service,
+        f"/api/{service}",
+        key,
+        {"eventId": eventId},
+        ttl=upstream.CACHE_TTLS[service],
+        kind="listing",
+    )
+
+
 @router.get(
     "",
     summary="Get all events",
-    description="Get all events.",
+    description=f"""Get all events, ordered by date and id. They may be filtered by
+    visibility or by organizer, but not both, and by a range of dates. Only the
+    fields listed in `fields` are returned, along with the id. The events come a
+    page at a time, of `limit` or {pagination.MAX_LIMIT} events, and `next` is the
+    cursor of the next page.""",
     responses={
         200: {
             "description": "All the events",
@@ -41,6 +100,12 @@ class EventModel(BaseModel):
                 }
             },
         },
+        400: {
+            "description": "Unknown fields, order or filter combination requested",
+            "content": {
+                "application/json": {"example": {"error": "Unknown fields: color"}}
+            },
+        },
         500: {
             "description": "Internal server error",
             "content": {
@@ -49,18 +114,55 @@ class EventModel(BaseModel):
         },
     },
 )
-async def get_events():
+async def get_events(
+    fields: str = Query(
+        default=None, description="Comma-separated fields to return, e.g. title,date"
+    ),
+    isPublic: bool = Query(default=None, description="Only events of this visibility"),
+    organizer: str = Query(default=None, description="Only events of this organizer"),
+    start: datetime.date = Query(
+        default=None, alias="from", description="Only events on or after this date"
+    ),
+    end: datetime.date = Query(
+        default=None, alias="to", description="Only events on or before this date"
+    ),
+    order: str = Query(
+        default=None, description="`date` (the default) or `-date` for latest first"
+    ),
+    limit: int = Query(
+        default=None,
+        ge=1,
+        le=pagination.MAX_LIMIT,
+        description=f"Number of items per page, {pagination.MAX_LIMIT} by default",
+    ),
+    cursor: str = Query(
+        default=None, description="The `next` cursor of the previous page"
+    ),
+):
     """
     Get events.
     """
     try:
-        response = httpx.get("http://events-service:8000/api/events")
-        return Response(
-            status_code=response.status_code,
-            content=response.content,
-            media_type="application/json",
+        return await streaming.get(
+            "events",
+            "/api/events",
+            params={
+                **({"fields": fields} if fields else {}),
+                **filter_params(
+                    {
+                        "isPublic": isPublic,
+                        "organizer": organizer,
+                        "from": start,
+                        "to": end,
+                        "order": order,
+                    }
+                ),
+                **pagination.page_params(limit, cursor),
+            },
+            ttl=upstream.CACHE_TTLS["events"],
+            kind="listing",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
@@ -71,7 +173,10 @@ async def get_events():
 @router.get(
     "/public",
     summary="Get all public events",
-    description="Get all public events.",
+    description=f"""Get all public events, ordered by date and id, optionally
+    within a range of dates. Only the fields listed in `fields` are returned, along
+    with the id. The events come a page at a time, of `limit` or
+    {pagination.MAX_LIMIT} events, and `next` is the cursor of the next page.""",
     responses={
         200: {
             "description": "All the public events",
@@ -92,6 +197,12 @@ async def get_events():
                 }
             },
         },
+        400: {
+            "description": "Unknown fields, order or filter combination requested",
+            "content": {
+                "application/json": {"example": {"error": "Unknown fields: color"}}
+            },
+        },
         500: {
             "description": "Internal server error",
             "content": {
@@ -100,23 +211,124 @@ async def get_events():
         },
     },
 )
-async def get_public_events():
+async def get_public_events(
+    fields: str = Query(
+        default=None, description="Comma-separated fields to return, e.g. title,date"
+    ),
+    start: datetime.date = Query(
+        default=None, alias="from", description="Only events on or after this date"
+    ),
+    end: datetime.date = Query(
+        default=None, alias="to", description="Only events on or before this date"
+    ),
+    order: str = Query(
+        default=None, description="`date` (the default) or `-date` for latest first"
+    ),
+    limit: int = Query(
+        default=None,
+        ge=1,
+        le=pagination.MAX_LIMIT,
+        description=f"Number of items per page, {pagination.MAX_LIMIT} by default",
+    ),
+    cursor: str = Query(
+        default=None, description="The `next` cursor of the previous page"
+    ),
+):
     """
     Get public events.
     """
     try:
-        response = httpx.get("http://events-service:8000/api/events/public")
+        return await streaming.get(
+            "events",
+            "/api/events/public",
+            params={
+                **({"fields": fields} if fields else {}),
+                **filter_params({"from": start, "to": end, "order": order}),
+                **pagination.page_params(limit, cursor),
+            },
+            ttl=upstream.CACHE_TTLS["events"],
+            kind="listing",
+        )
+    except httpx.TransportError:
         return Response(
-            status_code=response.status_code,
-            content=response.content,
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=json.dumps({"error": "Internal server error"}),
+            media_type="application/json",
+        )
+
+
+@router.post(
+    "/lookup",
+    summary="Get events by ID",
+    description=f"""Get up to {MAX_LOOKUP} events by their ids in one round trip.
+    The events are returned in the order of the ids, each once, and the ids of
+    events that do not exist are listed in `missing`. Only the fields listed in
+    `fields` are returned, along with the id.""",
+    responses={
+        200: {
+            "description": "The events found and the ids not found",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "events": [
+                            {
+                                "id": 1,
+                                "title": "Independence!!!",
+                                "description": "Chase those Ottomans (not the couches) away!",
+                                "date": "1912-11-28",
+                                "organizer": "Ismail Qemali",
+                                "isPublic": True,
+                            }
+                        ],
+                        "missing": [2],
+                    }
+                }
+            },
+        },
+        400: {
+            "description": "Too many ids or unknown fields requested",
+            "content": {
+                "application/json": {
+                    "example": {"error": "A lookup holds at most 5000 ids"}
+                }
+            },
+        },
+        500: {
+            "description": "Internal server error",
+            "content": {
+                "application/json": {"example": {"error": "Internal server error"}}
+            },
+        },
+    },
+)
+async def lookup_events(lookup: LookupModel):
+    if len(lookup.ids) > MAX_LOOKUP:
+        return Response(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=json.dumps({"error": f"A lookup holds at most {MAX_LOOKUP} ids"}),
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    try:
+        response = await upstream.post(
+            "events",
+            "/api/events/lookup",
+            json={
+                "ids": lookup.ids,
+                **({"fields": lookup.fields} if lookup.fields else {}),
+            },
+            kind="lookup",
+        )
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
+    return Response(
+        status_code=response.status_code,
+        content=response.content,
+        media_type="application/json",
+    )
 
 
 @router.get(
@@ -158,18 +370,136 @@ async def get_event(eventId: int):
     Get event by ID.
     """
     try:
-        response = httpx.get(f"http://events-service:8000/api/events/{eventId}")
+        response = await upstream.get(
+            "events",
+            f"/api/events/{eventId}",
+            coalesce=True,
+            ttl=upstream.CACHE_TTLS["events"],
+            kind="lookup",
+        )
+        return streaming.relay(response)
+    except httpx.TransportError:
         return Response(
-            status_code=response.status_code,
-            content=response.content,
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
-    except httpx.ConnectError:
+
+
+@router.get(
+    "/{eventId}/details",
+    summary="Get event details by ID",
+    description="""Get an event together with the users (maybe) going to it. A
+    private event is only visible to its organizer, its invitees and the users the
+    organizer shares their calendar with.""",
+    responses={
+        200: {
+            "description": "The event and its participants",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "event": {
+                            "id": 1,
+                            "title": "Independence!!!",
+                            "description": "Chase those Ottomans (not the couches) away!",
+                            "date": "1912-11-28",
+                            "organizer": "Ismail Qemali",
+                            "isPublic": True,
+                        },
+                        "participants": [
+                            {
+                                "username": "Ismail Qemali",
+                                "status": "YES",
+                                "source": "invite",
+                            }
+                        ],
+                    }
+                }
+            },
+        },
+        403: {
+            "description": "Event not visible to the viewer",
+            "content": {
+                "application/json": {
+                    "example": {"error": "Event not visible to viewer"}
+                }
+            },
+        },
+        404: {
+            "description": "Event not found",
+            "content": {"application/json": {"example": {"error": "Event not found"}}},
+        },
+        500: {
+            "description": "Internal server error",
+            "content": {
+                "application/json": {"example": {"error": "Internal server error"}}
+            },
+        },
+    },
+)
+async def get_event_details(
+    eventId: int,
+    viewer: str = Query(default=None, description="User viewing the event"),
+):
+    """
+    Get event details by ID.
+    """
+    try:
+        response = await upstream.get(
+            "events",
+            f"/api/events/{eventId}",
+            coalesce=True,
+            ttl=upstream.CACHE_TTLS["events"],
+            kind="lookup",
+        )
+        if response.status_code != 200:
+            return Response(
+                status_code=response.status_code,
+                content=response.content,
+                media_type="application/json",
+            )
+        event = response.json()["event"]
+
+        # The invites tell whether the viewer is invited, so they are always needed
+
+        lookups = {"invites": get_participants("invites", "invites", eventId)}
+        if event["isPublic"]:
+            lookups["responses"] = get_participants("rsvp", "responses", eventId)
+        elif viewer is not None and viewer != event["organizer"]:
+            lookups["shared"] = checks.shares_calendar(event["organizer"], viewer)
+        results = dict(zip(lookups, await asyncio.gather(*lookups.values())))
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
+    invites = results["invites"]
+    if not (
+        event["isPublic"]
+        or viewer == event["organizer"]
+        or results.get("shared")
+        or any(invite["username"] == viewer for invite in invites)
+    ):
+        return Response(
+            status_code=status.HTTP_403_FORBIDDEN,
+            content=json.dumps({"error": "Event not visible to viewer"}),
+            media_type="application/json",
+        )
+    participants = [
+        {"username": row["username"], "status": row["status"], "source": source}
+        for rows, source in (
+            (invites, "invite"),
+            (results.get("responses", []), "rsvp"),
+        )
+        for row in rows
+        if row["status"] in ATTENDING
+    ]
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=json.dumps({"event": event, "participants": participants}),
+        media_type="application/json",
+    )
 
 
 @router.post(
@@ -212,31 +542,48 @@ async def create_event(event: EventModel):
     # Check if the organizer is valid
 
     try:
-        response = httpx.get(
-            f"http://auth-service:8000/api/users?username={event.organizer}"
-        )
-    except httpx.ConnectError:
+        organizer_exists = await checks.user_exists(event.organizer)
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
-    if response.status_code == 200:
-        response = httpx.post(
-            "http://events-service:8000/api/events",
-            json={
-                "title": event.title,
-                "description": event.description,
-                "date": str(event.date),
-                "organizer": event.organizer,
-                "isPublic": event.isPublic,
-            },
-        )
-        return Response(
-            status_code=response.status_code,
-            content=response.content,
-            media_type="application/json",
-        )
+    if organizer_exists:
+        response = None
+        try:
+            response = await upstream.post(
+                "events",
+                "/api/events",
+                json={
+                    "title": event.title,
+                    "description": event.description,
+                    "date": str(event.date),
+                    "organizer": event.organizer,
+                    "isPublic": event.isPublic,
+                },
+            )
+            return Response(
+                status_code=response.status_code,
+                content=response.content,
+                media_type="application/json",
+            )
+        except httpx.TransportError:
+            return Response(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                content=json.dumps({"error": "Internal server error"}),
+                media_type="application/json",
+            )
+        finally:
+            # The event may have been created even if its response was lost, and
+            # a lookup of its id may have cached a 404
+            upstream.cache.invalidate("events", "/api/events", "/api/events/public")
+            if response is None:
+                upstream.cache.invalidate_missing("events")
+            elif response.status_code == 201:
+                upstream.cache.invalidate(
+                    "events", f"/api/events/{response.json()['event']['id']}"
+                )
     return Response(
         status_code=status.HTTP_404_NOT_FOUND,
         content=json.dumps({"error": "Organizer not found"}),
@@ -272,6 +619,12 @@ async def create_event(event: EventModel):
                 "application/json": {"example": {"error": "Organizer not found"}}
             },
         },
+        412: {
+            "description": "Event modified since the ETag was read",
+            "content": {
+                "application/json": {"example": {"error": "Event has been modified"}}
+            },
+        },
         500: {
             "description": "Internal server error",
             "content": {
@@ -280,36 +633,49 @@ async def create_event(event: EventModel):
         },
     },
 )
-async def modify_event(eventId: int, event: EventModel):
+async def modify_event(
+    eventId: int,
+    event: EventModel,
+    if_match: str = Header(
+        default=None, description="Only update if the ETag still matches"
+    ),
+):
     """
     Update an event by its id.
     """
     try:
-        response = httpx.get(
-            f"http://auth-service:8000/api/users?username={event.organizer}"
-        )
-    except httpx.ConnectError:
+        organizer_exists = await checks.user_exists(event.organizer)
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
-    if response.status_code == 200:
-        response = httpx.put(
-            f"http://events-service:8000/api/events/{eventId}",
-            json={
-                "title": event.title,
-                "description": event.description,
-                "date": str(event.date),
-                "organizer": event.organizer,
-                "isPublic": event.isPublic,
-            },
-        )
-        return Response(
-            status_code=response.status_code,
-            content=response.content,
-            media_type="application/json",
-        )
+    if organizer_exists:
+        try:
+            response = await upstream.put(
+                "events",
+                f"/api/events/{eventId}",
+                json={
+                    "title": event.title,
+                    "description": event.description,
+                    "date": str(event.date),
+                    "organizer": event.organizer,
+                    "isPublic": event.isPublic,
+                },
+                headers={"If-Match": if_match} if if_match else None,
+            )
+            return streaming.relay(response)
+        except httpx.TransportError:
+            return Response(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                content=json.dumps({"error": "Internal server error"}),
+                media_type="application/json",
+            )
+        finally:
+            upstream.cache.invalidate(
+                "events", f"/api/events/{eventId}", "/api/events", "/api/events/public"
+            )
     return Response(
         status_code=status.HTTP_404_NOT_FOUND,
         content=json.dumps({"error": "Organizer not found"}),
@@ -343,15 +709,19 @@ async def delete_event(eventId: int):
     Delete an event by its id.
     """
     try:
-        response = httpx.delete(f"http://events-service:8000/api/events/{eventId}")
+        response = await upstream.delete("events", f"/api/events/{eventId}")
         return Response(
             status_code=response.status_code,
             content=response.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
+    finally:
+        upstream.cache.invalidate(
+            "events", f"/api/events/{eventId}", "/api/events", "/api/events/public"
+        )
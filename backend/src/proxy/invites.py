@@ -1,8 +1,13 @@
+import asyncio
 import enum
 import json
 
+import checks
 import httpx
-from fastapi import APIRouter, Query, Response, status
+import pagination
+import streaming
+import upstream
+from fastapi import APIRouter, Header, Query, Response, status
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -26,29 +31,33 @@ class DeleteInviteModel(BaseModel):
     username: str
 
 
-def check_user_exists(username: str):
-    try:
-        response = httpx.get(f"http://auth-service:8000/api/users?username={username}")
-        return response.status_code == 200
-    except httpx.ConnectError:
-        return False
+class StatusModel(BaseModel):
+    status: INVITE_STATUS
 
 
-def check_event_exists(eventId: int):
-    try:
-        response = httpx.get(f"http://events-service:8000/api/events/{eventId}")
-        return response.status_code == 200
-    except httpx.ConnectError:
-        return False
+class BulkInviteeModel(BaseModel):
+    username: str
+    status: INVITE_STATUS = INVITE_STATUS.PENDING
+
+
+class BulkInviteModel(BaseModel):
+    eventId: int
+    invites: list[BulkInviteeModel]
+
+
+# The most invites of a bulk request, no more than invites-service accepts
+MAX_BULK_INVITES = upstream.get_env_int("PROXY_MAX_BULK_INVITES", 1000)
 
 
 @router.get(
     "",
     summary="Get invites",
-    description="""Get invites by user and event ID. 
+    description=f"""Get invites by user and event ID. 
     If no parameters are provided, all invites will be returned. 
     If only one parameter is provided, 
-    invites will be filtered by that parameter.""",
+    invites will be filtered by that parameter.
+    Listings come a page at a time, of `limit` or {pagination.MAX_LIMIT} invites,
+    and `next` is the cursor of the next page.""",
     responses={
         200: {
             "description": "Invites",
@@ -71,20 +80,30 @@ def check_event_exists(eventId: int):
 async def get_invite(
     username: str = Query(default=None, description="User's username"),
     eventId: int = Query(default=None, description="Event's ID"),
+    limit: int = Query(
+        default=None,
+        ge=1,
+        le=pagination.MAX_LIMIT,
+        description=f"Number of items per page, {pagination.MAX_LIMIT} by default",
+    ),
+    cursor: str = Query(
+        default=None, description="The `next` cursor of the previous page"
+    ),
 ):
-    params = {}
+    params = pagination.page_params(limit, cursor)
     if username:
         params["username"] = username
     if eventId:
         params["eventId"] = eventId
     try:
-        response = httpx.get("http://invites-service:8000/api/invites", params=params)
-        return Response(
-            status_code=response.status_code,
-            content=response.content,
-            media_type="application/json",
+        return await streaming.get(
+            "invites",
+            "/api/invites",
+            params=params,
+            ttl=upstream.CACHE_TTLS["invites"],
+            kind="listing",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
@@ -126,22 +145,22 @@ async def get_invite(
 async def create_invite(invite: InviteModel):
     # Check if user and event exist
 
-    if not check_user_exists(invite.username):
+    if error := await checks.first_failure(
+        {
+            "User not found": checks.check_user_exists(invite.username),
+            "Event not found": checks.check_event_exists(invite.eventId),
+        }
+    ):
         return Response(
             status_code=status.HTTP_404_NOT_FOUND,
-            content=json.dumps({"error": "User not found"}),
-            media_type="application/json",
-        )
-    if not check_event_exists(invite.eventId):
-        return Response(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content=json.dumps({"error": "Event not found"}),
+            content=json.dumps({"error": error}),
             media_type="application/json",
         )
     # Create invite
     try:
-        response = httpx.post(
-            "http://invites-service:8000/api/invites",
+        response = await upstream.post(
+            "invites",
+            "/api/invites",
             json={
                 "eventId": invite.eventId,
                 "username": invite.username,
@@ -153,12 +172,136 @@ async def create_invite(invite: InviteModel):
             content=response.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
+    finally:
+        upstream.cache.invalidate("invites", "/api/invites")
+
+
+@router.post(
+    "/bulk",
+    summary="Create invites to an event",
+    description=f"""Invite up to {MAX_BULK_INVITES} users to an event at once. The
+    event is checked once and the users are looked up together, then all the
+    invites are created in one statement. The result of each invite is `created`,
+    `exists` or `user not found`, in the order of the invites.""",
+    responses={
+        200: {
+            "description": "The result of each invite",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "results": [
+                            {
+                                "eventId": 1,
+                                "username": "john_doe",
+                                "status": "PENDING",
+                                "result": "created",
+                            },
+                            {
+                                "eventId": 1,
+                                "username": "ghost",
+                                "status": "PENDING",
+                                "result": "user not found",
+                            },
+                        ]
+                    }
+                }
+            },
+        },
+        400: {
+            "description": "Too many invites",
+            "content": {
+                "application/json": {
+                    "example": {"error": "At most 1000 invites can be created at once"}
+                }
+            },
+        },
+        404: {
+            "description": "Event not found",
+            "content": {"application/json": {"example": {"error": "Event not found"}}},
+        },
+        500: {
+            "description": "Internal server error",
+            "content": {
+                "application/json": {"example": {"error": "Internal server error"}}
+            },
+        },
+    },
+)
+async def create_invites(bulk: BulkInviteModel):
+    if len(bulk.invites) > MAX_BULK_INVITES:
+        return Response(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=json.dumps(
+                {"error": f"At most {MAX_BULK_INVITES} invites can be created at once"}
+            ),
+            media_type="application/json",
+        )
+    # Check the event and every user concurrently
+    event_exists, users_exist = await asyncio.gather(
+        checks.check_event_exists(bulk.eventId),
+        checks.check_users_exist([invite.username for invite in bulk.invites]),
+    )
+    if not event_exists:
+        return Response(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=json.dumps({"error": "Event not found"}),
+            media_type="application/json",
+        )
+    # Create the invites of the users that exist
+    invites = [invite for invite in bulk.invites if users_exist[invite.username]]
+    rows = iter([])
+    if invites:
+        try:
+            response = await upstream.post(
+                "invites",
+                "/api/invites/bulk",
+                json={
+                    "invites": [
+                        {
+                            "eventId": bulk.eventId,
+                            "username": invite.username,
+                            "status": invite.status.value,
+                        }
+                        for invite in invites
+                    ]
+                },
+            )
+        except httpx.TransportError:
+            response = None
+        finally:
+            upstream.cache.invalidate("invites", "/api/invites")
+        if response is None or response.status_code != 200:
+            return Response(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                content=json.dumps({"error": "Internal server error"}),
+                media_type="application/json",
+            )
+        rows = iter(response.json()["results"])
+    # The service reports on the invites it was sent in order
+    results = [
+        (
+            next(rows)
+            if users_exist[invite.username]
+            else {
+                "eventId": bulk.eventId,
+                "username": invite.username,
+                "status": invite.status.value,
+                "result": "user not found",
+            }
+        )
+        for invite in bulk.invites
+    ]
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=json.dumps({"results": results}),
+        media_type="application/json",
+    )
 
 
 @router.put(
@@ -180,6 +323,12 @@ async def create_invite(invite: InviteModel):
                 }
             },
         },
+        412: {
+            "description": "Invite modified since the ETag was read",
+            "content": {
+                "application/json": {"example": {"error": "Invite has been modified"}}
+            },
+        },
         500: {
             "description": "Internal server error",
             "content": {
@@ -188,27 +337,117 @@ async def create_invite(invite: InviteModel):
         },
     },
 )
-async def update_invite(invite: InviteModel):
+async def update_invite(
+    invite: InviteModel,
+    if_match: str = Header(
+        default=None, description="Only update if the ETag still matches"
+    ),
+):
     try:
-        response = httpx.put(
-            "http://invites-service:8000/api/invites",
+        response = await upstream.put(
+            "invites",
+            "/api/invites",
             json={
                 "eventId": invite.eventId,
                 "username": invite.username,
                 "status": invite.status.value,
             },
+            headers={"If-Match": if_match} if if_match else None,
         )
         return Response(
             status_code=response.status_code,
             content=response.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
+    finally:
+        upstream.cache.invalidate("invites", "/api/invites")
+
+
+@router.put(
+    "/{eventId}/{username}",
+    summary="Create or update invite",
+    description="""Invite a user to an event, or set the status of their invite if
+    they were already invited, in one statement.""",
+    responses={
+        200: {
+            "description": "Invite updated",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "invite": {
+                            "eventId": 1,
+                            "username": "john_doe",
+                            "status": "YES",
+                        }
+                    }
+                }
+            },
+        },
+        201: {
+            "description": "Invite created",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "invite": {
+                            "eventId": 1,
+                            "username": "john_doe",
+                            "status": "PENDING",
+                        }
+                    }
+                }
+            },
+        },
+        404: {
+            "description": "User or event not found",
+            "content": {"application/json": {"example": {"error": "User not found"}}},
+        },
+        500: {
+            "description": "Internal server error",
+            "content": {
+                "application/json": {"example": {"error": "Internal server error"}}
+            },
+        },
+    },
+)
+async def put_invite(eventId: int, username: str, invite: StatusModel):
+    # Check if user and event exist
+
+    if error := await checks.first_failure(
+        {
+            "User not found": checks.check_user_exists(username),
+            "Event not found": checks.check_event_exists(eventId),
+        }
+    ):
+        return Response(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=json.dumps({"error": error}),
+            media_type="application/json",
+        )
+    try:
+        response = await upstream.put(
+            "invites",
+            f"/api/invites/{eventId}/{username}",
+            json={"status": invite.status.value},
+        )
+        return Response(
+            status_code=response.status_code,
+            content=response.content,
+            media_type="application/json",
+        )
+    except httpx.TransportError:
+        return Response(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=json.dumps({"error": "Internal server error"}),
+            media_type="application/json",
+        )
+    finally:
+        upstream.cache.invalidate("invites", "/api/invites")
 
 
 @router.delete(
@@ -230,17 +469,20 @@ async def update_invite(invite: InviteModel):
 )
 async def delete_invite(eventId: int, username: str):
     try:
-        response = httpx.delete(
-            f"http://invites-service:8000/api/invites/{eventId}/{username}",
+        response = await upstream.delete(
+            "invites",
+            f"/api/invites/{eventId}/{username}",
         )
         return Response(
             status_code=response.status_code,
             content=response.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
-        )
\ No newline at end of file
+        )
+    finally:
+        upstream.cache.invalidate("invites", "/api/invites")
@@ -0,0 +1,133 @@
+"""
+Prometheus metrics of the proxy.
+"""
+
+import asyncio
+import time
+from typing import Any, Iterator
+
+from anyio import to_thread
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle a request, by route and status.",
+    ["method", "route", "status"],
+)
+
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds",
+    "Time until an upstream service answers one attempt of a request.",
+    ["service", "method", "status"],
+)
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop runs a callback scheduled for a given time.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+
+class RuntimeCollector(Collector):
+    """
+    Reads the threadpool state when the metrics are scraped.
+    """
+
+    def collect(self) -> Iterator[Any]:
+        try:
+            limiter = to_thread.current_default_thread_limiter()
+        except RuntimeError:
+            # Scraped outside of the event loop
+            return
+        statistics = limiter.statistics()
+        yield GaugeMetricFamily(
+            "threadpool_threads_in_use",
+            "Worker threads running synchronous handlers and calls.",
+            value=statistics.borrowed_tokens,
+        )
+        yield GaugeMetricFamily(
+            "threadpool_tasks_waiting",
+            "Tasks queued for a free worker thread.",
+            value=statistics.tasks_waiting,
+        )
+
+
+REGISTRY.register(RuntimeCollector())
+
+
+async def monitor_loop_lag(interval: float = 0.5) -> None:
+    """
+    Measure how late the event loop wakes up from a sleep, forever.
+
+    :param interval: Seconds between two measurements.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+
+def route_template(scope: Scope) -> str:
+    """
+    Return the template of the route that handled a request, such as
+    `/events/{eventId}`.
+
+    The router puts the route it matched in the scope. A route of an included
+    router only knows its path within that router, so the segments of the request
+    path before it, which are the prefix of the router, are put back in front.
+
+    :param scope: The ASGI scope of the request, after routing.
+
+    :returns: The route template, or `unmatched` if no route matched.
+    """
+    if (route_path := getattr(scope.get("route"), "path", None)) is None:
+        return "unmatched"
+    segments = scope["path"].removeprefix(scope.get("root_path", "")).split("/")
+    prefix = segments[: max(0, len(segments) - route_path.count("/"))]
+    return "/".join(prefix) + route_path
+
+
+class MetricsMiddleware:
+    """
+    Record the latency of every request by method, route template and status.
+
+    Requests that match no route are grouped under one label, so unknown paths
+    cannot grow the number of series.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_LATENCY.labels(
+                scope["method"], route_template(scope), status
+            ).observe(time.perf_counter() - started)
+
+
+def metrics_response() -> Response:
+    """
+    Return every metric in the Prometheus text format.
+
+    :returns: The response to a scrape.
+    """
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,62 @@
+"""
+Paginated listings of the services, whose query parameters are passed through,
+and which the proxy reads whole where it needs every row.
+"""
+
+from typing import Any
+
+import upstream
+from breaker import UpstreamUnavailable
+
+# The largest page the services return
+MAX_LIMIT = 1000
+
+
+def page_params(limit: int | None, cursor: str | None) -> dict[str, Any]:
+    """
+    Build the query parameters that select a page of a listing upstream.
+
+    :param limit: The number of items in a page, if the listing is paginated.
+    :param cursor: The `next` cursor of the previous page, if any.
+
+    :returns: The parameters to send upstream, without the ones not given.
+    """
+    params: dict[str, Any] = {}
+    if limit is not None:
+        params["limit"] = limit
+    if cursor is not None:
+        params["cursor"] = cursor
+    return params
+
+
+async def get_all_pages(
+    service: str, path: str, key: str, params: dict[str, Any], **kwargs: Any
+) -> list[dict]:
+    """
+    Read a whole listing upstream, following the `next` cursors of its pages.
+
+    :param service: The name of the upstream service.
+    :param path: The path of the listing, relative to the service base URL.
+    :param key: The key of the list in the upstream response.
+    :param params: The query parameters that select the listing.
+    :param kwargs: Extra arguments forwarded to `upstream.get`.
+
+    :returns: The rows of every page, in order.
+    :raises httpx.TransportError: If the upstream service is unreachable or too slow.
+    :raises UpstreamUnavailable: If the service fails to return a page.
+    """
+    rows: list[dict] = []
+    cursor = None
+    while True:
+        response = await upstream.get(
+            service,
+            path,
+            params={**params, **page_params(MAX_LIMIT, cursor)},
+            **kwargs,
+        )
+        if response.status_code != 200:
+            raise UpstreamUnavailable(service)
+        page = response.json()
+        rows.extend(page[key])
+        if not (cursor := page.get("next")):
+            return rows
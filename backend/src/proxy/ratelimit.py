@@ -0,0 +1,224 @@
+"""
+Token-bucket rate limiting of the requests sent to the proxy.
+"""
+
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any
+
+import upstream
+from fastapi import Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Routes whose upstream work is expensive, such as hashing passwords
+AUTH_ROUTES = ("/auth/login", "/auth/register")
+
+# Routes that are never limited, such as the container health check, or whose
+# sub-requests are limited instead
+EXEMPT_ROUTES = ("/health", "/metrics", "/batch")
+
+# Addresses of the reverse proxies whose `X-Forwarded-For` is trusted, from the
+# comma-separated `PROXY_TRUSTED_PROXIES`
+TRUSTED_PROXIES = frozenset(
+    address.strip()
+    for address in os.getenv("PROXY_TRUSTED_PROXIES", "").split(",")
+    if address.strip()
+)
+
+
+class TokenBuckets:
+    """
+    One token bucket per key, refilled lazily when the key is next seen.
+
+    At most `max_keys` buckets are kept. The least recently used one is dropped
+    first, which at worst lets an idle client start again with a full bucket.
+
+    :param rate: Tokens added to a bucket per second.
+    :param burst: The capacity of a bucket.
+    :param max_keys: The number of buckets to keep.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # Tokens left in each bucket and when they were counted
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+
+    def take(self, key: str) -> tuple[bool, float]:
+        """
+        Take a token from the bucket of a key.
+
+        :param key: The client the request is counted against.
+
+        :returns: Whether the request is allowed, and the tokens left.
+        """
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+            self.allowed += 1
+        else:
+            self.rejected += 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    def seconds_until(self, tokens: float, needed: float) -> int:
+        """
+        Return how long a bucket takes to hold a number of tokens.
+
+        :param tokens: The tokens in the bucket now.
+        :param needed: The tokens the bucket should hold.
+
+        :returns: The delay in whole seconds, rounded up.
+        """
+        return max(0, math.ceil((needed - tokens) / self.rate))
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
+
+
+def get_buckets(route_class: str, per_minute: int, burst: int) -> TokenBuckets | None:
+    """
+    Build the buckets of a class of routes.
+
+    The defaults can be overridden with `PROXY_RATE_<CLASS>_PER_MINUTE` and
+    `PROXY_RATE_<CLASS>_BURST`. A rate of 0 turns limiting off for the class.
+
+    :param route_class: The name of the class of routes.
+    :param per_minute: The default number of requests allowed per minute.
+    :param burst: The default number of requests allowed at once.
+
+    :returns: The buckets, or None if the class is not limited.
+    """
+    prefix = f"PROXY_RATE_{route_class.upper()}"
+    if not (per_minute := upstream.get_env_int(f"{prefix}_PER_MINUTE", per_minute)):
+        return None
+    return TokenBuckets(
+        rate=per_minute / 60,
+        burst=upstream.get_env_int(f"{prefix}_BURST", burst),
+        max_keys=upstream.get_env_int("PROXY_RATE_MAX_KEYS", 10000),
+    )
+
+
+LIMITS = {
+    "auth": get_buckets("auth", per_minute=60, burst=20),
+    "write": get_buckets("write", per_minute=120, burst=60),
+    "read": get_buckets("read", per_minute=600, burst=200),
+}
+
+
+def route_path(scope: Scope) -> str:
+    """
+    Return the path of the route a request is for, without the `/api` root path.
+
+    :param scope: The ASGI scope of the request.
+
+    :returns: The path, such as `/health`.
+    """
+    path, root = scope["path"], scope.get("root_path", "")
+    if root and (path == root or path.startswith(root + "/")):
+        path = path[len(root) :]
+    return path
+
+
+def route_class(method: str, path: str) -> str:
+    """
+    Return the class of routes a request belongs to.
+
+    :param method: The HTTP method of the request.
+    :param path: The path of the route, as returned by `route_path`.
+
+    :returns: `auth`, `write` or `read`.
+    """
+    if path in AUTH_ROUTES:
+        return "auth"
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    return "write"
+
+
+def client_key(scope: Scope) -> str:
+    """
+    Identify the client a request is counted against.
+
+    Requests are counted against the address of the peer. If the peer is a
+    trusted proxy, the address it forwarded the request for is used instead, the
+    last one in `X-Forwarded-For` that is not itself a trusted proxy. Headers and
+    parameters that the client chooses freely, such as `X-User`, are never used.
+
+    :param scope: The ASGI scope of the request.
+
+    :returns: A key such as `ip:10.0.0.2`.
+    """
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if address in TRUSTED_PROXIES:
+        forwarded = ",".join(Headers(scope=scope).getlist("x-forwarded-for"))
+        for hop in reversed([hop.strip() for hop in forwarded.split(",")]):
+            if not hop:
+                continue
+            address = hop
+            if hop not in TRUSTED_PROXIES:
+                break
+    return f"ip:{address}"
+
+
+class RateLimitMiddleware:
+    """
+    Reject requests over the rate of their client and class of routes with 429.
+
+    Every limited response carries `RateLimit-Limit`, `RateLimit-Remaining` and
+    `RateLimit-Reset`, and rejections also carry `Retry-After`.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or route_path(scope) in EXEMPT_ROUTES:
+            await self.app(scope, receive, send)
+            return
+        name = route_class(scope["method"], route_path(scope))
+        if (buckets := LIMITS[name]) is None:
+            await self.app(scope, receive, send)
+            return
+        allowed, tokens = buckets.take(f"{name}:{client_key(scope)}")
+        headers = {
+            "RateLimit-Limit": str(buckets.burst),
+            "RateLimit-Remaining": str(int(tokens)),
+            "RateLimit-Reset": str(buckets.seconds_until(tokens, buckets.burst)),
+        }
+        if not allowed:
+            response = Response(
+                status_code=429,
+                content=json.dumps({"error": "Too many requests"}),
+                media_type="application/json",
+                headers={
+                    "Retry-After": str(buckets.seconds_until(tokens, 1)),
+                    **headers,
+                },
+            )
+            await response(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).update(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,163 @@
+"""
+Replicas of the upstream services, with load balancing and health checks.
+"""
+
+import asyncio
+import random
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import httpx
+
+
+class Replica:
+    """
+    One instance of an upstream service, reached through its own pooled client.
+
+    A replica is ejected from balancing after `ReplicaPool.fall` failed health
+    checks or transport errors in a row, and admitted again after `ReplicaPool.rise`
+    successful health checks in a row.
+    """
+
+    def __init__(self, url: str, client: httpx.AsyncClient):
+        self.url = url
+        self.client = client
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.successes = 0
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """
+        Count a request as outstanding on the replica while it is in flight.
+        """
+        self.outstanding += 1
+        self.requests += 1
+        try:
+            yield
+        finally:
+            self.outstanding -= 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+        }
+
+
+class ReplicaPool:
+    """
+    The replicas of an upstream service.
+
+    Requests go to the less loaded of two healthy replicas picked at random, which
+    spreads load almost as well as always picking the least loaded replica without
+    every request crowding onto the same one.
+
+    :param service: The name of the upstream service.
+    :param replicas: The replicas of the service.
+    :param interval: Seconds between two health checks of a replica.
+    :param timeout: Seconds to wait for a health check.
+    :param fall: Failures in a row after which a replica is ejected.
+    :param rise: Successful health checks in a row after which it is admitted again.
+    """
+
+    def __init__(
+        self,
+        service: str,
+        replicas: list[Replica],
+        interval: float = 5,
+        timeout: float = 1,
+        fall: int = 3,
+        rise: int = 2,
+    ):
+        self.service = service
+        self.replicas = replicas
+        self.interval = interval
+        self.timeout = timeout
+        self.fall = fall
+        self.rise = rise
+        self._checker: asyncio.Task | None = None
+
+    def choose(self) -> Replica:
+        """
+        Pick the replica to send a request to.
+
+        If every replica is ejected, all of them are considered, so the service's
+        circuit breaker rather than the pool decides whether to fail the request.
+
+        :returns: The replica with fewer outstanding requests of two random ones.
+        """
+        candidates = [replica for replica in self.replicas if replica.healthy]
+        if not candidates:
+            candidates = self.replicas
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if first.outstanding <= second.outstanding else second
+
+    def failure(self, replica: Replica) -> None:
+        """
+        Record a failed request or health check of a replica.
+
+        :param replica: The replica that failed.
+        """
+        replica.successes = 0
+        replica.failures += 1
+        if replica.failures >= self.fall:
+            replica.healthy = False
+
+    def success(self, replica: Replica) -> None:
+        """
+        Record a request or health check that a replica handled.
+
+        :param replica: The replica that succeeded.
+        """
+        replica.failures = 0
+        replica.successes += 1
+        if not replica.healthy and replica.successes >= self.rise:
+            replica.healthy = True
+
+    async def check(self, replica: Replica) -> None:
+        """
+        Run one health check against a replica's `/api/health`.
+
+        :param replica: The replica to check.
+        """
+        try:
+            response = await replica.client.get("/api/health", timeout=self.timeout)
+        except httpx.TransportError:
+            self.failure(replica)
+            return
+        if response.status_code == 200:
+            self.success(replica)
+        else:
+            self.failure(replica)
+
+    async def _check_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    def start(self) -> None:
+        """
+        Start checking the health of the replicas in the background.
+        """
+        if self.interval and len(self.replicas) > 1:
+            self._checker = asyncio.ensure_future(self._check_forever())
+
+    async def stop(self) -> None:
+        """
+        Stop the health checks and close the client of every replica.
+        """
+        if self._checker is not None:
+            self._checker.cancel()
+            await asyncio.gather(self._checker, return_exceptions=True)
+            self._checker = None
+        await asyncio.gather(*(replica.client.aclose() for replica in self.replicas))
+
+    def stats(self) -> list[dict[str, Any]]:
+        return [replica.stats() for replica in self.replicas]
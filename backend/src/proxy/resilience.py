@@ -0,0 +1,273 @@
+"""
+Timeouts, retries and hedging of idempotent upstream requests.
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+import httpx
+
+# Statuses that mean the upstream service could not handle the request right now
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+
+
+@dataclass(frozen=True)
+class Policy:
+    """
+    How to send the requests of a group of routes.
+
+    :param connect_timeout: Seconds to wait for a connection.
+    :param read_timeout: Seconds to wait for each read, and for the other phases.
+    :param retries: How many times an idempotent request may be retried.
+    :param backoff: Base delay before a retry, doubled on each attempt.
+    :param max_backoff: Upper bound of the delay before a retry.
+    :param hedge: Send a second request when the first is slower than usual.
+    :param min_hedge_delay: Never hedge earlier than this many seconds.
+    """
+
+    connect_timeout: float = 1.0
+    read_timeout: float = 5.0
+    retries: int = 2
+    backoff: float = 0.05
+    max_backoff: float = 1.0
+    hedge: bool = False
+    min_hedge_delay: float = 0.01
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def delay(self, attempt: int) -> float:
+        """
+        Return the jittered delay before a retry.
+
+        :param attempt: The number of the retry, starting at 1.
+
+        :returns: A delay in seconds, drawn uniformly up to the exponential backoff.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+
+class RetryBudget:
+    """
+    Caps retries and hedges to a fraction of the requests sent.
+
+    Each request deposits `ratio` tokens and each retry or hedge withdraws one, so
+    a failing service gets a bounded amount of extra load instead of a multiple of
+    its traffic. `min_per_second` tokens are also added over time, so retries stay
+    possible when traffic is low.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self.requests = 0
+        self.retries = 0
+        self.hedges = 0
+        self.exhausted = 0
+
+    def _refill(self, tokens: float) -> None:
+        now = time.monotonic()
+        tokens += (now - self._updated) * self.min_per_second
+        self._tokens = min(self.max_tokens, self._tokens + tokens)
+        self._updated = now
+
+    def deposit(self) -> None:
+        """
+        Record a request, which earns a fraction of a retry.
+        """
+        self.requests += 1
+        self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        Take one token for a retry or a hedge.
+
+        :returns: Whether a token was available.
+        """
+        self._refill(0)
+        if self._tokens < 1:
+            self.exhausted += 1
+            return False
+        self._tokens -= 1
+        return True
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Return the budget and how much of it was spent.
+
+        :returns: A dictionary with the retry statistics.
+        """
+        return {
+            "tokens": self._tokens,
+            "requests": self.requests,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "exhausted": self.exhausted,
+        }
+
+
+class LatencyTracker:
+    """
+    Tracks a high percentile of the recent response times of a service.
+
+    The percentile is recomputed every `every` samples, not on every lookup.
+    """
+
+    def __init__(
+        self,
+        window: int = 1000,
+        percentile: float = 0.95,
+        min_samples: int = 20,
+        every: int = 50,
+    ):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.every = every
+        self._samples: deque[float] = deque(maxlen=window)
+        self._pending = 0
+        self._value: float | None = None
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._pending += 1
+        if self._value is None or self._pending >= self.every:
+            self._pending = 0
+            if len(self._samples) >= self.min_samples:
+                ordered = sorted(self._samples)
+                self._value = ordered[int(self.percentile * (len(ordered) - 1))]
+
+    def value(self) -> float | None:
+        """
+        Return the tracked percentile.
+
+        :returns: The percentile in seconds, or None while there are too few samples.
+        """
+        return self._value
+
+
+async def timed(
+    send: Callable[[], Awaitable[httpx.Response]], latency: LatencyTracker
+) -> httpx.Response:
+    started = time.monotonic()
+    response = await send()
+    latency.record(time.monotonic() - started)
+    return response
+
+
+def discard(task: asyncio.Future) -> None:
+    """
+    Cancel an attempt that lost a race, and close its response if it has one.
+
+    :param task: The attempt to discard.
+    """
+
+    def close(done: asyncio.Future) -> None:
+        if not done.cancelled() and done.exception() is None:
+            asyncio.ensure_future(done.result().aclose())
+
+    if task.done():
+        close(task)
+    else:
+        task.cancel()
+        task.add_done_callback(close)
+
+
+async def hedged(
+    send: Callable[[], Awaitable[httpx.Response]],
+    policy: Policy,
+    budget: RetryBudget,
+    latency: LatencyTracker,
+) -> httpx.Response:
+    """
+    Send a request, and a second one if the first takes longer than usual.
+
+    The second request is sent once the first has taken longer than the tracked
+    percentile, and whichever succeeds first is returned.
+
+    :param send: Sends one attempt of the request.
+    :param policy: The policy of the request.
+    :param budget: The budget the second request is taken from.
+    :param latency: The response times of the service.
+
+    :returns: The first successful response.
+    :raises httpx.TransportError: If every attempt failed.
+    """
+    first = asyncio.ensure_future(timed(send, latency))
+    if (delay := latency.value()) is None:
+        return await first
+    attempts = {first}
+    try:
+        done, _ = await asyncio.wait(
+            attempts, timeout=max(delay, policy.min_hedge_delay)
+        )
+        if not done and budget.withdraw():
+            budget.hedges += 1
+            attempts.add(asyncio.ensure_future(timed(send, latency)))
+        error: BaseException | None = None
+        while attempts:
+            done, attempts = await asyncio.wait(
+                attempts, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    done.discard(task)
+                    for other in done:
+                        discard(other)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in attempts:
+            discard(task)
+
+
+async def call(
+    send: Callable[[], Awaitable[httpx.Response]],
+    policy: Policy,
+    budget: RetryBudget,
+    latency: LatencyTracker,
+) -> httpx.Response:
+    """
+    Send an idempotent request under a policy.
+
+    Transport errors and 502, 503 and 504 responses are retried after a jittered
+    backoff, as long as the policy and the retry budget allow it.
+
+    :param send: Sends one attempt of the request.
+    :param policy: The policy of the request.
+    :param budget: The budget retries are taken from.
+    :param latency: The response times of the service.
+
+    :returns: The upstream response.
+    :raises httpx.TransportError: If the last attempt failed.
+    """
+    budget.deposit()
+    attempt = 0
+    while True:
+        response, error = None, None
+        try:
+            if policy.hedge:
+                response = await hedged(send, policy, budget, latency)
+            else:
+                response = await timed(send, latency)
+        except httpx.TransportError as exc:
+            error = exc
+        if response is not None and response.status_code not in RETRYABLE_STATUSES:
+            return response
+        if attempt >= policy.retries or not budget.withdraw():
+            if error is not None:
+                raise error
+            return response
+        if response is not None:
+            await response.aclose()
+        attempt += 1
+        budget.retries += 1
+        await asyncio.sleep(policy.delay(attempt))
@@ -1,8 +1,12 @@
 import enum
 import json
 
+import checks
 import httpx
-from fastapi import APIRouter, Query, Response, status
+import pagination
+import streaming
+import upstream
+from fastapi import APIRouter, Header, Query, Response, status
 from pydantic import BaseModel, Field
 
 router = APIRouter()
@@ -24,29 +28,19 @@ class RsvpResponseModel(BaseModel):
     status: RSVP_STATUS = Field(..., description="Response status")
 
 
-def check_user_exists(username: str):
-    try:
-        response = httpx.get(f"http://auth-service:8000/api/users?username={username}")
-        return response.status_code == 200
-    except httpx.HTTPStatusError:
-        return False
-
-
-def check_public_event_exists(eventId: int):
-    try:
-        response = httpx.get(f"http://events-service:8000/api/events/{eventId}")
-        return response.status_code == 200 and response.json()["event"]["isPublic"]
-    except httpx.HTTPStatusError:
-        return False
+class StatusModel(BaseModel):
+    status: RSVP_STATUS = Field(..., description="Response status")
 
 
 @router.get(
     "",
     summary="Get responses",
-    description="""Get responses by user and event ID.
+    description=f"""Get responses by user and event ID.
             If no parameters are provided, all responses will be returned.
             If only one parameter is provided,
-            responses will be filtered by that parameter.""",
+            responses will be filtered by that parameter.
+            Listings come a page at a time, of `limit` or {pagination.MAX_LIMIT}
+            responses, and `next` is the cursor of the next page.""",
     responses={
         200: {
             "description": "Responses",
@@ -71,23 +65,33 @@ def check_public_event_exists(eventId: int):
 async def get_responses(
     username: str = Query(default=None, description="User's username"),
     eventId: int = Query(default=None, description="Event's ID"),
+    limit: int = Query(
+        default=None,
+        ge=1,
+        le=pagination.MAX_LIMIT,
+        description=f"Number of items per page, {pagination.MAX_LIMIT} by default",
+    ),
+    cursor: str = Query(
+        default=None, description="The `next` cursor of the previous page"
+    ),
 ):
     """
     Get all responses
     """
-    params = {}
+    params = pagination.page_params(limit, cursor)
     if username:
         params["username"] = username
     if eventId:
         params["eventId"] = eventId
     try:
-        response = httpx.get("http://rsvp-service:8000/api/rsvp", params=params)
-        return Response(
-            status_code=response.status_code,
-            content=response.content,
-            media_type="application/json",
+        return await streaming.get(
+            "rsvp",
+            "/api/rsvp",
+            params=params,
+            ttl=upstream.CACHE_TTLS["rsvp"],
+            kind="listing",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
@@ -132,21 +136,23 @@ async def create_response(response: RsvpResponseModel):
     """
     # Check if the user and event exist and are public
 
-    if not check_user_exists(response.username):
-        return Response(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content=json.dumps({"error": "User not found"}),
-            media_type="application/json",
-        )
-    if not check_public_event_exists(response.eventId):
+    if error := await checks.first_failure(
+        {
+            "User not found": checks.check_user_exists(response.username),
+            "Public event not found": checks.check_public_event_exists(
+                response.eventId
+            ),
+        }
+    ):
         return Response(
             status_code=status.HTTP_404_NOT_FOUND,
-            content=json.dumps({"error": "Public event not found"}),
+            content=json.dumps({"error": error}),
             media_type="application/json",
         )
     try:
-        result = httpx.post(
-            "http://rsvp-service:8000/api/rsvp",
+        result = await upstream.post(
+            "rsvp",
+            "/api/rsvp",
             json={
                 "eventId": response.eventId,
                 "username": response.username,
@@ -158,12 +164,14 @@ async def create_response(response: RsvpResponseModel):
             content=result.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
+    finally:
+        upstream.cache.invalidate("rsvp", "/api/rsvp")
 
 
 @router.put(
@@ -183,6 +191,12 @@ async def create_response(response: RsvpResponseModel):
                 }
             },
         },
+        412: {
+            "description": "Response modified since the ETag was read",
+            "content": {
+                "application/json": {"example": {"error": "Response has been modified"}}
+            },
+        },
         500: {
             "description": "Internal server error",
             "content": {
@@ -191,30 +205,125 @@ async def create_response(response: RsvpResponseModel):
         },
     },
 )
-async def update_response(response: RsvpResponseModel):
+async def update_response(
+    response: RsvpResponseModel,
+    if_match: str = Header(
+        default=None, description="Only update if the ETag still matches"
+    ),
+):
     """
     Update response
     """
     try:
-        result = httpx.put(
-            "http://rsvp-service:8000/api/rsvp",
+        result = await upstream.put(
+            "rsvp",
+            "/api/rsvp",
             json={
                 "eventId": response.eventId,
                 "username": response.username,
                 "status": response.status.value,
             },
+            headers={"If-Match": if_match} if if_match else None,
+        )
+        return Response(
+            status_code=result.status_code,
+            content=result.content,
+            media_type="application/json",
+        )
+    except httpx.TransportError:
+        return Response(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=json.dumps({"error": "Internal server error"}),
+            media_type="application/json",
+        )
+    finally:
+        upstream.cache.invalidate("rsvp", "/api/rsvp")
+
+
+@router.put(
+    "/{eventId}/{username}",
+    summary="Create or update response",
+    description="""Respond to a public event, or change the response if the user
+    already responded, in one statement.""",
+    responses={
+        200: {
+            "description": "Response updated",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "response": {
+                            "eventId": 1,
+                            "username": "john_doe",
+                            "status": "YES",
+                        }
+                    }
+                }
+            },
+        },
+        201: {
+            "description": "Response created",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "response": {
+                            "eventId": 1,
+                            "username": "john_doe",
+                            "status": "MAYBE",
+                        }
+                    }
+                }
+            },
+        },
+        404: {
+            "description": "User or event not found",
+            "content": {
+                "application/json": {"example": {"error": "Public event not found"}}
+            },
+        },
+        500: {
+            "description": "Internal server error",
+            "content": {
+                "application/json": {"example": {"error": "Internal server error"}}
+            },
+        },
+    },
+)
+async def put_response(eventId: int, username: str, response: StatusModel):
+    """
+    Create or update response
+    """
+    # Check if the user and event exist and are public
+
+    if error := await checks.first_failure(
+        {
+            "User not found": checks.check_user_exists(username),
+            "Public event not found": checks.check_public_event_exists(eventId),
+        }
+    ):
+        return Response(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=json.dumps({"error": error}),
+            media_type="application/json",
+        )
+    try:
+        result = await upstream.put(
+            "rsvp",
+            f"/api/rsvp/{eventId}/{username}",
+            json={"status": response.status.value},
         )
         return Response(
             status_code=result.status_code,
             content=result.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
+    finally:
+        upstream.cache.invalidate("rsvp", "/api/rsvp")
 
 
 @router.delete(
@@ -247,15 +356,17 @@ async def delete_response(eventId: int, username: str):
     Delete response
     """
     try:
-        result = httpx.delete(f"http://rsvp-service:8000/api/rsvp/{eventId}/{username}")
+        result = await upstream.delete("rsvp", f"/api/rsvp/{eventId}/{username}")
         return Response(
             status_code=result.status_code,
             content=result.content,
             media_type="application/json",
         )
-    except httpx.ConnectError:
+    except httpx.TransportError:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": "Internal server error"}),
             media_type="application/json",
         )
+    finally:
+        upstream.cache.invalidate("rsvp", "/api/rsvp")
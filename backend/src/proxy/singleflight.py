@@ -0,0 +1,62 @@
+"""
+Coalescing of concurrent identical upstream requests.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time and share its outcome with every caller
+    that asks for the same key while it is in flight.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Call `fn` unless a call for `key` is already in flight, and wait for it.
+
+        The shared call is shielded, so a caller that gets cancelled does not cancel
+        it for the other callers.
+
+        :param key: The key identifying identical calls.
+        :param fn: The coroutine function to call.
+
+        :returns: The result of the shared call.
+        :raises Exception: Whatever the shared call raised.
+        """
+        if (call := self._calls.get(key)) is not None:
+            self.followers += 1
+        else:
+            self.leaders += 1
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(call)
+
+    def _forget(self, key: Hashable, call: asyncio.Future) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.cancelled():
+            # Mark the exception as retrieved if every caller went away
+            call.exception()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Return how many calls were made and how many were served by a shared call.
+
+        :returns: A dictionary with the call counts and the collapse ratio.
+        """
+        calls = self.leaders + self.followers
+        return {
+            "calls": calls,
+            "upstream_calls": self.leaders,
+            "coalesced_calls": self.followers,
+            "in_flight": len(self._calls),
+            "collapse_ratio": self.followers / calls if calls else 0.0,
+        }
@@ -0,0 +1,154 @@
+"""
+Streaming pass-through of upstream responses.
+"""
+
+import time
+from typing import Any, AsyncIterator
+
+import conditional
+import httpx
+import upstream
+from cache import decoded_headers
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+# Headers that describe a single connection or the encoded body, which is relayed
+# decoded, or that the server sets again
+NOT_RELAYED = frozenset(
+    {
+        "connection",
+        "content-encoding",
+        "content-length",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+        "date",
+        "server",
+    }
+)
+
+
+def relay_headers(headers: httpx.Headers) -> dict[str, str]:
+    """
+    Return the upstream headers that should be relayed to the client.
+
+    :param headers: The headers of the upstream response.
+
+    :returns: The end-to-end headers.
+    """
+    return {name: value for name, value in headers.items() if name not in NOT_RELAYED}
+
+
+def relay(response: httpx.Response) -> Response:
+    """
+    Relay a buffered upstream response with its status, headers and body.
+
+    :param response: The upstream response, already read.
+
+    :returns: The response to send to the client.
+    """
+    return Response(
+        status_code=response.status_code,
+        content=response.content,
+        headers=relay_headers(response.headers),
+    )
+
+
+async def relay_body(
+    response: httpx.Response, key: tuple, ttl: float, started: float
+) -> AsyncIterator[bytes]:
+    """
+    Yield the body of an upstream response chunk by chunk, then close it.
+
+    Each chunk is only read once the previous one has been sent, so a slow client
+    slows down the upstream read instead of filling the proxy's memory. Small
+    bodies are also kept and stored in the response cache once complete.
+
+    :param response: The upstream response, opened in streaming mode.
+    :param key: The cache key of the request.
+    :param ttl: The time to live of the cache entry, or 0 to not cache.
+    :param started: The monotonic time at which the request was sent.
+    """
+    chunks: list[bytes] | None = [] if ttl else None
+    size = 0
+    try:
+        async for chunk in response.aiter_bytes():
+            if chunks is not None:
+                size += len(chunk)
+                if size <= upstream.cache.max_entry_bytes:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+            yield chunk
+    finally:
+        await response.aclose()
+    if chunks is not None:
+        upstream.cache.put(
+            key,
+            httpx.Response(
+                response.status_code,
+                headers=decoded_headers(response.headers),
+                content=b"".join(chunks),
+            ),
+            ttl,
+            started,
+        )
+
+
+async def get(
+    service: str,
+    path: str,
+    ttl: float = 0,
+    kind: str | None = None,
+    **kwargs: Any,
+) -> Response:
+    """
+    Relay a GET request to an upstream service, streaming the response body.
+
+    A fresh response found in the cache is sent as is, and an expired one is
+    revalidated. Otherwise the client's `If-None-Match` is relayed, so upstream can
+    answer 304 without serializing the body.
+
+    :param service: The name of the upstream service.
+    :param path: The path of the request, relative to the service base URL.
+    :param ttl: Serve the response from the cache for this many seconds.
+    :param kind: The kind of route, one of `ROUTE_KINDS`, whose policy to use.
+    :param kwargs: Extra arguments forwarded to `httpx.AsyncClient.build_request`.
+
+    :returns: The response to send to the client.
+    :raises httpx.TransportError: If the upstream service is unreachable or too slow.
+    """
+    key = upstream.request_key(service, path, kwargs.get("params"))
+    if ttl and (cached := upstream.cache.get(key)) is not None:
+        return relay(cached)
+    etag = upstream.cache.validator(key) if ttl else None
+    if validator := etag or conditional.if_none_match.get():
+        kwargs["headers"] = {"If-None-Match": validator}
+    started = time.monotonic()
+    response = await upstream.send(service, "GET", path, kind=kind, **kwargs)
+    if response.status_code == 304:
+        await response.aclose()
+        if (
+            etag
+            and (cached := upstream.cache.revalidate(key, etag, ttl, started))
+            is not None
+        ):
+            return relay(cached)
+        if not etag:
+            return Response(status_code=304, headers=relay_headers(response.headers))
+        # The cached entry went away meanwhile, fetch the body after all
+        del kwargs["headers"]
+        started = time.monotonic()
+        response = await upstream.send(service, "GET", path, kind=kind, **kwargs)
+    return StreamingResponse(
+        relay_body(response, key, ttl, started),
+        status_code=response.status_code,
+        headers=relay_headers(response.headers),
+        # Runs even if the client disconnects before the body is sent
+        background=BackgroundTask(response.aclose),
+    )
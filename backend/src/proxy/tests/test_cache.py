@@ -0,0 +1,202 @@
+"""
+Tests of the response cache, of its invalidation by writes and of how it behaves
+behind gzip-encoding upstream services.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PROXY_WARMUP_CONNECTIONS", "0")
+
+import checks  # noqa: E402
+import httpx  # noqa: E402
+import registry  # noqa: E402
+import upstream  # noqa: E402
+from app import app  # noqa: E402
+from cache import ResponseCache  # noqa: E402
+
+EVENT = {
+    "id": 1,
+    "title": "Independence!!!",
+    "description": "Chase those Ottomans (not the couches) away!" * 40,
+    "date": "1912-11-28",
+    "organizer": "Ismail Qemali",
+    "isPublic": True,
+}
+
+
+def gzip_upstream(request: httpx.Request) -> httpx.Response:
+    """
+    Answer like a service behind `GZipMiddleware`, whatever the request.
+    """
+    if request.url.path == "/api/events":
+        body = {"events": [EVENT] * 10, "next": None}
+    else:
+        body = {"event": EVENT}
+    content = gzip.compress(json.dumps(body).encode())
+    return httpx.Response(
+        200,
+        headers={
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+            "Content-Length": str(len(content)),
+            "ETag": '"v1"',
+        },
+        content=content,
+    )
+
+
+async def get_twice(path: str) -> tuple[httpx.Response, httpx.Response, int]:
+    for service in upstream.UPSTREAMS:
+        client = httpx.AsyncClient(
+            base_url="http://upstream", transport=httpx.MockTransport(gzip_upstream)
+        )
+        upstream.pools[service] = registry.ReplicaPool(
+            service, [registry.Replica("http://upstream", client)]
+        )
+    hits = upstream.cache.hits
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://proxy"
+    ) as client:
+        first = await client.get(path)
+        second = await client.get(path)
+    return first, second, upstream.cache.hits - hits
+
+
+def test_cached_item_is_not_decoded_twice():
+    upstream.cache.invalidate("events", "/api/events/1")
+    first, second, hits = asyncio.run(get_twice("/events/1"))
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json() == {"event": EVENT}
+    assert hits == 1
+
+
+def test_cached_listing_is_not_decoded_twice():
+    upstream.cache.invalidate("events", "/api/events")
+    first, second, hits = asyncio.run(get_twice("/events"))
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json() == {"events": [EVENT] * 10, "next": None}
+    assert hits == 1
+
+
+def cached(cache: ResponseCache, key: tuple, status_code: int = 200, ttl=60):
+    response = httpx.Response(status_code, json={"key": key})
+    cache.put(key, response, ttl, time.monotonic())
+    return cache.get(key) is not None
+
+
+def test_invalidate_drops_every_query_variant_of_a_path():
+    cache = ResponseCache(max_bytes=10000, max_entry_bytes=1000, negative_ttl=5)
+    keys = [
+        ("invites", "/api/invites", ()),
+        ("invites", "/api/invites", (("username", "john_doe"),)),
+        ("invites", "/api/invites/1", ()),
+        ("rsvp", "/api/invites", ()),
+    ]
+    assert all(cached(cache, key) for key in keys)
+    cache.invalidate("invites", "/api/invites")
+    assert [cache.get(key) is not None for key in keys] == [False, False, True, True]
+
+
+def test_responses_that_started_before_an_invalidation_are_not_cached():
+    cache = ResponseCache(max_bytes=10000, max_entry_bytes=1000, negative_ttl=5)
+    key = ("events", "/api/events", ())
+    cached(cache, key)
+    started = time.monotonic()
+    cache.invalidate("events", "/api/events")
+    etag = httpx.Response(200, headers={"ETag": '"v1"'})
+    cache.put(key, etag, 60, started)
+    assert cache.get(key) is None
+    cache.put(key, etag, 60, time.monotonic())
+    assert cache.revalidate(key, '"v1"', 60, started) is None
+    assert cache.get(key) is not None
+
+
+def test_invalidate_missing_drops_only_the_404s_of_a_service():
+    cache = ResponseCache(max_bytes=10000, max_entry_bytes=1000, negative_ttl=5)
+    missing = ("events", "/api/events/7", ())
+    found = ("events", "/api/events/1", ())
+    other = ("auth", "/api/users", (("username", "ghost"),))
+    assert cached(cache, missing, 404)
+    assert cached(cache, found)
+    assert cached(cache, other, 404)
+    cache.invalidate_missing("events")
+    assert cache.get(missing) is None
+    assert cache.get(found) is not None
+    assert cache.get(other) is not None
+
+
+def use_upstream(handler) -> None:
+    for service in upstream.UPSTREAMS:
+        client = httpx.AsyncClient(
+            base_url="http://upstream", transport=httpx.MockTransport(handler)
+        )
+        upstream.pools[service] = registry.ReplicaPool(
+            service, [registry.Replica("http://upstream", client)]
+        )
+
+
+async def send(method: str, path: str, **kwargs) -> httpx.Response:
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://proxy"
+    ) as client:
+        return await client.request(method, path, **kwargs)
+
+
+def created_upstream(request: httpx.Request) -> httpx.Response:
+    """
+    Create event 7, which was not found until then.
+    """
+    if request.method == "POST":
+        return httpx.Response(201, json={"event": {**EVENT, "id": 7}})
+    return httpx.Response(404, json={"error": "Event not found"})
+
+
+def lost_upstream(request: httpx.Request) -> httpx.Response:
+    """
+    Lose the response to a write, which may still have been committed.
+    """
+    if request.method == "GET":
+        return httpx.Response(404, json={"error": "Event not found"})
+    raise httpx.ReadError("connection reset", request=request)
+
+
+def test_creating_an_event_drops_its_cached_404():
+    use_upstream(created_upstream)
+    upstream.cache.invalidate("events", "/api/events/7")
+    key = upstream.request_key("events", "/api/events/7")
+
+    async def create() -> httpx.Response:
+        await upstream.get("events", "/api/events/7", ttl=60)
+        assert upstream.cache.get(key) is not None
+        return await send("POST", "/events", json={**EVENT, "id": None})
+
+    checks.users.add(EVENT["organizer"], True)
+    assert asyncio.run(create()).status_code == 201
+    assert upstream.cache.get(key) is None
+
+
+def test_writes_invalidate_even_when_their_response_is_lost():
+    use_upstream(lost_upstream)
+    checks.users.add(EVENT["organizer"], True)
+    event_key = upstream.request_key("events", "/api/events/8")
+    invites_key = upstream.request_key("invites", "/api/invites")
+
+    async def write() -> list[int]:
+        await upstream.get("events", "/api/events/8", ttl=60)
+        upstream.cache.put(
+            invites_key, httpx.Response(200, json={}), 60, time.monotonic()
+        )
+        return [
+            (await send("POST", "/events", json={**EVENT, "id": None})).status_code,
+            (await send("DELETE", "/invites/1/john_doe")).status_code,
+        ]
+
+    assert asyncio.run(write()) == [500, 500]
+    assert upstream.cache.get(event_key) is None
+    assert upstream.cache.get(invites_key) is None
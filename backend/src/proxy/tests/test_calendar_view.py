@@ -0,0 +1,57 @@
+"""
+Tests of who may see the calendar of a user, whatever the listings behind it do.
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PROXY_WARMUP_CONNECTIONS", "0")
+
+import httpx  # noqa: E402
+import registry  # noqa: E402
+import upstream  # noqa: E402
+from app import app  # noqa: E402
+
+
+def failing_upstream(request: httpx.Request) -> httpx.Response:
+    """
+    Share no calendars, and fail to list invites and RSVPs.
+    """
+    if request.url.path.startswith("/api/shares"):
+        return httpx.Response(404, json={"error": "Calendar not found"})
+    if request.url.path == "/api/events/lookup":
+        return httpx.Response(200, json={"events": []})
+    return httpx.Response(500, json={"error": "database is down"})
+
+
+def get_calendar(viewer: str) -> httpx.Response:
+    for service in upstream.UPSTREAMS:
+        client = httpx.AsyncClient(
+            base_url="http://upstream", transport=httpx.MockTransport(failing_upstream)
+        )
+        upstream.pools[service] = registry.ReplicaPool(
+            service, [registry.Replica("http://upstream", client)]
+        )
+    upstream.cache.invalidate("invites", "/api/invites")
+    upstream.cache.invalidate("rsvp", "/api/rsvp")
+    upstream.cache.invalidate("calendars", "/api/shares/by/john_doe/with/jane_doe")
+
+    async def get() -> httpx.Response:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://proxy"
+        ) as client:
+            return await client.get("/calendar/john_doe", params={"viewer": viewer})
+
+    return asyncio.run(get())
+
+
+def test_a_viewer_without_the_share_is_forbidden_even_if_listings_fail():
+    response = get_calendar("jane_doe")
+    assert response.status_code == 403
+    assert response.json() == {"error": "Calendar not shared with viewer"}
+
+
+def test_the_owner_sees_the_listings_fail():
+    assert get_calendar("john_doe").status_code == 503
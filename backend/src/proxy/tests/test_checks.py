@@ -0,0 +1,81 @@
+"""
+Tests of the cache of which users exist.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PROXY_WARMUP_CONNECTIONS", "0")
+
+import checks  # noqa: E402
+from checks import ExistenceCache  # noqa: E402
+
+
+def existence_cache(monkeypatch, now: list[float], **limits: int) -> ExistenceCache:
+    monkeypatch.setattr(checks.time, "monotonic", lambda: now[0])
+    return ExistenceCache(
+        **{
+            "max_entries": 10,
+            "ttl": 300,
+            "max_negative": 10,
+            "negative_ttl": 5,
+            **limits,
+        }
+    )
+
+
+def test_known_and_unknown_names_are_cached(monkeypatch):
+    cache = existence_cache(monkeypatch, [100.0])
+    assert cache.get("john_doe") is None
+    cache.add("john_doe", True)
+    cache.add("ghost", False)
+    assert cache.get("john_doe") is True
+    assert cache.get("ghost") is False
+    assert cache.stats() == {
+        "known": 1,
+        "unknown": 1,
+        "hits": 2,
+        "misses": 1,
+        "hit_ratio": 2 / 3,
+    }
+
+
+def test_unknown_names_expire_sooner(monkeypatch):
+    now = [100.0]
+    cache = existence_cache(monkeypatch, now)
+    cache.add("john_doe", True)
+    cache.add("ghost", False)
+    now[0] += 5
+    assert cache.get("ghost") is None
+    assert cache.get("john_doe") is True
+    now[0] += 295
+    assert cache.get("john_doe") is None
+    assert cache.stats()["known"] == cache.stats()["unknown"] == 0
+
+
+def test_a_name_is_only_known_or_unknown(monkeypatch):
+    cache = existence_cache(monkeypatch, [100.0])
+    cache.add("jane_doe", False)
+    cache.add("jane_doe", True)
+    assert cache.get("jane_doe") is True
+    assert cache.stats()["unknown"] == 0
+
+
+def test_each_side_evicts_its_least_recently_used_names(monkeypatch):
+    cache = existence_cache(monkeypatch, [100.0], max_entries=2, max_negative=1)
+    cache.add("a", True)
+    cache.add("b", True)
+    cache.get("a")
+    cache.add("c", True)
+    cache.add("x", False)
+    cache.add("y", False)
+    assert [cache.get(name) for name in "abcxy"] == [True, None, True, None, False]
+
+
+def test_discard_forgets_a_name(monkeypatch):
+    cache = existence_cache(monkeypatch, [100.0])
+    cache.add("ghost", False)
+    cache.discard("ghost")
+    cache.discard("never_seen")
+    assert cache.get("ghost") is None
@@ -0,0 +1,81 @@
+"""
+Regression tests of conditional requests through compressed responses.
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PROXY_WARMUP_CONNECTIONS", "0")
+
+import httpx  # noqa: E402
+import registry  # noqa: E402
+import upstream  # noqa: E402
+from app import app  # noqa: E402
+
+EVENT = {
+    "id": 1,
+    "title": "Independence!!!",
+    "description": "Chase those Ottomans (not the couches) away!" * 40,
+    "date": "1912-11-28",
+    "organizer": "Ismail Qemali",
+    "isPublic": True,
+}
+
+
+def strict_upstream(request: httpx.Request) -> httpx.Response:
+    """
+    Answer like events-service, which checks `If-Match` with the strong comparison.
+    """
+    if request.url.path == "/api/users":
+        return httpx.Response(200, json={"user": {"id": 1, "username": "Ismail"}})
+    if request.headers.get("if-none-match") == '"v1"':
+        return httpx.Response(304, headers={"ETag": '"v1"'})
+    if request.method == "PUT" and request.headers.get("if-match") != '"v1"':
+        return httpx.Response(412, json={"error": "Event was modified"})
+    return httpx.Response(200, headers={"ETag": '"v1"'}, json={"event": EVENT})
+
+
+async def round_trip(encoding: str) -> list[httpx.Response]:
+    for service in upstream.UPSTREAMS:
+        client = httpx.AsyncClient(
+            base_url="http://upstream", transport=httpx.MockTransport(strict_upstream)
+        )
+        upstream.pools[service] = registry.ReplicaPool(
+            service, [registry.Replica("http://upstream", client)]
+        )
+    upstream.cache.invalidate("events", "/api/events/1")
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://proxy",
+        headers={"Accept-Encoding": encoding},
+    ) as client:
+        got = await client.get("/events/1")
+        etag = got.headers["etag"]
+        revalidated = await client.get("/events/1", headers={"If-None-Match": etag})
+        updated = await client.put(
+            "/events/1",
+            json={**EVENT, "id": None},
+            headers={"If-Match": etag},
+        )
+    return [got, revalidated, updated]
+
+
+def test_compressed_etag_is_strong_and_per_encoding():
+    got, _, _ = asyncio.run(round_trip("gzip"))
+    assert got.headers["content-encoding"] == "gzip"
+    assert got.headers["etag"] == '"v1-gzip"'
+    assert got.json() == {"event": EVENT}
+
+
+def test_compressed_etag_revalidates():
+    _, revalidated, _ = asyncio.run(round_trip("gzip"))
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == '"v1-gzip"'
+
+
+def test_compressed_etag_updates_conditionally():
+    for encoding in ("gzip", "br"):
+        _, _, updated = asyncio.run(round_trip(encoding))
+        assert updated.status_code == 200, encoding
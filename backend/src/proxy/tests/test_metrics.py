@@ -0,0 +1,71 @@
+"""
+Tests of the route label under which the latency of requests is recorded.
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PROXY_WARMUP_CONNECTIONS", "0")
+
+import httpx  # noqa: E402
+import metrics  # noqa: E402
+import registry  # noqa: E402
+import upstream  # noqa: E402
+from app import app  # noqa: E402
+
+
+def route_of(path: str) -> str:
+    """
+    Request a path from the proxy and return the route label it was recorded under.
+    """
+    routes = []
+    route_template = metrics.route_template
+
+    def record(scope):
+        routes.append(route_template(scope))
+        return routes[-1]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(404, json={"error": "Not found"})
+
+    for service in upstream.UPSTREAMS:
+        client = httpx.AsyncClient(
+            base_url="http://upstream", transport=httpx.MockTransport(handler)
+        )
+        upstream.pools[service] = registry.ReplicaPool(
+            service, [registry.Replica("http://upstream", client)]
+        )
+
+    async def get() -> None:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://proxy"
+        ) as client:
+            await client.get(path)
+
+    metrics.route_template = record
+    try:
+        asyncio.run(get())
+    finally:
+        metrics.route_template = route_template
+    return routes[0]
+
+
+def test_routes_of_included_routers_keep_their_prefix():
+    assert route_of("/events/12") == "/events/{eventId}"
+    assert route_of("/users") == "/users"
+    assert route_of("/health") == "/health"
+
+
+def test_parameters_equal_to_segments_are_not_mistaken_for_them():
+    assert route_of("/shares/by/by/with/with") == (
+        "/shares/by/{username}/with/{receivingUser}"
+    )
+    assert route_of("/shares/by/1/with/1") == (
+        "/shares/by/{username}/with/{receivingUser}"
+    )
+
+
+def test_unknown_paths_share_one_label():
+    assert route_of("/nowhere/12") == "unmatched"
@@ -0,0 +1,124 @@
+"""
+Tests of the token buckets and of how requests are classed and keyed.
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PROXY_WARMUP_CONNECTIONS", "0")
+
+import httpx  # noqa: E402
+import ratelimit  # noqa: E402
+from app import app  # noqa: E402
+from ratelimit import TokenBuckets  # noqa: E402
+
+
+def scope(path: str = "/api/events", client: str = "10.0.0.2", **headers: str):
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "root_path": "/api",
+        "client": (client, 50000),
+        "headers": [
+            (name.replace("_", "-").encode(), value.encode())
+            for name, value in headers.items()
+        ],
+    }
+
+
+def test_bucket_allows_a_burst_then_rejects(monkeypatch):
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: 100.0)
+    buckets = TokenBuckets(rate=1, burst=3, max_keys=10)
+    assert [buckets.take("a")[0] for _ in range(4)] == [True, True, True, False]
+    assert buckets.take("b")[0]
+    assert buckets.stats() == {"keys": 2, "allowed": 4, "rejected": 1}
+
+
+def test_bucket_refills_with_time(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    buckets = TokenBuckets(rate=2, burst=2, max_keys=10)
+    buckets.take("a")
+    allowed, tokens = buckets.take("a")
+    assert allowed and tokens == 0
+    assert not buckets.take("a")[0]
+    assert buckets.seconds_until(0, 1) == 1
+    now[0] += 0.5
+    assert buckets.take("a")[0]
+    now[0] += 60
+    assert buckets.take("a") == (True, 1)
+
+
+def test_bucket_evicts_the_least_recently_used_key(monkeypatch):
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: 100.0)
+    buckets = TokenBuckets(rate=1, burst=1, max_keys=2)
+    buckets.take("a")
+    buckets.take("b")
+    buckets.take("a")
+    buckets.take("c")
+    # b was dropped and starts again with a full bucket, c was not
+    assert buckets.take("b")[0]
+    assert not buckets.take("c")[0]
+
+
+def test_route_path_strips_the_root_path():
+    assert ratelimit.route_path(scope("/api/health")) == "/health"
+    assert ratelimit.route_path(scope("/api")) == ""
+    assert ratelimit.route_path(scope("/apiary/health")) == "/apiary/health"
+
+
+def test_route_class():
+    assert ratelimit.route_class("POST", "/auth/login") == "auth"
+    assert ratelimit.route_class("GET", "/auth/register") == "auth"
+    assert ratelimit.route_class("POST", "/events/auth/login") == "write"
+    assert ratelimit.route_class("GET", "/events") == "read"
+    assert ratelimit.route_class("OPTIONS", "/events") == "read"
+    assert ratelimit.route_class("DELETE", "/events/1") == "write"
+
+
+def test_client_key_is_the_peer():
+    assert ratelimit.client_key(scope()) == "ip:10.0.0.2"
+    assert ratelimit.client_key(scope(x_user="alice")) == "ip:10.0.0.2"
+
+
+def test_client_key_ignores_forwarded_for_from_untrusted_peers(monkeypatch):
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXIES", frozenset({"10.0.0.9"}))
+    key = ratelimit.client_key(scope(x_forwarded_for="1.2.3.4"))
+    assert key == "ip:10.0.0.2"
+
+
+def test_client_key_uses_forwarded_for_from_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(
+        ratelimit, "TRUSTED_PROXIES", frozenset({"10.0.0.9", "10.0.0.8"})
+    )
+    forwarded = "6.6.6.6, 1.2.3.4, 10.0.0.8"
+    key = ratelimit.client_key(scope(client="10.0.0.9", x_forwarded_for=forwarded))
+    assert key == "ip:1.2.3.4"
+    key = ratelimit.client_key(scope(client="10.0.0.9"))
+    assert key == "ip:10.0.0.9"
+
+
+def test_middleware_rejects_over_the_limit_but_not_exempt_routes(monkeypatch):
+    buckets = TokenBuckets(rate=1 / 60, burst=2, max_keys=10)
+    monkeypatch.setitem(ratelimit.LIMITS, "read", buckets)
+
+    async def get(path: str) -> httpx.Response:
+        transport = httpx.ASGITransport(app=app, client=("10.0.0.3", 50000))
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://proxy"
+        ) as client:
+            return await client.get(path)
+
+    async def run() -> list[httpx.Response]:
+        return [await get("/api/nowhere") for _ in range(3)] + [
+            await get("/api/health")
+        ]
+
+    *limited, health = asyncio.run(run())
+    assert [response.status_code for response in limited] == [404, 404, 429]
+    assert limited[0].headers["RateLimit-Remaining"] == "1"
+    assert limited[2].headers["Retry-After"] == "60"
+    assert "RateLimit-Limit" not in health.headers
@@ -0,0 +1,94 @@
+"""
+Tests of the coalescing of concurrent identical calls.
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from singleflight import SingleFlight  # noqa: E402
+
+
+def test_concurrent_calls_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["result"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {
+        "calls": 5,
+        "upstream_calls": 1,
+        "coalesced_calls": 4,
+        "in_flight": 0,
+        "collapse_ratio": 0.8,
+    }
+
+
+def test_other_keys_and_later_calls_are_not_shared():
+    flight = SingleFlight()
+    calls = []
+
+    def fetch(key):
+        async def call():
+            calls.append(key)
+            await asyncio.sleep(0)
+            return key
+
+        return call
+
+    async def main():
+        first = await asyncio.gather(
+            flight.do("a", fetch("a")), flight.do("b", fetch("b"))
+        )
+        return first, await flight.do("a", fetch("a"))
+
+    assert asyncio.run(main()) == (["a", "b"], "a")
+    assert calls == ["a", "b", "a"]
+    assert flight.stats()["coalesced_calls"] == 0
+
+
+def test_every_caller_gets_the_exception():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def main():
+        return await asyncio.gather(
+            *(flight.do("key", fetch) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert [str(result) for result in results] == ["upstream down"] * 3
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_a_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do("key", fetch))
+        follower = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "result"
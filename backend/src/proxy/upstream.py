@@ -0,0 +1,503 @@
+"""
+Pooled asynchronous HTTP clients for the upstream services.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable
+
+import httpx
+import metrics
+import resilience
+import tracing
+from breaker import CircuitBreaker, UpstreamUnavailable
+from cache import ResponseCache
+from registry import Replica, ReplicaPool
+from singleflight import SingleFlight
+
+UPSTREAMS = {
+    "auth": "http://auth-service:8000",
+    "events": "http://events-service:8000",
+    "invites": "http://invites-service:8000",
+    "rsvp": "http://rsvp-service:8000",
+    "calendars": "http://calendars-service:8000",
+}
+
+pools: dict[str, ReplicaPool] = {}
+
+singleflight = SingleFlight()
+
+
+def get_env_int(var: str, default: int) -> int:
+    """
+    Return an environment variable as an integer, or a default if it is not set.
+
+    :param var: The name of the environment variable to retrieve.
+    :param default: The value to return if `var` is not defined or empty.
+
+    :returns: Value of the environment variable `var` as an integer.
+    :raises RuntimeError: If the environment variable `var` is not an integer.
+    """
+    if not (value := os.getenv(var, "")):
+        return default
+    try:
+        return int(value)
+    except ValueError as exc:
+        raise RuntimeError(f"Invalid {var}: {value}") from exc
+
+
+cache = ResponseCache(
+    max_bytes=get_env_int("PROXY_CACHE_MAX_BYTES", 32 * 1024 * 1024),
+    max_entry_bytes=get_env_int("PROXY_CACHE_MAX_ENTRY_BYTES", 1024 * 1024),
+    negative_ttl=get_env_int("PROXY_CACHE_NEGATIVE_TTL", 5),
+)
+
+# Seconds for which each group of routes is served from the cache
+CACHE_TTLS = {
+    "users": get_env_int("PROXY_CACHE_TTL_USERS", 60),
+    "events": get_env_int("PROXY_CACHE_TTL_EVENTS", 10),
+    "shares": get_env_int("PROXY_CACHE_TTL_SHARES", 10),
+    "invites": get_env_int("PROXY_CACHE_TTL_INVITES", 5),
+    "rsvp": get_env_int("PROXY_CACHE_TTL_RSVP", 5),
+}
+
+# Services whose GETs are hedged unless configured otherwise
+HEDGED = ("auth", "events")
+
+# Kinds of routes with a policy of their own, and the settings in which their
+# policy differs from the one of the service by default
+ROUTE_KINDS = {
+    # Reads of a single row by key, such as existence checks on the path of
+    # writes, which are cheap and should fail fast
+    "lookup": {"READ_TIMEOUT_MS": 1000, "HEDGE": 1},
+    # Listings, whose pages can be large and slow to serialize, and which are not
+    # worth doing twice
+    "listing": {"READ_TIMEOUT_MS": 10000, "RETRIES": 1, "HEDGE": 0},
+}
+
+
+def get_policy(service: str, kind: str | None = None) -> resilience.Policy:
+    """
+    Build the policy of the requests sent to an upstream service.
+
+    Each setting is read from `PROXY_<SERVICE>_<SETTING>`, then from
+    `PROXY_<SETTING>`. For a kind of routes, it is first read from
+    `PROXY_<SERVICE>_<KIND>_<SETTING>` and `PROXY_<KIND>_<SETTING>`, then taken
+    from `ROUTE_KINDS`. Durations are given in milliseconds.
+
+    :param service: The name of the upstream service.
+    :param kind: The kind of routes, one of `ROUTE_KINDS`, or None for the others.
+
+    :returns: The policy of the service or of its routes of that kind.
+    """
+
+    def setting(name: str, default: int) -> int:
+        value = get_env_int(
+            f"PROXY_{service.upper()}_{name}", get_env_int(f"PROXY_{name}", default)
+        )
+        if kind is None:
+            return value
+        value = ROUTE_KINDS[kind].get(name, value)
+        return get_env_int(
+            f"PROXY_{service.upper()}_{kind.upper()}_{name}",
+            get_env_int(f"PROXY_{kind.upper()}_{name}", value),
+        )
+
+    return resilience.Policy(
+        connect_timeout=setting("CONNECT_TIMEOUT_MS", 1000) / 1000,
+        read_timeout=setting("READ_TIMEOUT_MS", 5000) / 1000,
+        retries=setting("RETRIES", 2),
+        backoff=setting("BACKOFF_MS", 50) / 1000,
+        max_backoff=setting("MAX_BACKOFF_MS", 1000) / 1000,
+        hedge=bool(setting("HEDGE", int(service in HEDGED))),
+        min_hedge_delay=setting("MIN_HEDGE_DELAY_MS", 10) / 1000,
+    )
+
+
+# The policy of each service and kind of routes, None standing for the other routes
+POLICIES = {
+    (service, kind): get_policy(service, kind)
+    for service in UPSTREAMS
+    for kind in (None, *ROUTE_KINDS)
+}
+
+# Response times are tracked per policy, so that each kind of routes is hedged
+# after its own percentile
+latency = {key: resilience.LatencyTracker() for key in POLICIES}
+
+retry_budget = resilience.RetryBudget(
+    ratio=get_env_int("PROXY_RETRY_BUDGET_PERCENT", 10) / 100,
+    min_per_second=get_env_int("PROXY_RETRY_MIN_PER_SECOND", 5),
+    max_tokens=get_env_int("PROXY_RETRY_BUDGET_MAX", 20),
+)
+
+
+def get_base_urls(service: str) -> list[str]:
+    """
+    Return the base URLs of the replicas of an upstream service.
+
+    They are read from the JSON file named by `PROXY_UPSTREAMS_FILE`, which maps
+    service names to lists of URLs, then from `UPSTREAM_<SERVICE>_URL`, which may
+    list several URLs separated by commas.
+
+    :param service: The name of the upstream service.
+
+    :returns: The base URLs of the replicas of the upstream service.
+    """
+    if path := os.getenv("PROXY_UPSTREAMS_FILE", ""):
+        with open(path, encoding="utf-8") as file:
+            if urls := json.load(file).get(service):
+                return list(urls)
+    if urls := os.getenv(f"UPSTREAM_{service.upper()}_URL", ""):
+        return [url.strip() for url in urls.split(",") if url.strip()]
+    return [UPSTREAMS[service]]
+
+
+def get_limits() -> httpx.Limits:
+    """
+    Build the connection pool limits shared by every upstream client.
+
+    :returns: An httpx Limits object.
+    """
+    return httpx.Limits(
+        max_connections=get_env_int("PROXY_MAX_CONNECTIONS", 100),
+        max_keepalive_connections=get_env_int("PROXY_MAX_KEEPALIVE_CONNECTIONS", 20),
+        keepalive_expiry=get_env_int("PROXY_KEEPALIVE_EXPIRY", 30),
+    )
+
+
+def get_pool(service: str) -> ReplicaPool:
+    """
+    Return the replicas of an upstream service.
+
+    :param service: The name of the upstream service.
+
+    :returns: The replica pool of the service.
+    :raises RuntimeError: If the clients have not been started.
+    """
+    try:
+        return pools[service]
+    except KeyError as exc:
+        raise RuntimeError(f"Upstream client {service} is not started") from exc
+
+
+async def warm_up(replica: Replica, connections: int) -> None:
+    """
+    Open keep-alive connections to a replica ahead of traffic.
+
+    :param replica: The replica of an upstream service.
+    :param connections: The number of connections to open concurrently.
+    """
+    results = await asyncio.gather(
+        *(replica.client.get("/api/health") for _ in range(connections)),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, httpx.Response):
+            await result.aclose()
+
+
+async def probe(service: str) -> bool:
+    """
+    Check whether an upstream service answers its health check.
+
+    :param service: The name of the upstream service.
+
+    :returns: Whether the service is healthy.
+    """
+    replica = get_pool(service).choose()
+    response = await replica.client.get(
+        "/api/health", timeout=POLICIES[service, None].timeout
+    )
+    return response.status_code == 200
+
+
+breakers = {
+    service: CircuitBreaker(
+        service,
+        probe=functools.partial(probe, service),
+        failure_threshold=get_env_int("PROXY_BREAKER_FAILURES", 5),
+        reset_timeout=get_env_int("PROXY_BREAKER_RESET_TIMEOUT", 5),
+    )
+    for service in UPSTREAMS
+}
+
+
+async def inject_traceparent(request: httpx.Request) -> None:
+    """
+    Send the span of the current attempt upstream, so the service continues its
+    trace.
+
+    :param request: The request about to be sent.
+    """
+    if (current := tracing.current_span.get()) is not None:
+        request.headers["traceparent"] = current.traceparent
+
+
+async def startup() -> None:
+    """
+    Create one pooled client per replica of each upstream service, start their
+    health checks and warm up their connections.
+    """
+    limits = get_limits()
+    for service in UPSTREAMS:
+        pools[service] = ReplicaPool(
+            service,
+            [
+                Replica(
+                    url,
+                    httpx.AsyncClient(
+                        base_url=url,
+                        limits=limits,
+                        event_hooks={"request": [inject_traceparent]},
+                    ),
+                )
+                for url in get_base_urls(service)
+            ],
+            interval=get_env_int("PROXY_HEALTH_CHECK_INTERVAL", 5),
+            timeout=get_env_int("PROXY_HEALTH_CHECK_TIMEOUT", 1),
+            fall=get_env_int("PROXY_HEALTH_CHECK_FALL", 3),
+            rise=get_env_int("PROXY_HEALTH_CHECK_RISE", 2),
+        )
+        pools[service].start()
+    if connections := get_env_int("PROXY_WARMUP_CONNECTIONS", 2):
+        await asyncio.gather(
+            *(
+                warm_up(replica, connections)
+                for pool in pools.values()
+                for replica in pool.replicas
+            )
+        )
+
+
+async def shutdown() -> None:
+    """
+    Close every upstream client and its pooled connections.
+    """
+    await asyncio.gather(*(breaker.stop() for breaker in breakers.values()))
+    stopping = list(pools.values())
+    pools.clear()
+    await asyncio.gather(*(pool.stop() for pool in stopping))
+
+
+async def attempt(
+    service: str,
+    method: str,
+    send: Callable[[httpx.AsyncClient], Awaitable[httpx.Response]],
+) -> httpx.Response:
+    """
+    Send one attempt of a request to a replica of an upstream service.
+
+    The replica is picked by the pool of the service, and the attempt goes through
+    the circuit breaker of the service. Each attempt is a span of its own, so the
+    retries and hedges of a request show up separately in its trace.
+
+    :param service: The name of the upstream service.
+    :param method: The HTTP method, for the metrics.
+    :param send: Sends the request with the client of the replica.
+
+    :returns: The upstream response.
+    :raises httpx.TransportError: If the replica is unreachable or too slow.
+    :raises UpstreamUnavailable: If the circuit breaker of the service is open.
+    """
+    pool = get_pool(service)
+    replica = pool.choose()
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with (
+            tracing.span(
+                f"{method} {service}", kind="client", replica=replica.url
+            ) as current,
+            replica.track(),
+        ):
+            try:
+                response = await breakers[service].guard(lambda: send(replica.client))
+            except httpx.TransportError:
+                pool.failure(replica)
+                raise
+            status = str(response.status_code)
+            if current is not None:
+                current.attributes["status"] = response.status_code
+    except UpstreamUnavailable:
+        status = "unavailable"
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        metrics.UPSTREAM_LATENCY.labels(service, method, status).observe(
+            time.perf_counter() - started
+        )
+    pool.success(replica)
+    return response
+
+
+async def request(
+    service: str,
+    method: str,
+    path: str,
+    kind: str | None = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """
+    Send a request to an upstream service over its pooled client.
+
+    Every request gets the timeouts of its policy, and GETs are also retried and
+    hedged as the policy allows.
+
+    :param service: The name of the upstream service.
+    :param method: The HTTP method.
+    :param path: The path of the request, relative to the service base URL.
+    :param kind: The kind of route, one of `ROUTE_KINDS`, whose policy to use.
+    :param kwargs: Extra arguments forwarded to `httpx.AsyncClient.request`.
+
+    :returns: The upstream response.
+    :raises httpx.TransportError: If the upstream service is unreachable or too slow.
+    :raises UpstreamUnavailable: If the circuit breaker of the service is open.
+    """
+    policy = POLICIES[service, kind]
+    kwargs.setdefault("timeout", policy.timeout)
+
+    def send_once() -> Awaitable[httpx.Response]:
+        return attempt(
+            service, method, lambda client: client.request(method, path, **kwargs)
+        )
+
+    if method != "GET":
+        return await send_once()
+    return await resilience.call(
+        send_once, policy, retry_budget, latency[service, kind]
+    )
+
+
+async def send(
+    service: str,
+    method: str,
+    path: str,
+    kind: str | None = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """
+    Send a request to an upstream service without reading the response body.
+
+    The caller must close the response, which returns its connection to the pool.
+    GETs are retried and hedged until their headers arrive, as in `request`.
+
+    :param service: The name of the upstream service.
+    :param method: The HTTP method.
+    :param path: The path of the request, relative to the service base URL.
+    :param kind: The kind of route, one of `ROUTE_KINDS`, whose policy to use.
+    :param kwargs: Extra arguments forwarded to `httpx.AsyncClient.build_request`.
+
+    :returns: The upstream response, with its body still to be streamed.
+    :raises httpx.TransportError: If the upstream service is unreachable or too slow.
+    :raises UpstreamUnavailable: If the circuit breaker of the service is open.
+    """
+    policy = POLICIES[service, kind]
+    kwargs.setdefault("timeout", policy.timeout)
+
+    def send_once() -> Awaitable[httpx.Response]:
+        return attempt(
+            service,
+            method,
+            lambda client: client.send(
+                client.build_request(method, path, **kwargs), stream=True
+            ),
+        )
+
+    if method != "GET":
+        return await send_once()
+    return await resilience.call(
+        send_once, policy, retry_budget, latency[service, kind]
+    )
+
+
+def request_key(service: str, path: str, params: Any = None) -> tuple:
+    """
+    Build a key that identifies a GET request by its service, path and query.
+
+    The query parameters are sorted, so the same query in another order gives the
+    same key.
+
+    :param service: The name of the upstream service.
+    :param path: The path of the request, which may contain a query string.
+    :param params: Extra query parameters of the request.
+
+    :returns: A hashable key for the request.
+    """
+    url = httpx.URL(path)
+    if params:
+        url = url.copy_merge_params(params)
+    return service, url.path, tuple(sorted(url.params.multi_items()))
+
+
+async def get(
+    service: str,
+    path: str,
+    coalesce: bool = False,
+    ttl: float = 0,
+    kind: str | None = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """
+    Send a GET request to an upstream service.
+
+    Only requests whose sole extra argument is `params` are coalesced or cached.
+
+    :param service: The name of the upstream service.
+    :param path: The path of the request, relative to the service base URL.
+    :param coalesce: Share one upstream call between concurrent identical requests.
+    :param ttl: Serve the response from the cache for this many seconds.
+    :param kind: The kind of route, one of `ROUTE_KINDS`, whose policy to use.
+    :param kwargs: Extra arguments forwarded to `httpx.AsyncClient.request`.
+
+    :returns: The upstream response.
+    :raises httpx.TransportError: If the upstream service is unreachable or too slow.
+    """
+    if (not coalesce and not ttl) or set(kwargs) - {"params"}:
+        return await request(service, "GET", path, kind=kind, **kwargs)
+    key = request_key(service, path, kwargs.get("params"))
+    if ttl and (cached := cache.get(key)) is not None:
+        return cached
+
+    async def fetch() -> httpx.Response:
+        started = time.monotonic()
+        if ttl and (etag := cache.validator(key)):
+            # Revalidate the expired entry instead of fetching it again
+            response = await request(
+                service,
+                "GET",
+                path,
+                kind=kind,
+                headers={"If-None-Match": etag},
+                **kwargs,
+            )
+            if response.status_code == 304:
+                if (cached := cache.revalidate(key, etag, ttl, started)) is not None:
+                    return cached
+                response = await request(service, "GET", path, kind=kind, **kwargs)
+        else:
+            response = await request(service, "GET", path, kind=kind, **kwargs)
+        if ttl:
+            cache.put(key, response, ttl, started)
+        return response
+
+    if coalesce:
+        return await singleflight.do(key, fetch)
+    return await fetch()
+
+
+async def post(service: str, path: str, **kwargs: Any) -> httpx.Response:
+    return await request(service, "POST", path, **kwargs)
+
+
+async def put(service: str, path: str, **kwargs: Any) -> httpx.Response:
+    return await request(service, "PUT", path, **kwargs)
+
+
+async def delete(service: str, path: str, **kwargs: Any) -> httpx.Response:
+    return await request(service, "DELETE", path, **kwargs)
@@ -1,4 +1,7 @@
 import httpx
+import pagination
+import streaming
+import upstream
 from fastapi import APIRouter, Query, Response
 from pydantic import BaseModel
 
@@ -17,10 +20,12 @@ class UserModel(BaseModel):
 @router.get(
     "",
     summary="Get user(s)",
-    description="""Get user(s). If no query parameters are provided, 
+    description=f"""Get user(s). If no query parameters are provided, 
     all users are returned. If only one query parameter is provided, 
     the search is filtered by that parameter (username or userId). 
-    If both are provided, the search is done for a specific user.""",
+    If both are provided, the search is done for a specific user.
+    All users are listed a page at a time, of `limit` or {pagination.MAX_LIMIT}
+    users, with `cursor` the `next` cursor of the previous page.""",
     responses={
         200: {
             "description": "User / Users found",
@@ -39,6 +44,15 @@ class UserModel(BaseModel):
 async def get_user(
     user_id: int = Query(default=None),
     username: str = Query(default=None),
+    limit: int = Query(
+        default=None,
+        ge=1,
+        le=pagination.MAX_LIMIT,
+        description=f"Number of items per page, {pagination.MAX_LIMIT} by default",
+    ),
+    cursor: str = Query(
+        default=None, description="The `next` cursor of the previous page"
+    ),
 ):
     """
     Get a user by its id.
@@ -51,17 +65,18 @@ async def get_user(
     If none are provided, all users are returned.
     """
 
-    # If no username or id is provided, return all users
+    # If no username or id is provided, return all users, a page at a time
 
     if not user_id and not username:
         try:
-            response = httpx.get("http://auth-service:8000/api/users")
-            return Response(
-                status_code=response.status_code,
-                content=response.content,
-                media_type="application/json",
+            return await streaming.get(
+                "auth",
+                "/api/users",
+                params=pagination.page_params(limit, cursor),
+                ttl=upstream.CACHE_TTLS["users"],
+                kind="listing",
             )
-        except httpx.ConnectError:
+        except httpx.TransportError:
             return Response(
                 status_code=500,
                 content={"error": "Internal server error"},
@@ -77,16 +92,15 @@ async def get_user(
     # Send the request to the auth service
 
     try:
-        response = httpx.get(
-            f"http://auth-service:8000/api/users",
+        response = await upstream.get(
+            "auth",
+            f"/api/users",
             params=params,
+            coalesce=True,
+            ttl=upstream.CACHE_TTLS["users"],
         )
-        return Response(
-            status_code=response.status_code,
-            content=response.content,
-            media_type="application/json",
-        )
-    except httpx.ConnectError:
+        return streaming.relay(response)
+    except httpx.TransportError:
         return Response(
             status_code=500,
             content={"error": "Internal server error"},
@@ -4,6 +4,7 @@ from typing import Optional
 import bcrypt
 
 from fastapi import APIRouter, Response, status
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from wrapper import create_user, find_user, User
 
@@ -40,17 +41,20 @@ def get_password_hash(password: str) -> str:
     return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
 
 
-def authenticate_user(username: str, password: str) -> Optional[User]:
+async def authenticate_user(username: str, password: str) -> Optional[User]:
     """
     Authenticate user.
 
+    The password check runs in the threadpool so that bcrypt does not block the
+    event loop.
+
     :param username: Username
     :param password: Password
     :return: UserModel if user is found, None otherwise
     """
     try:
-        if (user := find_user(username=username)) and verify_password(
-            password, str(user.password)
+        if (user := await find_user(username=username)) and await run_in_threadpool(
+            verify_password, password, str(user.password)
         ):
             return user
     except ValueError:
@@ -68,7 +72,7 @@ async def login(user: UserModel) -> Response:
     :raises HTTPException: Incorrect username or password
     """
 
-    if not authenticate_user(user.username, user.password):
+    if not await authenticate_user(user.username, user.password):
         return Response(
             status_code=status.HTTP_401_UNAUTHORIZED,
             content="Incorrect username or password",
@@ -94,7 +98,8 @@ async def register(user: UserModel) -> Response:
             content="Username and password must be provided",
         )
     try:
-        create_user(user.username, get_password_hash(user.password))
+        password_hash = await run_in_threadpool(get_password_hash, user.password)
+        await create_user(user.username, password_hash)
     except ValueError:
         return Response(
             status_code=status.HTTP_409_CONFLICT, content="Username already registered"
@@ -0,0 +1,72 @@
+"""
+Entity tags for conditional requests.
+"""
+
+import hashlib
+from typing import Any
+
+from fastapi import Response, status
+
+
+def version_etag(table: str, version: int, *query: Any) -> str:
+    """
+    Build the entity tag of a listing from the version of the table it reads.
+
+    The version changes on every write to the table, so the tag can be compared
+    before the rows are read and serialized.
+
+    :param table: The name of the table.
+    :param version: The current version of the table.
+    :param query: The parameters that select the rows of the listing.
+
+    :returns: A strong entity tag.
+    """
+    digest = hashlib.sha256(repr((table, version, query)).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def content_etag(content: str | bytes) -> str:
+    """
+    Build the entity tag of a serialized representation.
+
+    :param content: The response body.
+
+    :returns: A strong entity tag.
+    """
+    if isinstance(content, str):
+        content = content.encode()
+    return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+
+def etag_matches(header: str | None, etag: str, strong: bool = False) -> bool:
+    """
+    Check an `If-None-Match` or `If-Match` header against an entity tag.
+
+    `If-None-Match` uses the weak comparison, which ignores the `W/` prefix, while
+    `If-Match` must use the strong comparison, which no weak tag satisfies.
+
+    :param header: The value of the header, if any.
+    :param etag: The current entity tag.
+    :param strong: Whether to use the strong comparison, for `If-Match`.
+
+    :returns: Whether the header lists the entity tag or is `*`.
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header.split(",")]
+    if strong:
+        return not etag.startswith("W/") and etag in tags
+    return etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
+
+def not_modified(etag: str) -> Response:
+    """
+    Build a 304 response for a representation the client already has.
+
+    :param etag: The current entity tag.
+
+    :returns: An empty 304 response.
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
@@ -0,0 +1,225 @@
+"""
+Tracing of requests across the proxy, the services and the database.
+
+Spans are only recorded when `TRACE_EXPORTER` is set, to `file` (JSON lines
+appended to `TRACE_FILE`) or to `memory` (the last `TRACE_MEMORY_SPANS` spans).
+The trace context travels between processes in the W3C `traceparent` header.
+"""
+
+import functools
+import json
+import os
+import re
+import secrets
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Iterator, Protocol, TypeVar
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+T = TypeVar("T")
+
+
+@dataclass
+class Span:
+    """
+    A timed operation within a trace.
+
+    :param trace_id: The trace the span belongs to, as 32 hex digits.
+    :param span_id: The span, as 16 hex digits.
+    :param parent_id: The span this one runs within, if any.
+    :param name: What the span measures.
+    :param service: The process that recorded the span.
+    :param start: When the span started, in seconds since the epoch.
+    :param duration: How long the span took, in seconds.
+    :param attributes: Details of the operation.
+    :param error: The exception the operation raised, if any.
+    """
+
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    name: str
+    service: str
+    start: float
+    duration: float = 0.0
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+class Exporter(Protocol):
+    def export(self, span: Span) -> None: ...
+
+
+class MemoryExporter:
+    """
+    Keeps the last `max_spans` spans in memory.
+    """
+
+    def __init__(self, max_spans: int):
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def trace(self, trace_id: str) -> list[Span]:
+        """
+        Return the spans of one trace.
+
+        :param trace_id: The trace to look up.
+
+        :returns: The spans of the trace still in memory, in the order they ended.
+        """
+        return [span for span in self.spans if span.trace_id == trace_id]
+
+
+class FileExporter:
+    """
+    Appends every span to a file, one JSON object per line.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", buffering=1, encoding="utf-8")
+
+    def export(self, span: Span) -> None:
+        self._file.write(json.dumps(asdict(span)) + "\n")
+
+
+service_name = "unknown"
+
+exporter: Exporter | None = None
+
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def configure(name: str) -> None:
+    """
+    Name the process in its spans and set up the exporter from the environment.
+
+    :param name: The name of the service recording the spans.
+    :raises RuntimeError: If `TRACE_EXPORTER` is not `file`, `memory` or empty.
+    """
+    global service_name, exporter
+    service_name = name
+    match os.getenv("TRACE_EXPORTER", ""):
+        case "":
+            exporter = None
+        case "file":
+            exporter = FileExporter(os.getenv("TRACE_FILE", "") or "/tmp/traces.jsonl")
+        case "memory":
+            exporter = MemoryExporter(int(os.getenv("TRACE_MEMORY_SPANS", "10000")))
+        case other:
+            raise RuntimeError(f"Invalid TRACE_EXPORTER: {other}")
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str] | None:
+    """
+    Read the trace context sent by the caller.
+
+    :param header: The value of the `traceparent` header, if any.
+
+    :returns: The trace and parent span IDs, or None if the header is missing or
+        malformed.
+    """
+    if not header or not (match := TRACEPARENT.match(header.strip().lower())):
+        return None
+    trace_id, parent_id, _ = match.groups()
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id
+
+
+@contextmanager
+def span(
+    name: str, remote_parent: tuple[str, str] | None = None, **attributes: Any
+) -> Iterator[Span | None]:
+    """
+    Record an operation as a child of the current span, or of a remote parent.
+
+    :param name: What the span measures.
+    :param remote_parent: The trace and parent span IDs sent by the caller.
+    :param attributes: Details of the operation.
+
+    :returns: The span, or None if tracing is off.
+    """
+    if exporter is None:
+        yield None
+        return
+    if remote_parent is not None:
+        trace_id, parent_id = remote_parent
+    elif (parent := current_span.get()) is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+    current = Span(
+        trace_id=trace_id,
+        span_id=secrets.token_hex(8),
+        parent_id=parent_id,
+        name=name,
+        service=service_name,
+        start=time.time(),
+        attributes=attributes,
+    )
+    token = current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as exc:
+        current.error = type(exc).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        current_span.reset(token)
+        exporter.export(current)
+
+
+def traced(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """
+    Record every call of a coroutine function as a span named after it.
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        with span(fn.__name__):
+            return await fn(*args, **kwargs)
+
+    return wrapper
+
+
+class TracingMiddleware:
+    """
+    Record a span for every request, continuing the caller's trace.
+
+    The response carries the `traceparent` of the request's span, so a caller can
+    look up the trace of a slow response.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or exporter is None:
+            await self.app(scope, receive, send)
+            return
+        remote_parent = parse_traceparent(Headers(scope=scope).get("traceparent"))
+        with span(
+            f"{scope['method']} {scope['path']}", remote_parent, kind="server"
+        ) as current:
+
+            async def send_with_traceparent(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    current.attributes["status"] = message["status"]
+                    MutableHeaders(scope=message)["traceparent"] = current.traceparent
+                await send(message)
+
+            await self.app(scope, receive, send_with_traceparent)
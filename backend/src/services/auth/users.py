@@ -1,8 +1,16 @@
 import json
 
-from fastapi import APIRouter, Query, Response, status
+from etag import content_etag, etag_matches, not_modified, version_etag
+from fastapi import APIRouter, Header, Query, Response, status
 from pydantic import BaseModel
-from wrapper import find_user, get_all_users
+from pagination import decode_cursor, MAX_LIMIT, split_page
+from wrapper import (
+    find_user,
+    find_users,
+    get_all_users,
+    get_table_version,
+    USER_KEY,
+)
 
 router = APIRouter()
 
@@ -16,32 +24,64 @@ class UserModel(BaseModel):
     password: str
 
 
+class LookupModel(BaseModel):
+    """
+    Class for a lookup of several users by username.
+    """
+
+    usernames: list[str]
+
+
 @router.get("")
 async def get_user(
     user_id: int = Query(default=None),
     username: str = Query(default=None),
+    limit: int = Query(default=MAX_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: str | None = Query(default=None),
+    if_none_match: str | None = Header(default=None),
 ) -> Response:
     """
     Get a user by its id.
 
     :param user_id: The id of the user.
+    :param limit: The size of a page of all users, `MAX_LIMIT` by default.
+    :param cursor: The cursor of the page of all users to get.
     :return: The user with the given id.
     """
-    # If no username or id is provided, return all users
+    # If no username or id is provided, return all users, a page at a time
 
     if not user_id and not username:
         try:
-            users = get_all_users()
+            after = decode_cursor(cursor, USER_KEY)
+        except ValueError as e:
+            return Response(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content=json.dumps({"error": str(e)}),
+                media_type="application/json",
+            )
+        try:
+            etag = version_etag(
+                "users", await get_table_version("users"), limit, cursor
+            )
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+            users, next_cursor = split_page(
+                await get_all_users(after=after, limit=limit + 1),
+                limit,
+                lambda user: (user.id,),
+            )
             return Response(
                 status_code=status.HTTP_200_OK,
                 content=json.dumps(
                     {
                         "users": [
                             {"id": user.id, "username": user.username} for user in users
-                        ]
+                        ],
+                        "next": next_cursor,
                     }
                 ),
                 media_type="application/json",
+                headers={"ETag": etag},
             )
         except Exception as e:
             return Response(
@@ -50,14 +90,17 @@ async def get_user(
                 media_type="application/json",
             )
     try:
-        user = find_user(user_id=user_id, username=username)
+        user = await find_user(user_id=user_id, username=username)
         if user:
+            content = json.dumps({"user": {"id": user.id, "username": user.username}})
+            etag = content_etag(content)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
             return Response(
                 status_code=status.HTTP_200_OK,
-                content=json.dumps(
-                    {"user": {"id": user.id, "username": user.username}}
-                ),
+                content=content,
                 media_type="application/json",
+                headers={"ETag": etag},
             )
     except ValueError as e:
         return Response(
@@ -70,3 +113,32 @@ async def get_user(
         content=json.dumps({"error": "User not found"}),
         media_type="application/json",
     )
+
+
+@router.post("/lookup")
+async def lookup_users(lookup: LookupModel) -> Response:
+    """
+    Get the users with any of the given usernames, in one query.
+
+    :param lookup: The usernames to look up.
+    :return: The users that exist, and the usernames that do not.
+    """
+    try:
+        users = await find_users(list(set(lookup.usernames)))
+    except ValueError as e:
+        return Response(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=json.dumps({"error": str(e)}),
+            media_type="application/json",
+        )
+    found = {user.username for user in users}
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=json.dumps(
+            {
+                "users": [{"id": user.id, "username": user.username} for user in users],
+                "missing": sorted(set(lookup.usernames) - found),
+            }
+        ),
+        media_type="application/json",
+    )
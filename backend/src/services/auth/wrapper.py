@@ -2,19 +2,35 @@
 Handles the database connection and operations for the authentication service.
 """
 
+import functools
 import os
+import time
 from typing import Any
 
+from metrics import DB_CHECKOUT_WAIT
+from pagination import keyset
 from sqlalchemy import (
+    BigInteger,
     Column,
-    create_engine,
+    func,
+    Integer,
+    select,
     SmallInteger,
     String,
     URL,
 )
 
 from sqlalchemy.exc import IntegrityError, OperationalError
-from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import (
+    async_sessionmaker,
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
+from tracing import traced
 
 
 def get_env(var: str) -> str:
@@ -54,7 +70,7 @@ def get_db_url() -> URL:
         raise RuntimeError(f"Invalid AUTH_DB_PORT: {port_raw}") from exc
 
     return URL.create(
-        drivername="postgresql+psycopg2",
+        drivername="postgresql+asyncpg",
         username=user,
         password=password,
         host=host,
@@ -63,22 +79,130 @@ def get_db_url() -> URL:
     )
 
 
-def get_session() -> Session:
+def get_pool_config() -> dict[str, Any]:
+    """
+    Read the connection pool settings from the environment.
+
+    :returns: Keyword arguments for the engine's connection pool.
+    :raises RuntimeError: In case of incorrectly configured env vars.
+    """
+    try:
+        return {
+            "pool_size": int(os.getenv("AUTH_DB_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("AUTH_DB_MAX_OVERFLOW", "10")),
+            "pool_timeout": float(os.getenv("AUTH_DB_POOL_TIMEOUT", "30")),
+            "pool_recycle": int(os.getenv("AUTH_DB_POOL_RECYCLE", "1800")),
+            "pool_pre_ping": os.getenv("AUTH_DB_POOL_PRE_PING", "true").lower()
+            in ("1", "true", "yes"),
+        }
+    except ValueError as exc:
+        raise RuntimeError(f"Invalid AUTH_DB_POOL setting: {exc}") from exc
+
+
+pool_stats = {
+    "checkouts": 0,
+    "timeouts": 0,
+    "wait_seconds": 0.0,
+    "max_wait_seconds": 0.0,
+}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long checkouts wait for a connection.
+    """
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            pool_stats["checkouts"] += 1
+            pool_stats["timeouts"] += timed_out
+            pool_stats["wait_seconds"] += waited
+            pool_stats["max_wait_seconds"] = max(pool_stats["max_wait_seconds"], waited)
+            DB_CHECKOUT_WAIT.observe(waited)
+
+
+@functools.cache
+def get_engine() -> AsyncEngine:
+    """
+    Return the engine shared by the whole process, creating it on first use.
+
+    :returns: The SQLAlchemy engine with a pooled connection to the appdb.
+    :raises RuntimeError: In case of missing or incorrectly configured env vars.
+    """
+    return create_async_engine(
+        get_db_url(), poolclass=TimedQueuePool, **get_pool_config()
+    )
+
+
+@functools.cache
+def get_session_maker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(bind=get_engine(), expire_on_commit=False)
+
+
+def get_session() -> AsyncSession:
+    """
+    Return a new asynchronous session bound to the shared engine.
+
+    Use it as an async context manager so that the session is closed and its
+    connection returned to the pool once the operation is done.
+
+    :returns: A new session.
+    """
     try:
-        session_maker = sessionmaker(bind=create_engine(get_db_url()))
-        session = session_maker()
-    except RuntimeError as exc:
+        session = get_session_maker()()
+    except RuntimeError:
         # Temporary ugly fix to not crash testing
-        session = Session()
+
+        session = AsyncSession()
     return session
 
 
+def get_pool_stats() -> dict[str, Any]:
+    """
+    Return the connection pool usage and checkout statistics.
+
+    :returns: A dictionary with the pool status and checkout wait times.
+    """
+    try:
+        pool = get_engine().pool
+    except RuntimeError:
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **pool_stats,
+    }
+
+
 class Base(DeclarativeBase):
     """
     Base class for model class
     """
 
 
+class TableVersion(Base):
+    """
+    One slot of the version of a table, bumped by a trigger on every write to it.
+    The version of the table is the sum of its slots
+    """
+
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    slot = Column(SmallInteger, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
 class User(Base):
     """
     Model representing a user.
@@ -86,12 +210,17 @@ class User(Base):
 
     __tablename__ = "users"
 
-    id = Column(SmallInteger, primary_key=True, autoincrement=True, nullable=False)
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     username = Column(String, nullable=False, unique=True)
     password = Column(String, nullable=False)
 
 
-def create_user(
+# The columns listings are ordered and paginated by
+USER_KEY = (User.id,)
+
+
+@traced
+async def create_user(
     username: str,
     password: str,
 ) -> User:
@@ -105,21 +234,22 @@ def create_user(
 
     :return: The created User instance.
     """
-    session = get_session()
-    if session.query(User).filter(User.username == username).first():
-        raise ValueError("User already exists")
-
-    new_user = User(username=username, password=password)
-    try:
-        session.add(new_user)
-        session.commit()
-        return User(username=username, password=password, id=new_user.id)
-    except IntegrityError as exc_inner:
-        session.rollback()
-        raise ValueError("Error creating user") from exc_inner
-
-
-def find_user(username: str | None = None, user_id: int | None = None) -> User:
+    async with get_session() as session:
+        if await session.scalar(select(User).where(User.username == username)):
+            raise ValueError("User already exists")
+
+        new_user = User(username=username, password=password)
+        try:
+            session.add(new_user)
+            await session.commit()
+            return User(username=username, password=password, id=new_user.id)
+        except IntegrityError as exc_inner:
+            await session.rollback()
+            raise ValueError("Error creating user") from exc_inner
+
+
+@traced
+async def find_user(username: str | None = None, user_id: int | None = None) -> User:
     """
     Finds a user based on its username and/or id.
 
@@ -132,44 +262,77 @@ def find_user(username: str | None = None, user_id: int | None = None) -> User:
     """
     if not username and not user_id:
         raise ValueError("No username or id provided")
-    session = get_session()
-    try:
-        user = (
-            (session.query(User).filter(User.username == username).first())
-            if username is not None
-            else session.query(User).filter(User.id == user_id).first()
-        )
-    except OperationalError as se:
-        raise ValueError("Error getting user:", se) from se
+    async with get_session() as session:
+        try:
+            user = await session.scalar(
+                select(User).where(User.username == username)
+                if username is not None
+                else select(User).where(User.id == user_id)
+            )
+        except OperationalError as se:
+            raise ValueError("Error getting user:", se) from se
+
+        if user is None:
+            raise ValueError(
+                f"User with username {username} and id {user_id} not found in the database"
+            )
 
-    if user is None:
-        raise ValueError(
-            f"User with username {username} and id {user_id} not found in the database"
-        )
-
-    return User(username=user.username, password=user.password, id=user.id)
+        return User(username=user.username, password=user.password, id=user.id)
 
 
-def get_all_users() -> list[User]:
+@traced
+async def find_users(usernames: list[str]) -> list[User]:
     """
-    Gets all users from the database.
+    Finds the users with any of the given usernames, in one query.
+
+    :param usernames: Usernames of the users to find.
 
     :raises ValueError: If there is an error getting the users.
 
-    :return: List of all User instances.
+    :return: The found User instances, without the usernames that do not exist.
     """
-    session = get_session()
-    try:
-        users = session.query(User).all()
-        return [
-            User(username=user.username, password=user.password, id=user.id)
-            for user in users
-        ]
-    except OperationalError as se:
-        raise ValueError("Error getting users:", se) from se
+    if not usernames:
+        return []
+    async with get_session() as session:
+        try:
+            users = await session.scalars(
+                select(User).where(User.username.in_(usernames)).order_by(User.id)
+            )
+            return [
+                User(username=user.username, password=user.password, id=user.id)
+                for user in users
+            ]
+        except OperationalError as se:
+            raise ValueError("Error getting users:", se) from se
+
+
+@traced
+async def get_all_users(
+    after: tuple | None = None, limit: int | None = None
+) -> list[User]:
+    """
+    Gets users from the database in the order of their id.
 
+    :param after: The id after which to start, if any.
+    :param limit: The number of users to get, or None to get them all.
+
+    :raises ValueError: If there is an error getting the users.
 
-def update_user(user_id: int, **kwargs: Any) -> User:
+    :return: List of User instances.
+    """
+    async with get_session() as session:
+        try:
+            users = await session.scalars(keyset(select(User), USER_KEY, after, limit))
+            return [
+                User(username=user.username, password=user.password, id=user.id)
+                for user in users
+            ]
+        except OperationalError as se:
+            raise ValueError("Error getting users:", se) from se
+
+
+@traced
+async def update_user(user_id: int, **kwargs: Any) -> User:
     r"""
     Updates a user's attributes.
 
@@ -180,35 +343,50 @@ def update_user(user_id: int, **kwargs: Any) -> User:
 
     :return: The updated User instance.
     """
-    session = get_session()
-
-    if not (user := session.query(User).filter(User.id == user_id).first()):
-        raise ValueError(f"User with ID {user_id} not found in the database")
-
-    for key, value in kwargs.items():
-        if key in ["username", "password"]:
-            setattr(user, key, value)
-    try:
-        session.commit()
-        return User(username=user.username, password=user.password, id=user.id)
-    except IntegrityError as exc_inner:
-        session.rollback()
-        raise ValueError("Error updating user") from exc_inner
-
-
-def delete_user(user_id: int) -> None:
+    async with get_session() as session:
+        if not (user := await session.get(User, user_id)):
+            raise ValueError(f"User with ID {user_id} not found in the database")
+
+        for key, value in kwargs.items():
+            if key in ["username", "password"]:
+                setattr(user, key, value)
+        try:
+            await session.commit()
+            return User(username=user.username, password=user.password, id=user.id)
+        except IntegrityError as exc_inner:
+            await session.rollback()
+            raise ValueError("Error updating user") from exc_inner
+
+
+@traced
+async def delete_user(user_id: int) -> None:
     """
     Deletes a user based on its ID.
     :param user_id: ID of the user to delete.
     :raises ValueError: If the user with the given ID is not found in the database
     """
-    session = get_session()
+    async with get_session() as session:
+        if not (user := await session.get(User, user_id)):
+            raise ValueError(f"User with ID {user_id} not found in the database")
+        try:
+            await session.delete(user)
+            await session.commit()
+        except IntegrityError as exc_inner:
+            await session.rollback()
+            raise ValueError("Error deleting user") from exc_inner
+
+
+@traced
+async def get_table_version(table: str) -> int:
+    """
+    Get the current version of a table.
 
-    if not (user := session.query(User).filter(User.id == user_id).first()):
-        raise ValueError(f"User with ID {user_id} not found in the database")
-    try:
-        session.delete(user)
-        session.commit()
-    except IntegrityError as exc_inner:
-        session.rollback()
-        raise ValueError("Error deleting user") from exc_inner
+    :param table: The name of the table.
+
+    :returns: The version of the table, 0 if it was never written to.
+    """
+    async with get_session() as session:
+        version = await session.scalar(
+            select(func.sum(TableVersion.version)).where(TableVersion.name == table)
+        )
+        return int(version or 0)
@@ -2,9 +2,24 @@
 This file contains the calendar sharing routes for the FastAPI application.
 """
 
+import asyncio
+from contextlib import asynccontextmanager
+
 import calendars
+import metrics
+import tracing
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from wrapper import get_pool_stats
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    monitor = asyncio.ensure_future(metrics.monitor_loop_lag())
+    yield
+    monitor.cancel()
+
 
 app = FastAPI(
     title="Calendar Sharing Service API",
@@ -13,8 +28,14 @@ app = FastAPI(
     redoc_url=None,
     openapi_url="/openapi.json",
     root_path="/api",
+    lifespan=lifespan,
 )
 
+metrics.register_pool(get_pool_stats)
+tracing.configure("calendars-service")
+
+# Compress large listings on their way to the proxy
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -23,11 +44,18 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
 
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return {"status": "ok", "pool": get_pool_stats()}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.metrics_response()
 
 
 app.include_router(calendars.router, prefix="/shares", tags=["calendar shares"])
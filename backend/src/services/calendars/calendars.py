@@ -1,6 +1,8 @@
 import json
 
-from fastapi import APIRouter, Response, status
+from etag import content_etag, etag_matches, not_modified, version_etag
+from fastapi import APIRouter, Header, Query, Response, status
+from pagination import decode_cursor, MAX_LIMIT, split_page
 from pydantic import BaseModel, Field
 from wrapper import (
     delete_shared_calendar,
@@ -8,7 +10,9 @@ from wrapper import (
     get_shared_by,
     get_shared_calendar,
     get_shared_with,
+    get_table_version,
     share_calendar,
+    SHARE_KEY,
 )
 
 router = APIRouter()
@@ -24,12 +28,40 @@ class CalendarShareModel(BaseModel):
 
 
 @router.get("")
-def get_calendars():
+async def get_calendars(
+    limit: int = Query(default=MAX_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: str | None = Query(default=None),
+    if_none_match: str | None = Header(default=None),
+):
     """
-    Get all shared calendars.
+    Get all shared calendars, a page at a time.
 
-    :returns: A list of all shared calendars.
+    :param limit: The size of a page, `MAX_LIMIT` by default.
+    :param cursor: The cursor of the page to get.
+
+    :returns: A list of shared calendars.
     """
+    try:
+        after = decode_cursor(cursor, SHARE_KEY)
+    except ValueError as e:
+        return Response(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=json.dumps({"error": str(e)}),
+            media_type="application/json",
+        )
+    etag = version_etag(
+        "shared_calendars", await get_table_version("shared_calendars"), limit, cursor
+    )
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    shared_calendars, next_cursor = split_page(
+        await get_all_shared_calendars(after=after, limit=limit + 1),
+        limit,
+        lambda shared_calendar: (
+            shared_calendar.sharingUser,
+            shared_calendar.receivingUser,
+        ),
+    )
     return Response(
         status_code=status.HTTP_200_OK,
         content=json.dumps(
@@ -39,16 +71,20 @@ def get_calendars():
                         "sharingUser": shared_calendar.sharingUser,
                         "receivingUser": shared_calendar.receivingUser,
                     }
-                    for shared_calendar in get_all_shared_calendars()
-                ]
+                    for shared_calendar in shared_calendars
+                ],
+                "next": next_cursor,
             }
         ),
         media_type="application/json",
+        headers={"ETag": etag},
     )
 
 
 @router.get("/by/{username}")
-def get_calendars_by(username: str):
+async def get_calendars_by(
+    username: str, if_none_match: str | None = Header(default=None)
+):
     """
     Get all calendars shared by a user.
 
@@ -56,6 +92,11 @@ def get_calendars_by(username: str):
 
     :returns: A list of shared calendars.
     """
+    etag = version_etag(
+        "shared_calendars", await get_table_version("shared_calendars"), "by", username
+    )
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
     return Response(
         status_code=status.HTTP_200_OK,
         content=json.dumps(
@@ -65,16 +106,19 @@ def get_calendars_by(username: str):
                         "sharingUser": shared_calendar.sharingUser,
                         "receivingUser": shared_calendar.receivingUser,
                     }
-                    for shared_calendar in get_shared_by(username)
+                    for shared_calendar in await get_shared_by(username)
                 ]
             }
         ),
         media_type="application/json",
+        headers={"ETag": etag},
     )
 
 
 @router.get("/with/{username}")
-def get_calendars_with(username: str):
+async def get_calendars_with(
+    username: str, if_none_match: str | None = Header(default=None)
+):
     """
     Get all calendars shared with a user.
 
@@ -82,6 +126,14 @@ def get_calendars_with(username: str):
 
     :returns: A list of shared calendars.
     """
+    etag = version_etag(
+        "shared_calendars",
+        await get_table_version("shared_calendars"),
+        "with",
+        username,
+    )
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
     return Response(
         status_code=status.HTTP_200_OK,
         content=json.dumps(
@@ -91,16 +143,21 @@ def get_calendars_with(username: str):
                         "sharingUser": shared_calendar.sharingUser,
                         "receivingUser": shared_calendar.receivingUser,
                     }
-                    for shared_calendar in get_shared_with(username)
+                    for shared_calendar in await get_shared_with(username)
                 ]
             }
         ),
         media_type="application/json",
+        headers={"ETag": etag},
     )
 
 
 @router.get("/by/{sharingUser}/with/{receivingUser}")
-def get_specific_shared_calendar(sharingUser: str, receivingUser: str):
+async def get_specific_shared_calendar(
+    sharingUser: str,
+    receivingUser: str,
+    if_none_match: str | None = Header(default=None),
+):
     """
     Get a shared calendar.
 
@@ -109,29 +166,36 @@ def get_specific_shared_calendar(sharingUser: str, receivingUser: str):
 
     :returns: The shared calendar.
     """
-    calendar = get_shared_calendar(sharingUser=sharingUser, receivingUser=receivingUser)
+    calendar = await get_shared_calendar(
+        sharingUser=sharingUser, receivingUser=receivingUser
+    )
     if not calendar:
         return Response(
             status_code=status.HTTP_404_NOT_FOUND,
             content=json.dumps({"error": "Calendar not found"}),
             media_type="application/json",
         )
+    content = json.dumps(
+        {
+            "calendar": {
+                "sharingUser": calendar.sharingUser,
+                "receivingUser": calendar.receivingUser,
+            }
+        }
+    )
+    etag = content_etag(content)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
     return Response(
         status_code=status.HTTP_200_OK,
-        content=json.dumps(
-            {
-                "calendar": {
-                    "sharingUser": calendar.sharingUser,
-                    "receivingUser": calendar.receivingUser,
-                }
-            }
-        ),
+        content=content,
         media_type="application/json",
+        headers={"ETag": etag},
     )
 
 
 @router.post("")
-def add_shared_calendar(calendar: CalendarShareModel):
+async def add_shared_calendar(calendar: CalendarShareModel):
     """
     Share a calendar.
 
@@ -140,13 +204,13 @@ def add_shared_calendar(calendar: CalendarShareModel):
     :returns: The shared calendar.
     """
     try:
-        if get_shared_calendar(calendar.sharingUser, calendar.receivingUser):
+        if await get_shared_calendar(calendar.sharingUser, calendar.receivingUser):
             return Response(
                 status_code=status.HTTP_409_CONFLICT,
                 content=json.dumps({"error": "Calendar already shared"}),
                 media_type="application/json",
             )
-        share_calendar(
+        await share_calendar(
             sharingUser=calendar.sharingUser, receivingUser=calendar.receivingUser
         )
     except Exception as exc:
@@ -170,20 +234,20 @@ def add_shared_calendar(calendar: CalendarShareModel):
 
 
 @router.delete("/{sharingUser}/{receivingUser}")
-def remove_shared_calendar(sharingUser: str, receivingUser: str):
+async def remove_shared_calendar(sharingUser: str, receivingUser: str):
     """
     Delete a shared calendar.
 
     :param calendar: The calendar to delete.
     """
     try:
-        if not get_shared_calendar(sharingUser, receivingUser):
+        if not await get_shared_calendar(sharingUser, receivingUser):
             return Response(
                 status_code=status.HTTP_404_NOT_FOUND,
                 content=json.dumps({"error": "Calendar not found"}),
                 media_type="application/json",
             )
-        delete_shared_calendar(sharingUser, receivingUser)
+        await delete_shared_calendar(sharingUser, receivingUser)
     except Exception as exc:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
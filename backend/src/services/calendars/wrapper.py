@@ -1,20 +1,35 @@
 import datetime
+import functools
 import os
+import time
 from typing import Any
 
+from metrics import DB_CHECKOUT_WAIT
+from pagination import keyset
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
-    create_engine,
     Date,
     ForeignKey,
+    func,
+    select,
     SmallInteger,
     String,
     URL,
 )
 
 from sqlalchemy.exc import IntegrityError, OperationalError
-from sqlalchemy.orm import DeclarativeBase, relationship, Session, sessionmaker
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import (
+    async_sessionmaker,
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
+from sqlalchemy.orm import DeclarativeBase, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
+from tracing import traced
 
 
 def get_env(var: str) -> str:
@@ -53,7 +68,7 @@ def get_db_url() -> URL:
     except ValueError as exc:
         raise RuntimeError(f"Invalid CALENDARS_DB_PORT: {port_raw}") from exc
     return URL.create(
-        drivername="postgresql+psycopg2",
+        drivername="postgresql+asyncpg",
         username=user,
         password=password,
         host=host,
@@ -62,23 +77,130 @@ def get_db_url() -> URL:
     )
 
 
-def get_session() -> Session:
+def get_pool_config() -> dict[str, Any]:
+    """
+    Read the connection pool settings from the environment.
+
+    :returns: Keyword arguments for the engine's connection pool.
+    :raises RuntimeError: In case of incorrectly configured env vars.
+    """
     try:
-        session_maker = sessionmaker(bind=create_engine(get_db_url()))
-        session = session_maker()
-    except RuntimeError as exc:
+        return {
+            "pool_size": int(os.getenv("CALENDARS_DB_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("CALENDARS_DB_MAX_OVERFLOW", "10")),
+            "pool_timeout": float(os.getenv("CALENDARS_DB_POOL_TIMEOUT", "30")),
+            "pool_recycle": int(os.getenv("CALENDARS_DB_POOL_RECYCLE", "1800")),
+            "pool_pre_ping": os.getenv("CALENDARS_DB_POOL_PRE_PING", "true").lower()
+            in ("1", "true", "yes"),
+        }
+    except ValueError as exc:
+        raise RuntimeError(f"Invalid CALENDARS_DB_POOL setting: {exc}") from exc
+
+
+pool_stats = {
+    "checkouts": 0,
+    "timeouts": 0,
+    "wait_seconds": 0.0,
+    "max_wait_seconds": 0.0,
+}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long checkouts wait for a connection.
+    """
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            pool_stats["checkouts"] += 1
+            pool_stats["timeouts"] += timed_out
+            pool_stats["wait_seconds"] += waited
+            pool_stats["max_wait_seconds"] = max(pool_stats["max_wait_seconds"], waited)
+            DB_CHECKOUT_WAIT.observe(waited)
+
+
+@functools.cache
+def get_engine() -> AsyncEngine:
+    """
+    Return the engine shared by the whole process, creating it on first use.
+
+    :returns: The SQLAlchemy engine with a pooled connection to the appdb.
+    :raises RuntimeError: In case of missing or incorrectly configured env vars.
+    """
+    return create_async_engine(
+        get_db_url(), poolclass=TimedQueuePool, **get_pool_config()
+    )
+
+
+@functools.cache
+def get_session_maker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(bind=get_engine(), expire_on_commit=False)
+
+
+def get_session() -> AsyncSession:
+    """
+    Return a new asynchronous session bound to the shared engine.
+
+    Use it as an async context manager so that the session is closed and its
+    connection returned to the pool once the operation is done.
+
+    :returns: A new session.
+    """
+    try:
+        session = get_session_maker()()
+    except RuntimeError:
         # Temporary ugly fix to not crash testing
 
-        session = Session()
+        session = AsyncSession()
     return session
 
 
+def get_pool_stats() -> dict[str, Any]:
+    """
+    Return the connection pool usage and checkout statistics.
+
+    :returns: A dictionary with the pool status and checkout wait times.
+    """
+    try:
+        pool = get_engine().pool
+    except RuntimeError:
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **pool_stats,
+    }
+
+
 class Base(DeclarativeBase):
     """
     Base class for model class
     """
 
 
+class TableVersion(Base):
+    """
+    One slot of the version of a table, bumped by a trigger on every write to it.
+    The version of the table is the sum of its slots
+    """
+
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    slot = Column(SmallInteger, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
 class SharedCalendar(Base):
     """
     Model class for shared calendars
@@ -90,7 +212,12 @@ class SharedCalendar(Base):
     receivingUser = Column(String, primary_key=True)
 
 
-def share_calendar(sharingUser: str, receivingUser: str) -> Any:
+# The columns listings are ordered and paginated by
+SHARE_KEY = (SharedCalendar.sharingUser, SharedCalendar.receivingUser)
+
+
+@traced
+async def share_calendar(sharingUser: str, receivingUser: str) -> Any:
     """
     Share a calendar with another user.
 
@@ -99,36 +226,45 @@ def share_calendar(sharingUser: str, receivingUser: str) -> Any:
 
     :returns: The shared calendar.
     """
-    session = get_session()
-    shared_calendar = SharedCalendar(
-        sharingUser=sharingUser, receivingUser=receivingUser
-    )
-    session.add(shared_calendar)
-    try:
-        session.commit()
-    except IntegrityError as exc:
-        session.rollback()
-        raise exc
-    return SharedCalendar(sharingUser=sharingUser, receivingUser=receivingUser)
-
-
-def get_all_shared_calendars() -> Any:
-    """
-    Get all shared calendars.
-
-    :returns: A list of all shared calendars.
-    """
-    session = get_session()
-    return [
-        SharedCalendar(
-            sharingUser=shared_calendar.sharingUser,
-            receivingUser=shared_calendar.receivingUser,
+    async with get_session() as session:
+        shared_calendar = SharedCalendar(
+            sharingUser=sharingUser, receivingUser=receivingUser
         )
-        for shared_calendar in session.query(SharedCalendar).all()
-    ]
+        session.add(shared_calendar)
+        try:
+            await session.commit()
+        except IntegrityError as exc:
+            await session.rollback()
+            raise exc
+        return SharedCalendar(sharingUser=sharingUser, receivingUser=receivingUser)
+
+
+@traced
+async def get_all_shared_calendars(
+    after: tuple | None = None, limit: int | None = None
+) -> Any:
+    """
+    Get shared calendars in the order of the sharing and receiving user.
 
+    :param after: The sharing and receiving user after which to start, if any.
+    :param limit: The number of shared calendars to get, or None to get them all.
 
-def get_shared_by(username: str):
+    :returns: A list of shared calendars.
+    """
+    async with get_session() as session:
+        return [
+            SharedCalendar(
+                sharingUser=shared_calendar.sharingUser,
+                receivingUser=shared_calendar.receivingUser,
+            )
+            for shared_calendar in await session.scalars(
+                keyset(select(SharedCalendar), SHARE_KEY, after, limit)
+            )
+        ]
+
+
+@traced
+async def get_shared_by(username: str):
     """
     Get all calendars shared by a user.
 
@@ -136,19 +272,22 @@ def get_shared_by(username: str):
 
     :returns: A list of shared calendars.
     """
-    session = get_session()
-    return [
-        SharedCalendar(
-            sharingUser=shared_calendar.sharingUser,
-            receivingUser=shared_calendar.receivingUser,
-        )
-        for shared_calendar in session.query(SharedCalendar)
-        .filter_by(sharingUser=username)
-        .all()
-    ]
-
-
-def get_shared_with(username: str):
+    async with get_session() as session:
+        return [
+            SharedCalendar(
+                sharingUser=shared_calendar.sharingUser,
+                receivingUser=shared_calendar.receivingUser,
+            )
+            for shared_calendar in await session.scalars(
+                select(SharedCalendar)
+                .filter_by(sharingUser=username)
+                .order_by(SharedCalendar.receivingUser)
+            )
+        ]
+
+
+@traced
+async def get_shared_with(username: str):
     """
     Get all calendars shared with a user.
 
@@ -156,19 +295,22 @@ def get_shared_with(username: str):
 
     :returns: A list of shared calendars.
     """
-    session = get_session()
-    return [
-        SharedCalendar(
-            sharingUser=shared_calendar.sharingUser,
-            receivingUser=shared_calendar.receivingUser,
-        )
-        for shared_calendar in session.query(SharedCalendar)
-        .filter_by(receivingUser=username)
-        .all()
-    ]
-
-
-def get_shared_calendar(sharingUser: str, receivingUser: str):
+    async with get_session() as session:
+        return [
+            SharedCalendar(
+                sharingUser=shared_calendar.sharingUser,
+                receivingUser=shared_calendar.receivingUser,
+            )
+            for shared_calendar in await session.scalars(
+                select(SharedCalendar)
+                .filter_by(receivingUser=username)
+                .order_by(SharedCalendar.sharingUser)
+            )
+        ]
+
+
+@traced
+async def get_shared_calendar(sharingUser: str, receivingUser: str):
     """
     Get a shared calendar.
 
@@ -177,40 +319,51 @@ def get_shared_calendar(sharingUser: str, receivingUser: str):
 
     :returns: The shared calendar.
     """
-    session = get_session()
-    shared_calendar = (
-        session.query(SharedCalendar)
-        .filter_by(sharingUser=sharingUser, receivingUser=receivingUser)
-        .first()
-    )
-    return (
-        SharedCalendar(
-            sharingUser=shared_calendar.sharingUser,
-            receivingUser=shared_calendar.receivingUser,
+    async with get_session() as session:
+        shared_calendar = await session.get(
+            SharedCalendar, (sharingUser, receivingUser)
+        )
+        return (
+            SharedCalendar(
+                sharingUser=shared_calendar.sharingUser,
+                receivingUser=shared_calendar.receivingUser,
+            )
+            if shared_calendar
+            else None
         )
-        if shared_calendar
-        else None
-    )
 
 
-def delete_shared_calendar(sharingUser: str, receivingUser: str):
+@traced
+async def delete_shared_calendar(sharingUser: str, receivingUser: str):
     """
     Delete a shared calendar.
 
     :param sharingUser: The user sharing the calendar.
     :param receivingUser: The user receiving the calendar.
     """
-    session = get_session()
-    calendar = (
-        session.query(SharedCalendar)
-        .filter_by(sharingUser=sharingUser, receivingUser=receivingUser)
-        .first()
-    )
-    if not calendar:
-        return
-    try:
-        session.delete(calendar)
-        session.commit()
-    except Exception as exc:
-        session.rollback()
-        raise exc
+    async with get_session() as session:
+        calendar = await session.get(SharedCalendar, (sharingUser, receivingUser))
+        if not calendar:
+            return
+        try:
+            await session.delete(calendar)
+            await session.commit()
+        except Exception as exc:
+            await session.rollback()
+            raise exc
+
+
+@traced
+async def get_table_version(table: str) -> int:
+    """
+    Get the current version of a table.
+
+    :param table: The name of the table.
+
+    :returns: The version of the table, 0 if it was never written to.
+    """
+    async with get_session() as session:
+        version = await session.scalar(
+            select(func.sum(TableVersion.version)).where(TableVersion.name == table)
+        )
+        return int(version or 0)
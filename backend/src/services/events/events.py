@@ -1,13 +1,20 @@
 import datetime
 import json
 
-from fastapi import APIRouter, Response, status
+from etag import content_etag, etag_matches, not_modified, version_etag
+from fastapi import APIRouter, Header, Query, Response, status
+from filters import EventFilter, index_for, parse_order
+from pagination import decode_cursor, MAX_LIMIT, split_page
 from pydantic import BaseModel, Field
 from wrapper import (
     create_event,
     delete_event,
+    EVENT_FIELDS,
+    EVENT_KEY,
     find_all_events,
     find_event,
+    find_events,
+    get_table_version,
     update_event,
 )
 
@@ -22,30 +29,142 @@ class EventModel(BaseModel):
     isPublic: bool
 
 
+class LookupModel(BaseModel):
+    ids: list[int]
+    fields: str | None = None
+
+
+# The most events a lookup may ask for
+MAX_LOOKUP = 5000
+
+
+def event_content(event_id: int, event) -> str:
+    """
+    Serialize a single event, as returned by the item routes.
+    """
+    return json.dumps(
+        {
+            "event": {
+                "id": event_id,
+                "title": event.title,
+                "description": event.description,
+                "date": str(event.date),
+                "organizer": event.organizer,
+                "isPublic": event.isPublic,
+            }
+        }
+    )
+
+
+def parse_fields(fields: str | None) -> tuple[str, ...]:
+    """
+    Parse a comma-separated list of event fields, as in `fields=title,date`.
+
+    The id is always included, and the fields keep their usual order.
+
+    :param fields: The requested fields, or None for all of them.
+
+    :returns: The fields to read and serialize.
+    :raises ValueError: If a field is not a field of events.
+    """
+    if not fields:
+        return EVENT_FIELDS
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    if unknown := requested - set(EVENT_FIELDS):
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in EVENT_FIELDS if field == "id" or field in requested)
+
+
+def bad_request(e: ValueError) -> Response:
+    return Response(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content=json.dumps({"error": str(e)}),
+        media_type="application/json",
+    )
+
+
+async def list_events(
+    selected: tuple[str, ...],
+    event_filter: EventFilter,
+    after: tuple | None,
+    limit: int,
+) -> tuple[list[dict], str | None]:
+    """
+    Read a page of events in the order of their date and id.
+
+    :param selected: The fields to return.
+    :param event_filter: The events to list and their order.
+    :param after: The key after which the page starts, if any.
+    :param limit: The size of the page.
+
+    :returns: The events of the page and the cursor of the next page, if any.
+    """
+    # The date is part of the cursor, so it is read even if it is not returned
+    read = selected if "date" in selected else selected + ("date",)
+    events, next_cursor = split_page(
+        await find_all_events(
+            read,
+            event_filter,
+            after=after,
+            limit=limit + 1,
+        ),
+        limit,
+        lambda event: (event["date"], event["id"]),
+    )
+    if read is not selected:
+        for event in events:
+            del event["date"]
+    return events, next_cursor
+
+
 @router.get("")
-async def get_events():
+async def get_events(
+    fields: str | None = Query(default=None),
+    isPublic: bool | None = Query(default=None),
+    organizer: str | None = Query(default=None),
+    start: datetime.date | None = Query(default=None, alias="from"),
+    end: datetime.date | None = Query(default=None, alias="to"),
+    order: str | None = Query(default=None),
+    limit: int = Query(default=MAX_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: str | None = Query(default=None),
+    if_none_match: str | None = Header(default=None),
+):
     """
-    Get events.
+    Get events, a page at a time, of `MAX_LIMIT` events unless a limit is given.
+
+    The events may be filtered by visibility or by organizer, but not both, and
+    by a range of dates, and are read in one query on the matching index.
     """
     try:
+        selected = parse_fields(fields)
+        event_filter = EventFilter(
+            isPublic=isPublic,
+            organizer=organizer,
+            start=start,
+            end=end,
+            descending=parse_order(order),
+        )
+        index_for(event_filter)
+        after = decode_cursor(cursor, EVENT_KEY)
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        etag = version_etag(
+            "events",
+            await get_table_version("events"),
+            selected,
+            event_filter,
+            limit,
+            cursor,
+        )
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        events, next_cursor = await list_events(selected, event_filter, after, limit)
         return Response(
             status_code=status.HTTP_200_OK,
-            content=json.dumps(
-                {
-                    "events": [
-                        {
-                            "id": event.id,
-                            "title": event.title,
-                            "description": event.description,
-                            "date": event.date,
-                            "organizer": event.organizer,
-                            "isPublic": event.isPublic,
-                        }
-                        for event in find_all_events()
-                    ]
-                }
-            ),
+            content=json.dumps({"events": events, "next": next_cursor}),
             media_type="application/json",
+            headers={"ETag": etag},
         )
     except Exception as e:
         return Response(
@@ -56,67 +175,87 @@ async def get_events():
 
 
 @router.get("/public")
-async def get_public_events():
+async def get_public_events(
+    fields: str | None = Query(default=None),
+    start: datetime.date | None = Query(default=None, alias="from"),
+    end: datetime.date | None = Query(default=None, alias="to"),
+    order: str | None = Query(default=None),
+    limit: int = Query(default=MAX_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: str | None = Query(default=None),
+    if_none_match: str | None = Header(default=None),
+):
     """
-    Get public events.
+    Get public events, the same as `GET /events?isPublic=true`.
     """
+    return await get_events(
+        fields=fields,
+        isPublic=True,
+        organizer=None,
+        start=start,
+        end=end,
+        order=order,
+        limit=limit,
+        cursor=cursor,
+        if_none_match=if_none_match,
+    )
+
+
+@router.post("/lookup")
+async def lookup_events(lookup: LookupModel):
+    """
+    Get the events with any of the given ids in one query, in the order of the
+    ids, along with the ids that do not exist.
+    """
+    if len(lookup.ids) > MAX_LOOKUP:
+        return bad_request(ValueError(f"A lookup holds at most {MAX_LOOKUP} ids"))
     try:
-        return Response(
-            status_code=status.HTTP_200_OK,
-            content=json.dumps(
-                {
-                    "events": [
-                        {
-                            "id": event.id,
-                            "title": event.title,
-                            "description": event.description,
-                            "date": event.date,
-                            "organizer": event.organizer,
-                            "isPublic": event.isPublic,
-                        }
-                        for event in find_all_events()
-                        if event.isPublic
-                    ]
-                }
-            ),
-            media_type="application/json",
-        )
+        selected = parse_fields(lookup.fields)
+    except ValueError as e:
+        return bad_request(e)
+    # Each id is reported once, where it first appears
+    ids = list(dict.fromkeys(lookup.ids))
+    try:
+        events = {event["id"]: event for event in await find_events(ids, selected)}
     except Exception as e:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content=json.dumps({"error": str(e)}),
             media_type="application/json",
         )
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=json.dumps(
+            {
+                "events": [events[event_id] for event_id in ids if event_id in events],
+                "missing": [event_id for event_id in ids if event_id not in events],
+            }
+        ),
+        media_type="application/json",
+    )
 
 
 @router.get("/{event_id}")
-async def get_event(event_id: int):
+async def get_event(event_id: int, if_none_match: str | None = Header(default=None)):
     """
     Get an event by its id.
     """
     try:
-        event = find_event(event_id)
+        event = await find_event(event_id)
         if not event:
             return Response(
                 status_code=status.HTTP_404_NOT_FOUND,
                 content=json.dumps({"error": "Event not found"}),
                 media_type="application/json",
             )
+        content = event_content(event.id, event)
+        etag = content_etag(content)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
         return Response(
             status_code=status.HTTP_200_OK,
-            content=json.dumps(
-                {
-                    "event": {
-                        "id": event.id,
-                        "title": event.title,
-                        "description": event.description,
-                        "date": event.date,
-                        "organizer": event.organizer,
-                        "isPublic": event.isPublic,
-                    }
-                }
-            ),
+            content=content,
             media_type="application/json",
+            headers={"ETag": etag},
         )
     except Exception as e:
         return Response(
@@ -132,7 +271,7 @@ async def add_event(event: EventModel):
     Create an event.
     """
     try:
-        created_event = create_event(
+        created_event = await create_event(
             title=event.title,
             description=event.description,
             date=event.date,
@@ -169,14 +308,14 @@ async def remove_event(event_id: int):
     Delete an event by its id.
     """
     try:
-        event = find_event(event_id)
+        event = await find_event(event_id)
         if not event:
             return Response(
                 status_code=status.HTTP_404_NOT_FOUND,
                 content=json.dumps({"error": "Event not found"}),
                 media_type="application/json",
             )
-        delete_event(event_id)
+        await delete_event(event_id)
         return Response(
             status_code=status.HTTP_200_OK,
             content=json.dumps({"message": "Event deleted"}),
@@ -191,41 +330,51 @@ async def remove_event(event_id: int):
 
 
 @router.put("/{event_id}")
-async def modify_event(event_id: int, event: EventModel):
+async def modify_event(
+    event_id: int,
+    event: EventModel,
+    if_match: str | None = Header(default=None),
+):
     """
     Update an event by its id.
+
+    With an `If-Match` header, the event is only updated if it has not changed
+    since the client read it.
     """
+
+    def unchanged(existing) -> bool:
+        return etag_matches(
+            if_match, content_etag(event_content(event_id, existing)), strong=True
+        )
+
     try:
-        existing_event = find_event(event_id)
-        if not existing_event:
-            return Response(
-                status_code=status.HTTP_404_NOT_FOUND,
-                content=json.dumps({"error": "Event not found"}),
-                media_type="application/json",
-            )
-        update_event(
+        updated = await update_event(
             event_id=event_id,
             title=event.title,
             description=event.description,
             date=event.date,
             organizer=event.organizer,
             isPublic=event.isPublic,
+            precondition=unchanged if if_match else None,
         )
+        if updated is None:
+            return Response(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content=json.dumps({"error": "Event not found"}),
+                media_type="application/json",
+            )
+        if not updated:
+            return Response(
+                status_code=status.HTTP_412_PRECONDITION_FAILED,
+                content=json.dumps({"error": "Event has been modified"}),
+                media_type="application/json",
+            )
+        content = event_content(event_id, event)
         return Response(
             status_code=status.HTTP_200_OK,
-            content=json.dumps(
-                {
-                    "event": {
-                        "id": event_id,
-                        "title": event.title,
-                        "description": event.description,
-                        "date": str(event.date),
-                        "organizer": event.organizer,
-                        "isPublic": event.isPublic,
-                    }
-                }
-            ),
+            content=content,
             media_type="application/json",
+            headers={"ETag": content_etag(content)},
         )
     except Exception as e:
         return Response(
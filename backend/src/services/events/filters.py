@@ -0,0 +1,102 @@
+"""
+Filters of event listings, compiled to a single query that an index answers.
+
+A listing may pin columns to a value (`organizer=...`, `isPublic=...`) and bound
+the date. It is read in the order of the date and id, so it is answered by an
+index on the pinned columns followed by the date and id: the index is read from
+the first row in range to the last, and no other row is looked at. Combinations
+of pinned columns that no index starts with would have to be filtered row by row,
+and are rejected instead.
+"""
+
+import datetime
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import Select
+
+# The index of each combination of pinned columns, all followed by (date, id)
+INDEXES = {
+    frozenset(): "events_date_id",
+    frozenset({"organizer"}): "events_organizer_date_id",
+    frozenset({"isPublic"}): "events_public_date_id",
+}
+
+# The values of `order`, by whether they read the listing backwards
+ORDERS = {"date": False, "-date": True}
+
+
+@dataclass(frozen=True)
+class EventFilter:
+    """
+    The rows and order of an event listing.
+    """
+
+    isPublic: bool | None = None
+    organizer: str | None = None
+    start: datetime.date | None = None
+    end: datetime.date | None = None
+    descending: bool = False
+
+    def pinned(self) -> dict[str, Any]:
+        """
+        :returns: The columns pinned to a value, with their values.
+        """
+        return {
+            column: value
+            for column, value in (
+                ("isPublic", self.isPublic),
+                ("organizer", self.organizer),
+            )
+            if value is not None
+        }
+
+
+def parse_order(order: str | None) -> bool:
+    """
+    Parse the order of a listing, `date` (the default) or `-date`.
+
+    :param order: The requested order, or None for the default.
+
+    :returns: Whether to read the listing from the latest event down.
+    :raises ValueError: If the order is not one of `ORDERS`.
+    """
+    if order is None:
+        return False
+    if order not in ORDERS:
+        raise ValueError(f"Unknown order: {order}")
+    return ORDERS[order]
+
+
+def index_for(event_filter: EventFilter) -> str:
+    """
+    Find the index that answers a filter.
+
+    :param event_filter: The filter of the listing.
+
+    :returns: The name of the index.
+    :raises ValueError: If no index starts with the pinned columns.
+    """
+    pinned = frozenset(event_filter.pinned())
+    if pinned not in INDEXES:
+        raise ValueError(f"Cannot filter by {' and '.join(sorted(pinned))} together")
+    return INDEXES[pinned]
+
+
+def apply(query: Select, model: Any, event_filter: EventFilter) -> Select:
+    """
+    Restrict a query of events to the rows of a filter.
+
+    :param query: The query of the listing.
+    :param model: The mapped class of events.
+    :param event_filter: The filter of the listing, which `index_for` accepts.
+
+    :returns: The filtered query, still to be ordered and paginated.
+    """
+    for column, value in event_filter.pinned().items():
+        query = query.where(getattr(model, column) == value)
+    if event_filter.start is not None:
+        query = query.where(model.date >= event_filter.start)
+    if event_filter.end is not None:
+        query = query.where(model.date <= event_filter.end)
+    return query
@@ -0,0 +1,118 @@
+"""
+Keyset pagination of listings.
+
+A page is read with `WHERE (key) > (last key of the previous page)` in the order
+of the key, or with `<` in the reverse order, which an index on the key answers
+without reading the rows before the page, however deep the page is. The key of the
+last row is handed to the client as an opaque cursor.
+"""
+
+import base64
+import binascii
+import datetime
+import json
+from typing import Any, Callable, Sequence, TypeVar
+
+from sqlalchemy import Select, tuple_
+
+# The largest page a client may ask for
+MAX_LIMIT = 1000
+
+T = TypeVar("T")
+
+
+def encode_cursor(key: Sequence[Any]) -> str:
+    """
+    Encode the key of the last row of a page as a cursor.
+
+    :param key: The values of the key columns.
+
+    :returns: The cursor of the next page.
+    """
+    values = [
+        value.isoformat() if isinstance(value, datetime.date) else value
+        for value in key
+    ]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None, columns: Sequence[Any]) -> tuple | None:
+    """
+    Decode a cursor into the key after which the next page starts.
+
+    :param cursor: The cursor sent by the client, if any.
+    :param columns: The key columns of the listing.
+
+    :returns: The values of the key columns, or None if no cursor was sent.
+    :raises ValueError: If the cursor was not built for this listing.
+    """
+    if cursor is None:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("Invalid cursor")
+    key = []
+    for column, value in zip(columns, values):
+        python_type = column.type.python_type
+        if python_type is datetime.date and isinstance(value, str):
+            try:
+                value = datetime.date.fromisoformat(value)
+            except ValueError as exc:
+                raise ValueError("Invalid cursor") from exc
+        if not isinstance(value, python_type):
+            raise ValueError("Invalid cursor")
+        key.append(value)
+    return tuple(key)
+
+
+def keyset(
+    query: Select,
+    columns: Sequence[Any],
+    after: tuple | None,
+    limit: int | None,
+    descending: bool = False,
+) -> Select:
+    """
+    Restrict a query to the rows after a key, in the order of the key.
+
+    :param query: The query of the listing.
+    :param columns: The key columns, which must identify a row.
+    :param after: The key after which to start, or None to start at the first row.
+    :param limit: The number of rows to read, or None to read them all.
+    :param descending: Whether to read the rows from the largest key down.
+
+    :returns: The query of the page.
+    """
+    if descending:
+        query = query.order_by(*(column.desc() for column in columns))
+        if after is not None:
+            query = query.where(tuple_(*columns) < tuple_(*after))
+    else:
+        query = query.order_by(*columns)
+        if after is not None:
+            query = query.where(tuple_(*columns) > tuple_(*after))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def split_page(
+    rows: list[T], limit: int | None, key: Callable[[T], Sequence[Any]]
+) -> tuple[list[T], str | None]:
+    """
+    Cut the rows read for a page, one more than the limit, into the page and the
+    cursor of the next one.
+
+    :param rows: The rows read, at most `limit + 1` of them.
+    :param limit: The size of the page, or None if the listing is not paginated.
+    :param key: Returns the key of a row.
+
+    :returns: The rows of the page, and the cursor of the next page or None if
+        this page is the last.
+    """
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    return rows[:limit], encode_cursor(key(rows[limit - 1]))
@@ -1,20 +1,41 @@
 import datetime
+import functools
 import os
-from typing import Any
+import time
+from typing import Any, Callable
 
+import filters
+from filters import EventFilter
+from metrics import DB_CHECKOUT_WAIT
+from pagination import keyset
 from sqlalchemy import (
+    any_,
+    ARRAY,
+    BigInteger,
     Boolean,
     Column,
-    create_engine,
     Date,
     ForeignKey,
+    func,
+    Integer,
+    literal,
+    select,
     SmallInteger,
     String,
     URL,
 )
 
 from sqlalchemy.exc import IntegrityError, OperationalError
-from sqlalchemy.orm import DeclarativeBase, relationship, Session, sessionmaker
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import (
+    async_sessionmaker,
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
+from sqlalchemy.orm import DeclarativeBase, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
+from tracing import traced
 
 
 def get_env(var: str) -> str:
@@ -53,7 +74,7 @@ def get_db_url() -> URL:
     except ValueError as exc:
         raise RuntimeError(f"Invalid EVENTS_DB_PORT: {port_raw}") from exc
     return URL.create(
-        drivername="postgresql+psycopg2",
+        drivername="postgresql+asyncpg",
         username=user,
         password=password,
         host=host,
@@ -62,23 +83,130 @@ def get_db_url() -> URL:
     )
 
 
-def get_session() -> Session:
+def get_pool_config() -> dict[str, Any]:
+    """
+    Read the connection pool settings from the environment.
+
+    :returns: Keyword arguments for the engine's connection pool.
+    :raises RuntimeError: In case of incorrectly configured env vars.
+    """
     try:
-        session_maker = sessionmaker(bind=create_engine(get_db_url()))
-        session = session_maker()
-    except RuntimeError as exc:
+        return {
+            "pool_size": int(os.getenv("EVENTS_DB_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("EVENTS_DB_MAX_OVERFLOW", "10")),
+            "pool_timeout": float(os.getenv("EVENTS_DB_POOL_TIMEOUT", "30")),
+            "pool_recycle": int(os.getenv("EVENTS_DB_POOL_RECYCLE", "1800")),
+            "pool_pre_ping": os.getenv("EVENTS_DB_POOL_PRE_PING", "true").lower()
+            in ("1", "true", "yes"),
+        }
+    except ValueError as exc:
+        raise RuntimeError(f"Invalid EVENTS_DB_POOL setting: {exc}") from exc
+
+
+pool_stats = {
+    "checkouts": 0,
+    "timeouts": 0,
+    "wait_seconds": 0.0,
+    "max_wait_seconds": 0.0,
+}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long checkouts wait for a connection.
+    """
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            pool_stats["checkouts"] += 1
+            pool_stats["timeouts"] += timed_out
+            pool_stats["wait_seconds"] += waited
+            pool_stats["max_wait_seconds"] = max(pool_stats["max_wait_seconds"], waited)
+            DB_CHECKOUT_WAIT.observe(waited)
+
+
+@functools.cache
+def get_engine() -> AsyncEngine:
+    """
+    Return the engine shared by the whole process, creating it on first use.
+
+    :returns: The SQLAlchemy engine with a pooled connection to the appdb.
+    :raises RuntimeError: In case of missing or incorrectly configured env vars.
+    """
+    return create_async_engine(
+        get_db_url(), poolclass=TimedQueuePool, **get_pool_config()
+    )
+
+
+@functools.cache
+def get_session_maker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(bind=get_engine(), expire_on_commit=False)
+
+
+def get_session() -> AsyncSession:
+    """
+    Return a new asynchronous session bound to the shared engine.
+
+    Use it as an async context manager so that the session is closed and its
+    connection returned to the pool once the operation is done.
+
+    :returns: A new session.
+    """
+    try:
+        session = get_session_maker()()
+    except RuntimeError:
         # Temporary ugly fix to not crash testing
 
-        session = Session()
+        session = AsyncSession()
     return session
 
 
+def get_pool_stats() -> dict[str, Any]:
+    """
+    Return the connection pool usage and checkout statistics.
+
+    :returns: A dictionary with the pool status and checkout wait times.
+    """
+    try:
+        pool = get_engine().pool
+    except RuntimeError:
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **pool_stats,
+    }
+
+
 class Base(DeclarativeBase):
     """
     Base class for model class
     """
 
 
+class TableVersion(Base):
+    """
+    One slot of the version of a table, bumped by a trigger on every write to it.
+    The version of the table is the sum of its slots
+    """
+
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    slot = Column(SmallInteger, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
 class Event(Base):
     """
     Event model class
@@ -86,7 +214,7 @@ class Event(Base):
 
     __tablename__ = "events"
 
-    id = Column(SmallInteger, primary_key=True, autoincrement=True, nullable=False)
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     title = Column(String, nullable=False)
     description = Column(String, nullable=False)
     date = Column(Date, nullable=False)
@@ -94,7 +222,16 @@ class Event(Base):
     isPublic = Column(Boolean, nullable=False)
 
 
-def create_event(
+# The columns listings are ordered and paginated by
+EVENT_KEY = (Event.date, Event.id)
+
+
+# The columns of an event, in the order they are serialized
+EVENT_FIELDS = ("id", "title", "description", "date", "organizer", "isPublic")
+
+
+@traced
+async def create_event(
     title: str, description: str, date: datetime.date, organizer: str, isPublic: bool
 ) -> Any:
     """
@@ -116,33 +253,14 @@ def create_event(
         organizer=organizer,
         isPublic=isPublic,
     )
-    session = get_session()
-    session.add(event)
-    try:
-        session.commit()
-    except IntegrityError as exc:
-        session.rollback()
-        raise exc
-    return Event(
-        id=event.id,
-        title=event.title,
-        description=event.description,
-        date=str(event.date),
-        organizer=event.organizer,
-        isPublic=event.isPublic,
-    )
-
-
-def find_all_events() -> Any:
-    """
-    Get all events.
-
-    :returns: A list of all events.
-    """
-    session = get_session()
-    events = session.query(Event).all()
-    return [
-        Event(
+    async with get_session() as session:
+        session.add(event)
+        try:
+            await session.commit()
+        except IntegrityError as exc:
+            await session.rollback()
+            raise exc
+        return Event(
             id=event.id,
             title=event.title,
             description=event.description,
@@ -150,11 +268,74 @@ def find_all_events() -> Any:
             organizer=event.organizer,
             isPublic=event.isPublic,
         )
-        for event in events
-    ]
 
 
-def find_event(event_id: int) -> Any:
+@traced
+async def find_all_events(
+    fields: tuple[str, ...] = EVENT_FIELDS,
+    event_filter: EventFilter = EventFilter(),
+    after: tuple | None = None,
+    limit: int | None = None,
+) -> list[dict[str, Any]]:
+    """
+    Get events in the order of their date and id, reading only the given columns.
+
+    :param fields: The columns to read, from `EVENT_FIELDS`.
+    :param event_filter: The events to get and their order, checked with
+        `filters.index_for`.
+    :param after: The date and id after which to start, if any.
+    :param limit: The number of events to read, or None to read them all.
+
+    :returns: A list of events, each a dictionary of the given fields.
+    """
+    query = select(*(getattr(Event, field) for field in fields))
+    query = filters.apply(query, Event, event_filter)
+    query = keyset(query, EVENT_KEY, after, limit, event_filter.descending)
+    async with get_session() as session:
+        rows = await session.execute(query)
+        return [
+            {
+                field: str(value) if field == "date" else value
+                for field, value in zip(fields, row)
+            }
+            for row in rows
+        ]
+
+
+@traced
+async def find_events(
+    event_ids: list[int], fields: tuple[str, ...] = EVENT_FIELDS
+) -> list[dict[str, Any]]:
+    """
+    Get the events with any of the given ids, in one query.
+
+    The ids are sent as a single array, so the statement is the same however many
+    there are.
+
+    :param event_ids: The ids of the events to get.
+    :param fields: The columns to read, from `EVENT_FIELDS`.
+
+    :returns: The events that exist, each a dictionary of the given fields, in no
+        particular order.
+    """
+    if not event_ids:
+        return []
+    query = select(*(getattr(Event, field) for field in fields)).where(
+        Event.id == any_(literal(event_ids, ARRAY(Integer)))
+    )
+    async with get_session() as session:
+        rows = await session.execute(query)
+        return [
+            {
+                field: str(value) if field == "date" else value
+                for field, value in zip(fields, row)
+            }
+            for row in rows
+        ]
+
+
+@traced
+async def find_event(event_id: int) -> Any:
     """
     Get an event by its id.
 
@@ -162,74 +343,104 @@ def find_event(event_id: int) -> Any:
 
     :returns: The event with the given id.
     """
-    session = get_session()
-    event = session.query(Event).filter(Event.id == event_id).first()
-    return (
-        Event(
-            id=event.id,
-            title=event.title,
-            description=event.description,
-            date=str(event.date),
-            organizer=event.organizer,
-            isPublic=event.isPublic,
+    async with get_session() as session:
+        event = await session.scalar(select(Event).where(Event.id == event_id))
+        return (
+            Event(
+                id=event.id,
+                title=event.title,
+                description=event.description,
+                date=str(event.date),
+                organizer=event.organizer,
+                isPublic=event.isPublic,
+            )
+            if event
+            else None
         )
-        if event
-        else None
-    )
 
 
-def update_event(
+@traced
+async def update_event(
     event_id: int,
     title: str,
     description: str,
     date: datetime.date,
     organizer: str,
     isPublic: bool,
-):
+    precondition: Callable[[Event], bool] | None = None,
+) -> bool | None:
     """
     Update an event with the given parameters.
 
+    The event is locked while the precondition is checked and the event written,
+    in one transaction, so no other write can come in between.
+
     :param event_id: The id of the event to update.
     :param title: The title of the event.
     :param description: The description of the event.
     :param date: The date of the event.
     :param organizer: The id of the organizer.
     :param isPublic: Whether the event is public or not.
+    :param precondition: Checks the current event, which is only updated if it
+        returns True.
 
-    :returns: The updated event.
+    :returns: True if the event was updated, False if the precondition failed and
+        None if there is no such event.
     :raises IntegrityError: If the event could not be updated.
     """
-    session = get_session()
-    event = session.query(Event).filter(Event.id == event_id).first()
-    if not event:
-        return
-    setattr(event, "title", title)
-    setattr(event, "description", description)
-    setattr(event, "date", date)
-    setattr(event, "organizer", organizer)
-    setattr(event, "isPublic", isPublic)
-    try:
-        session.commit()
-    except Exception as exc:
-        session.rollback()
-        raise exc
-    return
-
-
-def delete_event(event_id: int):
+    async with get_session() as session:
+        event = await session.scalar(
+            select(Event).where(Event.id == event_id).with_for_update()
+        )
+        if not event:
+            return None
+        if precondition is not None and not precondition(event):
+            await session.rollback()
+            return False
+        setattr(event, "title", title)
+        setattr(event, "description", description)
+        setattr(event, "date", date)
+        setattr(event, "organizer", organizer)
+        setattr(event, "isPublic", isPublic)
+        try:
+            await session.commit()
+        except Exception as exc:
+            await session.rollback()
+            raise exc
+        return True
+
+
+@traced
+async def delete_event(event_id: int):
     """
     Delete an event by its id.
 
     :param event_id: The id of the event to delete.
     """
-    session = get_session()
-    event = session.query(Event).filter(Event.id == event_id).first()
-    if not event:
-        return
-    session.delete(event)
-    try:
-        session.commit()
-        return
-    except Exception as exc:
-        session.rollback()
-        raise exc
+    async with get_session() as session:
+        event = await session.scalar(select(Event).where(Event.id == event_id))
+        if not event:
+            return
+        await session.delete(event)
+        try:
+            await session.commit()
+            return
+        except Exception as exc:
+            await session.rollback()
+            raise exc
+
+
+@traced
+async def get_table_version(table: str) -> int:
+    """
+    Get the current version of a table.
+
+    :param table: The name of the table.
+
+    :returns: The version of the table, 0 if it was never written to.
+    """
+    async with get_session() as session:
+        version = await session.scalar(
+            select(func.sum(TableVersion.version)).where(TableVersion.name == table)
+        )
+        return int(version or 0)
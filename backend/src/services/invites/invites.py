@@ -1,17 +1,23 @@
 import json
 
-from fastapi import APIRouter, Query, Response, status
+from etag import content_etag, etag_matches, not_modified, version_etag
+from fastapi import APIRouter, Header, Query, Response, status
+from pagination import decode_cursor, MAX_LIMIT, split_page
 from pydantic import BaseModel
 
 from wrapper import (
     create_invite,
+    create_invites,
     delete_invite,
     find_all_invites,
     find_invite,
     find_invites_by_event,
     find_invites_by_user,
+    get_table_version,
+    INVITE_KEY,
     INVITE_STATUS,
     update_invite,
+    upsert_invite,
 )
 
 router = APIRouter()
@@ -28,43 +34,108 @@ class DeleteInviteModel(BaseModel):
     username: str
 
 
+class BulkInviteModel(BaseModel):
+    invites: list[InviteModel]
+
+
+class StatusModel(BaseModel):
+    status: INVITE_STATUS
+
+
+# The most invites a bulk request may create, as many as the proxy lets through.
+# Each one takes three parameters of the statement, of which there can be 32767
+MAX_BULK_INVITES = 1000
+
+
+def invite_content(eventId: int, username: str, status: str) -> str:
+    """
+    Serialize a single invite, as returned when both the user and event are given.
+    """
+    return json.dumps(
+        {
+            "invite": {
+                "eventId": eventId,
+                "username": username,
+                "status": status,
+            }
+        }
+    )
+
+
+def matching_statuses(if_match: str, eventId: int, username: str) -> list[str]:
+    """
+    List the statuses with which an invite matches an `If-Match` header.
+
+    An invite is serialized from its status alone, so an update can check the
+    header in its WHERE clause instead of reading the invite first.
+    """
+    return [
+        value.value
+        for value in INVITE_STATUS
+        if etag_matches(
+            if_match,
+            content_etag(invite_content(eventId, username, value.value)),
+            strong=True,
+        )
+    ]
+
+
 @router.get("")
-def get_invite(
+async def get_invite(
     username: str = Query(default=None, description="User's username"),
     eventId: int = Query(default=None, description="Event's ID"),
+    limit: int = Query(default=MAX_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: str | None = Query(default=None),
+    if_none_match: str | None = Header(default=None),
 ):
     """
     Get invite by user and event ID
     """
     if username and eventId:
         # Search for a specific invite
-        invite = find_invite(eventId, username)
+        invite = await find_invite(eventId, username)
         if not invite:
             return Response(
                 status_code=status.HTTP_404_NOT_FOUND,
                 content=json.dumps({"error": "Invite not found"}),
                 media_type="application/json",
             )
+        content = invite_content(invite.eventId, invite.username, invite.status)
+        etag = content_etag(content)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
         return Response(
             status_code=status.HTTP_200_OK,
-            content=json.dumps(
-                {
-                    "invite": {
-                        "eventId": invite.eventId,
-                        "username": invite.username,
-                        "status": invite.status,
-                    }
-                }
-            ),
+            content=content,
             media_type="application/json",
+            headers={"ETag": etag},
         )
 
+    # Listings are read a page at a time, of `MAX_LIMIT` rows by default
+    try:
+        after = decode_cursor(cursor, INVITE_KEY)
+    except ValueError as e:
+        return Response(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=json.dumps({"error": str(e)}),
+            media_type="application/json",
+        )
+    etag = version_etag(
+        "invites", await get_table_version("invites"), username, eventId, limit, cursor
+    )
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    page = {"after": after, "limit": limit + 1}
     if username:
-        invites = find_invites_by_user(username)
+        invites = await find_invites_by_user(username, **page)
     elif eventId:
-        invites = find_invites_by_event(eventId)
+        invites = await find_invites_by_event(eventId, **page)
     else:
-        invites = find_all_invites()
+        invites = await find_all_invites(**page)
+    invites, next_cursor = split_page(
+        invites, limit, lambda invite: (invite.eventId, invite.username)
+    )
     return Response(
         status_code=status.HTTP_200_OK,
         content=json.dumps(
@@ -76,26 +147,27 @@ def get_invite(
                         "status": invite.status,
                     }
                     for invite in invites
-                ]
+                ],
+                "next": next_cursor,
             }
         ),
         media_type="application/json",
+        headers={"ETag": etag},
     )
 
 
 @router.post("")
-def add_invite(invite: InviteModel):
+async def add_invite(invite: InviteModel):
     """
     Create invite
     """
     try:
-        if find_invite(invite.eventId, invite.username):
+        if not await create_invite(invite.eventId, invite.username, invite.status):
             return Response(
                 status_code=status.HTTP_409_CONFLICT,
                 content=json.dumps({"error": "Invite already exists"}),
                 media_type="application/json",
             )
-        create_invite(invite.eventId, invite.username, invite.status)
         return Response(
             status_code=status.HTTP_201_CREATED,
             content=json.dumps(
@@ -117,19 +189,86 @@ def add_invite(invite: InviteModel):
         )
 
 
+@router.post("/bulk")
+async def add_invites(bulk: BulkInviteModel):
+    """
+    Create many invites in one statement, and report for each whether it was
+    created or already existed
+    """
+    if len(bulk.invites) > MAX_BULK_INVITES:
+        return Response(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=json.dumps(
+                {"error": f"At most {MAX_BULK_INVITES} invites can be created at once"}
+            ),
+            media_type="application/json",
+        )
+    # The first of duplicate invites wins
+    invites = {}
+    for invite in bulk.invites:
+        invites.setdefault((invite.eventId, invite.username), invite.status)
+    try:
+        created = await create_invites(
+            [
+                (eventId, username, value)
+                for (eventId, username), value in invites.items()
+            ]
+        )
+    except Exception as e:
+        return Response(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=json.dumps({"error": str(e)}),
+            media_type="application/json",
+        )
+    # Only the first of duplicate invites counts as created
+    results = []
+    for invite in bulk.invites:
+        key = (invite.eventId, invite.username)
+        results.append(
+            {
+                "eventId": invite.eventId,
+                "username": invite.username,
+                "status": invite.status.value,
+                "result": "created" if key in created else "exists",
+            }
+        )
+        created.discard(key)
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=json.dumps({"results": results}),
+        media_type="application/json",
+    )
+
+
 @router.put("")
-def update_invite_status(invite: InviteModel):
+async def update_invite_status(
+    invite: InviteModel,
+    if_match: str | None = Header(default=None),
+):
     """
     Update invite status
     """
     try:
-        if not find_invite(invite.eventId, invite.username):
+        expected = (
+            matching_statuses(if_match, invite.eventId, invite.username)
+            if if_match
+            else None
+        )
+        if not await update_invite(
+            invite.eventId, invite.username, invite.status, expected
+        ):
+            # Only a failed update reads the invite, to tell why it failed
+            if not await find_invite(invite.eventId, invite.username):
+                return Response(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    content=json.dumps({"error": "Invite not found"}),
+                    media_type="application/json",
+                )
             return Response(
-                status_code=status.HTTP_404_NOT_FOUND,
-                content=json.dumps({"error": "Invite not found"}),
+                status_code=status.HTTP_412_PRECONDITION_FAILED,
+                content=json.dumps({"error": "Invite has been modified"}),
                 media_type="application/json",
             )
-        update_invite(invite.eventId, invite.username, invite.status)
         return Response(
             status_code=status.HTTP_200_OK,
             content=json.dumps(
@@ -151,19 +290,41 @@ def update_invite_status(invite: InviteModel):
         )
 
 
+@router.put("/{eventId}/{username}")
+async def put_invite(eventId: int, username: str, invite: StatusModel):
+    """
+    Create an invite, or update its status if it exists, in one statement
+    """
+    try:
+        created = await upsert_invite(eventId, username, invite.status)
+    except Exception as e:
+        return Response(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=json.dumps({"error": str(e)}),
+            media_type="application/json",
+        )
+    content = invite_content(eventId, username, invite.status.value)
+    return Response(
+        status_code=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        content=content,
+        media_type="application/json",
+        headers={"ETag": content_etag(content)},
+    )
+
+
 @router.delete("/{eventId}/{username}")
-def remove_invite(eventId: int, username: str):
+async def remove_invite(eventId: int, username: str):
     """
     Remove invite
     """
     try:
-        if not find_invite(eventId, username):
+        if not await find_invite(eventId, username):
             return Response(
                 status_code=status.HTTP_404_NOT_FOUND,
                 content=json.dumps({"error": "Invite not found"}),
                 media_type="application/json",
             )
-        delete_invite(eventId, username)
+        await delete_invite(eventId, username)
         return Response(
             status_code=status.HTTP_200_OK,
             content=json.dumps({"message": "Invite deleted"}),
@@ -1,23 +1,41 @@
 import datetime
 import enum
+import functools
 import os
+import time
 from typing import Any
 
+from metrics import DB_CHECKOUT_WAIT
+from pagination import keyset
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
-    create_engine,
     Date,
     ForeignKey,
+    func,
     Integer,
+    literal_column,
+    select,
     SmallInteger,
     String,
+    update,
     URL,
 )
 
+from sqlalchemy.dialects.postgresql import ENUM, insert
 from sqlalchemy.exc import IntegrityError, OperationalError
-from sqlalchemy.orm import DeclarativeBase, relationship, Session, sessionmaker
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import (
+    async_sessionmaker,
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
+from sqlalchemy.orm import DeclarativeBase, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
 from sqlalchemy.schema import PrimaryKeyConstraint
+from tracing import traced
 
 
 def get_env(var: str) -> str:
@@ -56,7 +74,7 @@ def get_db_url() -> URL:
     except ValueError as exc:
         raise RuntimeError(f"Invalid INVITES_DB_PORT: {port_raw}") from exc
     return URL.create(
-        drivername="postgresql+psycopg2",
+        drivername="postgresql+asyncpg",
         username=user,
         password=password,
         host=host,
@@ -65,23 +83,130 @@ def get_db_url() -> URL:
     )
 
 
-def get_session() -> Session:
+def get_pool_config() -> dict[str, Any]:
+    """
+    Read the connection pool settings from the environment.
+
+    :returns: Keyword arguments for the engine's connection pool.
+    :raises RuntimeError: In case of incorrectly configured env vars.
+    """
+    try:
+        return {
+            "pool_size": int(os.getenv("INVITES_DB_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("INVITES_DB_MAX_OVERFLOW", "10")),
+            "pool_timeout": float(os.getenv("INVITES_DB_POOL_TIMEOUT", "30")),
+            "pool_recycle": int(os.getenv("INVITES_DB_POOL_RECYCLE", "1800")),
+            "pool_pre_ping": os.getenv("INVITES_DB_POOL_PRE_PING", "true").lower()
+            in ("1", "true", "yes"),
+        }
+    except ValueError as exc:
+        raise RuntimeError(f"Invalid INVITES_DB_POOL setting: {exc}") from exc
+
+
+pool_stats = {
+    "checkouts": 0,
+    "timeouts": 0,
+    "wait_seconds": 0.0,
+    "max_wait_seconds": 0.0,
+}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long checkouts wait for a connection.
+    """
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            pool_stats["checkouts"] += 1
+            pool_stats["timeouts"] += timed_out
+            pool_stats["wait_seconds"] += waited
+            pool_stats["max_wait_seconds"] = max(pool_stats["max_wait_seconds"], waited)
+            DB_CHECKOUT_WAIT.observe(waited)
+
+
+@functools.cache
+def get_engine() -> AsyncEngine:
+    """
+    Return the engine shared by the whole process, creating it on first use.
+
+    :returns: The SQLAlchemy engine with a pooled connection to the appdb.
+    :raises RuntimeError: In case of missing or incorrectly configured env vars.
+    """
+    return create_async_engine(
+        get_db_url(), poolclass=TimedQueuePool, **get_pool_config()
+    )
+
+
+@functools.cache
+def get_session_maker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(bind=get_engine(), expire_on_commit=False)
+
+
+def get_session() -> AsyncSession:
+    """
+    Return a new asynchronous session bound to the shared engine.
+
+    Use it as an async context manager so that the session is closed and its
+    connection returned to the pool once the operation is done.
+
+    :returns: A new session.
+    """
     try:
-        session_maker = sessionmaker(bind=create_engine(get_db_url()))
-        session = session_maker()
-    except RuntimeError as exc:
+        session = get_session_maker()()
+    except RuntimeError:
         # Temporary ugly fix to not crash testing
 
-        session = Session()
+        session = AsyncSession()
     return session
 
 
+def get_pool_stats() -> dict[str, Any]:
+    """
+    Return the connection pool usage and checkout statistics.
+
+    :returns: A dictionary with the pool status and checkout wait times.
+    """
+    try:
+        pool = get_engine().pool
+    except RuntimeError:
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **pool_stats,
+    }
+
+
 class Base(DeclarativeBase):
     """
     Base class for model class
     """
 
 
+class TableVersion(Base):
+    """
+    One slot of the version of a table, bumped by a trigger on every write to it.
+    The version of the table is the sum of its slots
+    """
+
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    slot = Column(SmallInteger, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
 class INVITE_STATUS(enum.Enum):
     YES = "YES"
     NO = "NO"
@@ -96,89 +221,253 @@ class Invite(Base):
 
     __tablename__ = "invites"
 
-    eventId = Column(SmallInteger, primary_key=True)
+    eventId = Column(Integer, primary_key=True)
     username = Column(String, primary_key=True)
-    status = Column(String, default=INVITE_STATUS.PENDING, nullable=False)
+    status = Column(
+        ENUM(
+            *(status.value for status in INVITE_STATUS),
+            name="invite_status",
+            create_type=False,
+        ),
+        default=INVITE_STATUS.PENDING.value,
+        nullable=False,
+    )
     # __table_args__ = PrimaryKeyConstraint("eventId", "username")
 
 
-def create_invite(eventId: int, username: str, status: INVITE_STATUS):
-    invite = Invite(eventId=eventId, username=username, status=status.value)
-
-    session = get_session()
-    session.add(invite)
-    try:
-        session.commit()
-    except IntegrityError as exc:
-        session.rollback()
-        raise exc
-    return Invite(eventId=eventId, username=username, status=status)
+# The columns listings are ordered and paginated by
+INVITE_KEY = (Invite.eventId, Invite.username)
 
 
-def find_all_invites():
-    session = get_session()
-    invites = session.query(Invite).all()
-    return [
-        Invite(eventId=invite.eventId, username=invite.username, status=invite.status)
-        for invite in invites
-    ]
+@traced
+async def create_invite(eventId: int, username: str, status: INVITE_STATUS):
+    """
+    Create an invite in one statement, unless it already exists.
 
+    :param eventId: The id of the event.
+    :param username: The username of the invited user.
+    :param status: The status of the invite.
 
-def find_invite(eventId: int, username: str):
-    if not (eventId or username):
-        return None
-    session = get_session()
-    invite = (
-        session.query(Invite)
-        .filter(Invite.eventId == eventId, Invite.username == username)
-        .first()
-    )
-    return (
-        Invite(eventId=invite.eventId, username=invite.username, status=invite.status)
-        if invite
-        else None
+    :returns: The created invite, or None if the user was already invited.
+    """
+    statement = (
+        insert(Invite)
+        .values(eventId=eventId, username=username, status=status.value)
+        .on_conflict_do_nothing()
+        .returning(Invite.eventId)
     )
+    async with get_session() as session:
+        try:
+            created = (await session.execute(statement)).first()
+            await session.commit()
+        except IntegrityError as exc:
+            await session.rollback()
+            raise exc
+        if not created:
+            return None
+        return Invite(eventId=eventId, username=username, status=status)
+
 
+@traced
+async def upsert_invite(eventId: int, username: str, status: INVITE_STATUS) -> bool:
+    """
+    Create an invite, or set its status if it exists, in one statement.
+
+    Concurrent upserts of the same invite are serialized on its primary key, and
+    the last one wins.
+
+    :param eventId: The id of the event.
+    :param username: The username of the invited user.
+    :param status: The status of the invite.
 
-def find_invites_by_event(eventId: int):
-    session = get_session()
-    invites = session.query(Invite).filter(Invite.eventId == eventId).all()
-    return [
-        Invite(eventId=invite.eventId, username=invite.username, status=invite.status)
-        for invite in invites
-    ]
+    :returns: Whether the invite was created rather than updated.
+    """
+    statement = insert(Invite).values(
+        eventId=eventId, username=username, status=status.value
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[Invite.eventId, Invite.username],
+        set_={"status": statement.excluded.status},
+    ).returning(
+        # xmax is 0 on a row the statement inserted, and set on a row it updated
+        literal_column("xmax = 0")
+    )
+    async with get_session() as session:
+        try:
+            created = await session.scalar(statement)
+            await session.commit()
+        except IntegrityError as exc:
+            await session.rollback()
+            raise exc
+        return created
 
 
-def find_invites_by_user(username: str):
-    session = get_session()
-    invites = session.query(Invite).filter(Invite.username == username).all()
-    return [
-        Invite(eventId=invite.eventId, username=invite.username, status=invite.status)
-        for invite in invites
-    ]
+@traced
+async def create_invites(
+    invites: list[tuple[int, str, INVITE_STATUS]],
+) -> set[tuple[int, str]]:
+    """
+    Create many invites in a single multi-row statement, skipping existing ones.
 
+    :param invites: The event id, username and status of each invite.
 
-def update_invite(eventId: int, username: str, status: INVITE_STATUS):
-    session = get_session()
-    invite = session.query(Invite).get((eventId, username))
-    if invite:
-        setattr(invite, "status", status.value)
+    :returns: The event id and username of the invites that were created.
+    """
+    if not invites:
+        return set()
+    statement = (
+        insert(Invite)
+        .values(
+            [
+                {"eventId": eventId, "username": username, "status": status.value}
+                for eventId, username, status in invites
+            ]
+        )
+        .on_conflict_do_nothing()
+        .returning(Invite.eventId, Invite.username)
+    )
+    async with get_session() as session:
         try:
-            session.commit()
-        except Exception as exc:
-            session.rollback()
+            created = (await session.execute(statement)).all()
+            await session.commit()
+        except IntegrityError as exc:
+            await session.rollback()
             raise exc
-    return
+        return {(eventId, username) for eventId, username in created}
+
+
+@traced
+async def find_all_invites(after: tuple | None = None, limit: int | None = None):
+    async with get_session() as session:
+        invites = await session.scalars(
+            keyset(select(Invite), INVITE_KEY, after, limit)
+        )
+        return [
+            Invite(
+                eventId=invite.eventId, username=invite.username, status=invite.status
+            )
+            for invite in invites
+        ]
+
 
+@traced
+async def find_invite(eventId: int, username: str):
+    if not (eventId or username):
+        return None
+    async with get_session() as session:
+        invite = await session.scalar(
+            select(Invite).where(Invite.eventId == eventId, Invite.username == username)
+        )
+        return (
+            Invite(
+                eventId=invite.eventId, username=invite.username, status=invite.status
+            )
+            if invite
+            else None
+        )
+
+
+@traced
+async def find_invites_by_event(
+    eventId: int, after: tuple | None = None, limit: int | None = None
+):
+    async with get_session() as session:
+        invites = await session.scalars(
+            keyset(
+                select(Invite).where(Invite.eventId == eventId),
+                INVITE_KEY,
+                after,
+                limit,
+            )
+        )
+        return [
+            Invite(
+                eventId=invite.eventId, username=invite.username, status=invite.status
+            )
+            for invite in invites
+        ]
+
+
+@traced
+async def find_invites_by_user(
+    username: str, after: tuple | None = None, limit: int | None = None
+):
+    async with get_session() as session:
+        invites = await session.scalars(
+            keyset(
+                select(Invite).where(Invite.username == username),
+                INVITE_KEY,
+                after,
+                limit,
+            )
+        )
+        return [
+            Invite(
+                eventId=invite.eventId, username=invite.username, status=invite.status
+            )
+            for invite in invites
+        ]
+
+
+@traced
+async def update_invite(
+    eventId: int,
+    username: str,
+    status: INVITE_STATUS,
+    expected: list[str] | None = None,
+) -> bool:
+    """
+    Set the status of an invite in one statement.
 
-def delete_invite(eventId: int, username: str):
-    session = get_session()
-    invite = session.query(Invite).get((eventId, username))
-    if invite:
-        session.delete(invite)
+    :param eventId: The id of the event.
+    :param username: The username of the invited user.
+    :param status: The new status of the invite.
+    :param expected: The statuses the invite may have to be updated, or None for
+        any status.
+
+    :returns: Whether the invite was updated.
+    """
+    statement = update(Invite).where(
+        Invite.eventId == eventId, Invite.username == username
+    )
+    if expected is not None:
+        statement = statement.where(Invite.status.in_(expected))
+    statement = statement.values(status=status.value).returning(Invite.eventId)
+    async with get_session() as session:
         try:
-            session.commit()
+            updated = (await session.execute(statement)).first()
+            await session.commit()
         except Exception as exc:
-            session.rollback()
+            await session.rollback()
             raise exc
-    return
+        return updated is not None
+
+
+@traced
+async def delete_invite(eventId: int, username: str):
+    async with get_session() as session:
+        invite = await session.get(Invite, (eventId, username))
+        if invite:
+            await session.delete(invite)
+            try:
+                await session.commit()
+            except Exception as exc:
+                await session.rollback()
+                raise exc
+        return
+
+
+@traced
+async def get_table_version(table: str) -> int:
+    """
+    Get the current version of a table.
+
+    :param table: The name of the table.
+
+    :returns: The version of the table, 0 if it was never written to.
+    """
+    async with get_session() as session:
+        version = await session.scalar(
+            select(func.sum(TableVersion.version)).where(TableVersion.name == table)
+        )
+        return int(version or 0)
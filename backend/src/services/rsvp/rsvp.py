@@ -1,6 +1,8 @@
 import json
 
-from fastapi import APIRouter, Query, Response, status
+from etag import content_etag, etag_matches, not_modified, version_etag
+from fastapi import APIRouter, Header, Query, Response, status
+from pagination import decode_cursor, MAX_LIMIT, split_page
 from pydantic import BaseModel, Field
 from wrapper import (
     create_response,
@@ -9,8 +11,11 @@ from wrapper import (
     find_response,
     find_response_by_event,
     find_responses_by_user,
+    get_table_version,
+    RESPONSE_KEY,
     RSVP_STATUS,
     update_response,
+    upsert_response,
 )
 
 router = APIRouter()
@@ -22,41 +27,103 @@ class RsvpResponseModel(BaseModel):
     status: RSVP_STATUS = Field(..., description="Response status")
 
 
+class StatusModel(BaseModel):
+    status: RSVP_STATUS = Field(..., description="Response status")
+
+
+def response_content(eventId: int, username: str, status: str) -> str:
+    """
+    Serialize a single response, as returned when both the user and event are given.
+    """
+    return json.dumps(
+        {
+            "response": {
+                "eventId": eventId,
+                "username": username,
+                "status": status,
+            }
+        }
+    )
+
+
+def matching_statuses(if_match: str, eventId: int, username: str) -> list[str]:
+    """
+    List the statuses with which a response matches an `If-Match` header.
+
+    A response is serialized from its status alone, so an update can check the
+    header in its WHERE clause instead of reading the response first.
+    """
+    return [
+        value.value
+        for value in RSVP_STATUS
+        if etag_matches(
+            if_match,
+            content_etag(response_content(eventId, username, value.value)),
+            strong=True,
+        )
+    ]
+
+
 @router.get("")
-def get_response(
+async def get_response(
     username: str = Query(default=None, description="User's username"),
     eventId: int = Query(default=None, description="Event's ID"),
+    limit: int = Query(default=MAX_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: str | None = Query(default=None),
+    if_none_match: str | None = Header(default=None),
 ):
     """
     Get response by user and event ID
     """
     if username and eventId:
-        response = find_response(eventId, username)
+        response = await find_response(eventId, username)
         if not response:
             return Response(
                 status_code=status.HTTP_404_NOT_FOUND,
                 content=json.dumps({"error": "Response not found"}),
                 media_type="application/json",
             )
+        content = response_content(response.eventId, response.username, response.status)
+        etag = content_etag(content)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
         return Response(
             status_code=status.HTTP_200_OK,
-            content=json.dumps(
-                {
-                    "response": {
-                        "eventId": response.eventId,
-                        "username": response.username,
-                        "status": response.status,
-                    }
-                }
-            ),
+            content=content,
+            media_type="application/json",
+            headers={"ETag": etag},
+        )
+
+    # Listings are read a page at a time, of `MAX_LIMIT` rows by default
+    try:
+        after = decode_cursor(cursor, RESPONSE_KEY)
+    except ValueError as e:
+        return Response(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=json.dumps({"error": str(e)}),
             media_type="application/json",
         )
-    elif username:
-        responses = find_responses_by_user(username)
+    etag = version_etag(
+        "rsvp_responses",
+        await get_table_version("rsvp_responses"),
+        username,
+        eventId,
+        limit,
+        cursor,
+    )
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    page = {"after": after, "limit": limit + 1}
+    if username:
+        responses = await find_responses_by_user(username, **page)
     elif eventId:
-        responses = find_response_by_event(eventId)
+        responses = await find_response_by_event(eventId, **page)
     else:
-        responses = find_all_responses()
+        responses = await find_all_responses(**page)
+    responses, next_cursor = split_page(
+        responses, limit, lambda response: (response.eventId, response.username)
+    )
     return Response(
         status_code=status.HTTP_200_OK,
         content=json.dumps(
@@ -68,26 +135,29 @@ def get_response(
                         "status": response.status,
                     }
                     for response in responses
-                ]
+                ],
+                "next": next_cursor,
             }
         ),
         media_type="application/json",
+        headers={"ETag": etag},
     )
 
 
 @router.post("")
-def create_rsvp(response: RsvpResponseModel):
+async def create_rsvp(response: RsvpResponseModel):
     """
     Create a new response
     """
     try:
-        if find_response(response.eventId, response.username):
+        if not await create_response(
+            response.eventId, response.username, response.status
+        ):
             return Response(
                 status_code=status.HTTP_409_CONFLICT,
                 content=json.dumps({"error": "Response already exists"}),
                 media_type="application/json",
             )
-        create_response(response.eventId, response.username, response.status)
     except Exception as exc:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -110,18 +180,34 @@ def create_rsvp(response: RsvpResponseModel):
 
 
 @router.put("")
-def update_rsvp(response: RsvpResponseModel):
+async def update_rsvp(
+    response: RsvpResponseModel,
+    if_match: str | None = Header(default=None),
+):
     """
     Update a response
     """
     try:
-        if not find_response(response.eventId, response.username):
+        expected = (
+            matching_statuses(if_match, response.eventId, response.username)
+            if if_match
+            else None
+        )
+        if not await update_response(
+            response.eventId, response.username, response.status, expected
+        ):
+            # Only a failed update reads the response, to tell why it failed
+            if not await find_response(response.eventId, response.username):
+                return Response(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    content=json.dumps({"error": "Response not found"}),
+                    media_type="application/json",
+                )
             return Response(
-                status_code=status.HTTP_404_NOT_FOUND,
-                content=json.dumps({"error": "Response not found"}),
+                status_code=status.HTTP_412_PRECONDITION_FAILED,
+                content=json.dumps({"error": "Response has been modified"}),
                 media_type="application/json",
             )
-        update_response(response.eventId, response.username, response.status)
     except Exception as exc:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -143,20 +229,42 @@ def update_rsvp(response: RsvpResponseModel):
     )
 
 
+@router.put("/{eventId}/{username}")
+async def put_rsvp(eventId: int, username: str, response: StatusModel):
+    """
+    Create a response, or update its status if it exists, in one statement
+    """
+    try:
+        created = await upsert_response(eventId, username, response.status)
+    except Exception as exc:
+        return Response(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=json.dumps({"error": str(exc)}),
+            media_type="application/json",
+        )
+    content = response_content(eventId, username, response.status.value)
+    return Response(
+        status_code=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        content=content,
+        media_type="application/json",
+        headers={"ETag": content_etag(content)},
+    )
+
+
 @router.delete("/{eventId}/{username}")
-def delete_rsvp(eventId: int, username: str):
+async def delete_rsvp(eventId: int, username: str):
     """
     Delete a response
     """
 
     try:
-        if not find_response(eventId, username):
+        if not await find_response(eventId, username):
             return Response(
                 status_code=status.HTTP_404_NOT_FOUND,
                 content=json.dumps({"error": "Response not found"}),
                 media_type="application/json",
             )
-        delete_response(eventId, username)
+        await delete_response(eventId, username)
     except Exception as exc:
         return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
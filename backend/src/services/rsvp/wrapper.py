@@ -1,23 +1,41 @@
 import datetime
 import enum
+import functools
 import os
+import time
 from typing import Any
 
+from metrics import DB_CHECKOUT_WAIT
+from pagination import keyset
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
-    create_engine,
     Date,
     ForeignKey,
+    func,
     Integer,
+    literal_column,
+    select,
     SmallInteger,
     String,
+    update,
     URL,
 )
 
+from sqlalchemy.dialects.postgresql import ENUM, insert
 from sqlalchemy.exc import IntegrityError, OperationalError
-from sqlalchemy.orm import DeclarativeBase, relationship, Session, sessionmaker
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import (
+    async_sessionmaker,
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
+from sqlalchemy.orm import DeclarativeBase, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
 from sqlalchemy.schema import PrimaryKeyConstraint
+from tracing import traced
 
 
 def get_env(var: str) -> str:
@@ -56,7 +74,7 @@ def get_db_url() -> URL:
     except ValueError as exc:
         raise RuntimeError(f"Invalid RSVP_DB_PORT: {port_raw}") from exc
     return URL.create(
-        drivername="postgresql+psycopg2",
+        drivername="postgresql+asyncpg",
         username=user,
         password=password,
         host=host,
@@ -65,17 +83,111 @@ def get_db_url() -> URL:
     )
 
 
-def get_session() -> Session:
+def get_pool_config() -> dict[str, Any]:
+    """
+    Read the connection pool settings from the environment.
+
+    :returns: Keyword arguments for the engine's connection pool.
+    :raises RuntimeError: In case of incorrectly configured env vars.
+    """
+    try:
+        return {
+            "pool_size": int(os.getenv("RSVP_DB_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("RSVP_DB_MAX_OVERFLOW", "10")),
+            "pool_timeout": float(os.getenv("RSVP_DB_POOL_TIMEOUT", "30")),
+            "pool_recycle": int(os.getenv("RSVP_DB_POOL_RECYCLE", "1800")),
+            "pool_pre_ping": os.getenv("RSVP_DB_POOL_PRE_PING", "true").lower()
+            in ("1", "true", "yes"),
+        }
+    except ValueError as exc:
+        raise RuntimeError(f"Invalid RSVP_DB_POOL setting: {exc}") from exc
+
+
+pool_stats = {
+    "checkouts": 0,
+    "timeouts": 0,
+    "wait_seconds": 0.0,
+    "max_wait_seconds": 0.0,
+}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long checkouts wait for a connection.
+    """
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            pool_stats["checkouts"] += 1
+            pool_stats["timeouts"] += timed_out
+            pool_stats["wait_seconds"] += waited
+            pool_stats["max_wait_seconds"] = max(pool_stats["max_wait_seconds"], waited)
+            DB_CHECKOUT_WAIT.observe(waited)
+
+
+@functools.cache
+def get_engine() -> AsyncEngine:
+    """
+    Return the engine shared by the whole process, creating it on first use.
+
+    :returns: The SQLAlchemy engine with a pooled connection to the appdb.
+    :raises RuntimeError: In case of missing or incorrectly configured env vars.
+    """
+    return create_async_engine(
+        get_db_url(), poolclass=TimedQueuePool, **get_pool_config()
+    )
+
+
+@functools.cache
+def get_session_maker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(bind=get_engine(), expire_on_commit=False)
+
+
+def get_session() -> AsyncSession:
+    """
+    Return a new asynchronous session bound to the shared engine.
+
+    Use it as an async context manager so that the session is closed and its
+    connection returned to the pool once the operation is done.
+
+    :returns: A new session.
+    """
     try:
-        session_maker = sessionmaker(bind=create_engine(get_db_url()))
-        session = session_maker()
-    except RuntimeError as exc:
+        session = get_session_maker()()
+    except RuntimeError:
         # Temporary ugly fix to not crash testing
 
-        session = Session()
+        session = AsyncSession()
     return session
 
 
+def get_pool_stats() -> dict[str, Any]:
+    """
+    Return the connection pool usage and checkout statistics.
+
+    :returns: A dictionary with the pool status and checkout wait times.
+    """
+    try:
+        pool = get_engine().pool
+    except RuntimeError:
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **pool_stats,
+    }
+
+
 class RSVP_STATUS(enum.Enum):
     """
     RSVP status enum
@@ -92,6 +204,19 @@ class Base(DeclarativeBase):
     """
 
 
+class TableVersion(Base):
+    """
+    One slot of the version of a table, bumped by a trigger on every write to it.
+    The version of the table is the sum of its slots
+    """
+
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    slot = Column(SmallInteger, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
 class RsvpResponse(Base):
     """
     RSVP Responses model
@@ -99,101 +224,229 @@ class RsvpResponse(Base):
 
     __tablename__ = "rsvp_responses"
 
-    eventId = Column(SmallInteger, primary_key=True)
+    eventId = Column(Integer, primary_key=True)
     username = Column(String, primary_key=True)
-    status = Column(String, default=RSVP_STATUS.MAYBE, nullable=False)
+    status = Column(
+        ENUM(
+            *(status.value for status in RSVP_STATUS),
+            name="participation_status",
+            create_type=False,
+        ),
+        default=RSVP_STATUS.MAYBE.value,
+        nullable=False,
+    )
     # __table_args__ = PrimaryKeyConstraint("eventId", "username")
 
 
-def create_response(eventId: int, username: str, status: RSVP_STATUS):
-    response = RsvpResponse(eventId=eventId, username=username, status=status.value)
+# The columns listings are ordered and paginated by
+RESPONSE_KEY = (RsvpResponse.eventId, RsvpResponse.username)
 
-    session = get_session()
-    session.add(response)
-    try:
-        session.commit()
-    except (IntegrityError, OperationalError) as exc:
-        session.rollback()
-        raise exc
-    return RsvpResponse(eventId=eventId, username=username, status=status)
-
-
-def find_all_responses():
-    session = get_session()
-    responses = session.query(RsvpResponse).all()
-    return [
-        RsvpResponse(
-            eventId=response.eventId, username=response.username, status=response.status
-        )
-        for response in responses
-    ]
 
+@traced
+async def create_response(eventId: int, username: str, status: RSVP_STATUS):
+    """
+    Create a response in one statement, unless it already exists.
 
-def find_response(eventId: int, username: str):
-    if not (eventId or username):
-        return None
-    session = get_session()
-    response = (
-        session.query(RsvpResponse)
-        .filter(RsvpResponse.eventId == eventId, RsvpResponse.username == username)
-        .first()
-    )
-    return (
-        RsvpResponse(
-            eventId=response.eventId, username=response.username, status=response.status
-        )
-        if response
-        else None
+    :param eventId: The id of the event.
+    :param username: The username of the responding user.
+    :param status: The status of the response.
+
+    :returns: The created response, or None if the user had already responded.
+    """
+    statement = (
+        insert(RsvpResponse)
+        .values(eventId=eventId, username=username, status=status.value)
+        .on_conflict_do_nothing()
+        .returning(RsvpResponse.eventId)
     )
+    async with get_session() as session:
+        try:
+            created = (await session.execute(statement)).first()
+            await session.commit()
+        except (IntegrityError, OperationalError) as exc:
+            await session.rollback()
+            raise exc
+        if not created:
+            return None
+        return RsvpResponse(eventId=eventId, username=username, status=status)
+
+
+@traced
+async def upsert_response(eventId: int, username: str, status: RSVP_STATUS) -> bool:
+    """
+    Create a response, or set its status if it exists, in one statement.
+
+    Concurrent upserts of the same response are serialized on its primary key,
+    and the last one wins.
 
+    :param eventId: The id of the event.
+    :param username: The username of the responding user.
+    :param status: The status of the response.
 
-def find_response_by_event(eventId: int):
-    session = get_session()
-    responses = (
-        session.query(RsvpResponse).filter(RsvpResponse.eventId == eventId).all()
+    :returns: Whether the response was created rather than updated.
+    """
+    statement = insert(RsvpResponse).values(
+        eventId=eventId, username=username, status=status.value
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[RsvpResponse.eventId, RsvpResponse.username],
+        set_={"status": statement.excluded.status},
+    ).returning(
+        # xmax is 0 on a row the statement inserted, and set on a row it updated
+        literal_column("xmax = 0")
     )
-    return [
-        RsvpResponse(
-            eventId=response.eventId, username=response.username, status=response.status
+    async with get_session() as session:
+        try:
+            created = await session.scalar(statement)
+            await session.commit()
+        except (IntegrityError, OperationalError) as exc:
+            await session.rollback()
+            raise exc
+        return created
+
+
+@traced
+async def find_all_responses(after: tuple | None = None, limit: int | None = None):
+    async with get_session() as session:
+        responses = await session.scalars(
+            keyset(select(RsvpResponse), RESPONSE_KEY, after, limit)
+        )
+        return [
+            RsvpResponse(
+                eventId=response.eventId,
+                username=response.username,
+                status=response.status,
+            )
+            for response in responses
+        ]
+
+
+@traced
+async def find_response(eventId: int, username: str):
+    if not (eventId or username):
+        return None
+    async with get_session() as session:
+        response = await session.scalar(
+            select(RsvpResponse).where(
+                RsvpResponse.eventId == eventId, RsvpResponse.username == username
+            )
+        )
+        return (
+            RsvpResponse(
+                eventId=response.eventId,
+                username=response.username,
+                status=response.status,
+            )
+            if response
+            else None
         )
-        for response in responses
-    ]
 
 
-def find_responses_by_user(username: str):
-    session = get_session()
-    responses = (
-        session.query(RsvpResponse).filter(RsvpResponse.username == username).all()
-    )
-    return [
-        RsvpResponse(
-            eventId=response.eventId, username=response.username, status=response.status
+@traced
+async def find_response_by_event(
+    eventId: int, after: tuple | None = None, limit: int | None = None
+):
+    async with get_session() as session:
+        responses = await session.scalars(
+            keyset(
+                select(RsvpResponse).where(RsvpResponse.eventId == eventId),
+                RESPONSE_KEY,
+                after,
+                limit,
+            )
+        )
+        return [
+            RsvpResponse(
+                eventId=response.eventId,
+                username=response.username,
+                status=response.status,
+            )
+            for response in responses
+        ]
+
+
+@traced
+async def find_responses_by_user(
+    username: str, after: tuple | None = None, limit: int | None = None
+):
+    async with get_session() as session:
+        responses = await session.scalars(
+            keyset(
+                select(RsvpResponse).where(RsvpResponse.username == username),
+                RESPONSE_KEY,
+                after,
+                limit,
+            )
         )
-        for response in responses
-    ]
+        return [
+            RsvpResponse(
+                eventId=response.eventId,
+                username=response.username,
+                status=response.status,
+            )
+            for response in responses
+        ]
+
+
+@traced
+async def update_response(
+    eventId: int,
+    username: str,
+    status: RSVP_STATUS,
+    expected: list[str] | None = None,
+) -> bool:
+    """
+    Set the status of a response in one statement.
 
+    :param eventId: The id of the event.
+    :param username: The username of the responding user.
+    :param status: The new status of the response.
+    :param expected: The statuses the response may have to be updated, or None
+        for any status.
 
-def update_response(eventId: int, username: str, status: RSVP_STATUS):
-    session = get_session()
-    response = session.query(RsvpResponse).get((eventId, username))
-    if response:
-        setattr(response, "status", status.value)
+    :returns: Whether the response was updated.
+    """
+    statement = update(RsvpResponse).where(
+        RsvpResponse.eventId == eventId, RsvpResponse.username == username
+    )
+    if expected is not None:
+        statement = statement.where(RsvpResponse.status.in_(expected))
+    statement = statement.values(status=status.value).returning(RsvpResponse.eventId)
+    async with get_session() as session:
         try:
-            session.commit()
+            updated = (await session.execute(statement)).first()
+            await session.commit()
         except Exception as exc:
-            session.rollback()
+            await session.rollback()
             raise exc
-    return
+        return updated is not None
 
 
-def delete_response(eventId: int, username: str):
-    session = get_session()
-    response = session.query(RsvpResponse).get((eventId, username))
-    if response:
-        session.delete(response)
-        try:
-            session.commit()
-        except Exception as exc:
-            session.rollback()
-            raise exc
-    return
+@traced
+async def delete_response(eventId: int, username: str):
+    async with get_session() as session:
+        response = await session.get(RsvpResponse, (eventId, username))
+        if response:
+            await session.delete(response)
+            try:
+                await session.commit()
+            except Exception as exc:
+                await session.rollback()
+                raise exc
+        return
+
+
+@traced
+async def get_table_version(table: str) -> int:
+    """
+    Get the current version of a table.
+
+    :param table: The name of the table.
+
+    :returns: The version of the table, 0 if it was never written to.
+    """
+    async with get_session() as session:
+        version = await session.scalar(
+            select(func.sum(TableVersion.version)).where(TableVersion.name == table)
+        )
+        return int(version or 0)
@@ -0,0 +1,135 @@
+"""
+Render the traces recorded with `TRACE_EXPORTER=file` as waterfalls.
+
+Usage: python waterfall.py [--trace TRACE_ID] [--last N] [--width COLUMNS] FILE...
+
+The spans of the proxy and of every service can be read at once, as their files
+are merged by trace.
+"""
+
+import argparse
+import json
+import sys
+from collections import defaultdict
+from typing import Any, Iterator
+
+
+def read_spans(paths: list[str]) -> Iterator[dict[str, Any]]:
+    """
+    Read the spans of one or more trace files, skipping lines that are cut off.
+
+    :param paths: The files written by the file exporter.
+
+    :returns: The spans, in the order they were written.
+    """
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def group_traces(spans: Iterator[dict[str, Any]]) -> dict[str, list[dict[str, Any]]]:
+    """
+    Group spans by trace.
+
+    :param spans: The spans to group.
+
+    :returns: The spans of each trace, sorted by start time, with the traces in
+        the order they started.
+    """
+    traces: dict[str, list[dict[str, Any]]] = defaultdict(list)
+    for span in spans:
+        traces[span["trace_id"]].append(span)
+    for trace in traces.values():
+        trace.sort(key=lambda span: span["start"])
+    return dict(sorted(traces.items(), key=lambda item: item[1][0]["start"]))
+
+
+def walk(trace: list[dict[str, Any]]) -> Iterator[tuple[int, dict[str, Any]]]:
+    """
+    Visit the spans of a trace depth first, children in the order they started.
+
+    Spans whose parent was not recorded, such as the first span of a request that
+    came with a `traceparent`, are treated as roots.
+
+    :param trace: The spans of the trace.
+
+    :returns: The depth of each span and the span.
+    """
+    ids = {span["span_id"] for span in trace}
+    children: dict[str | None, list[dict[str, Any]]] = defaultdict(list)
+    for span in trace:
+        parent = span["parent_id"] if span["parent_id"] in ids else None
+        children[parent].append(span)
+
+    def visit(parent: str | None, depth: int) -> Iterator[tuple[int, dict[str, Any]]]:
+        for span in children[parent]:
+            yield depth, span
+            yield from visit(span["span_id"], depth + 1)
+
+    return visit(None, 0)
+
+
+def render(trace: list[dict[str, Any]], width: int) -> str:
+    """
+    Draw a trace as one bar per span, scaled to the duration of the trace.
+
+    :param trace: The spans of the trace.
+    :param width: The number of columns for the bars.
+
+    :returns: The waterfall, one line per span.
+    """
+    start = min(span["start"] for span in trace)
+    end = max(span["start"] + span["duration"] for span in trace)
+    total = max(end - start, 1e-9)
+    rows = []
+    for depth, span in walk(trace):
+        label = "  " * depth + f"{span['service']}: {span['name']}"
+        if span.get("error"):
+            label += f" !{span['error']}"
+        offset = round((span["start"] - start) / total * width)
+        length = max(1, round(span["duration"] / total * width))
+        bar = " " * offset + "█" * min(length, width - offset)
+        rows.append((label, bar, span["duration"]))
+    label_width = max(len(label) for label, _, _ in rows)
+    lines = [f"trace {trace[0]['trace_id']}  {total * 1000:.1f} ms"]
+    for label, bar, duration in rows:
+        lines.append(
+            f"{label:<{label_width}}  {duration * 1000:8.1f} ms  |{bar:<{width}}|"
+        )
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="+", help="trace files to read")
+    parser.add_argument(
+        "--trace", help="only show the trace with this ID or `traceparent` header"
+    )
+    parser.add_argument(
+        "--last", type=int, default=10, help="show the last N traces (default 10)"
+    )
+    parser.add_argument(
+        "--width", type=int, default=60, help="columns for the bars (default 60)"
+    )
+    args = parser.parse_args()
+
+    traces = group_traces(read_spans(args.files))
+    if args.trace:
+        if args.trace.count("-") == 3:
+            args.trace = args.trace.split("-")[1]
+        if args.trace not in traces:
+            print(f"Trace {args.trace} not found", file=sys.stderr)
+            return 1
+        selected = [traces[args.trace]]
+    else:
+        selected = list(traces.values())[-args.last :]
+    print("\n\n".join(render(trace, args.width) for trace in selected))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
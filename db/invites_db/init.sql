@@ -6,3 +6,33 @@ CREATE TABLE "invites" (
     PRIMARY KEY ("eventId", "username") -- FOREIGN KEY ("eventId") REFERENCES "events" ("id") ON DELETE CASCADE,
     -- FOREIGN KEY ("username") REFERENCES "users" ("username") ON DELETE CASCADE
 );
+
+-- Version of each table, bumped by every statement that writes to it, so that
+-- listings can be validated without reading them. The version is the sum of a
+-- few slots, and each connection bumps its own, so that concurrent writers do
+-- not queue for the lock of a single row
+CREATE TABLE "table_versions" (
+    "name" TEXT NOT NULL,
+    "slot" SMALLINT NOT NULL,
+    "version" BIGINT NOT NULL,
+    PRIMARY KEY ("name", "slot")
+);
+
+CREATE FUNCTION bump_table_version() RETURNS TRIGGER AS $$
+BEGIN
+    -- Seeded from the clock, so versions are not reused after a reset
+    INSERT INTO "table_versions" ("name", "slot", "version")
+    VALUES (
+        TG_TABLE_NAME,
+        pg_backend_pid() % 16,
+        (EXTRACT(EPOCH FROM clock_timestamp()) * 1000000)::BIGINT
+    )
+    ON CONFLICT ("name", "slot") DO UPDATE
+    SET "version" = GREATEST("table_versions"."version" + 1, EXCLUDED."version");
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "invites_version"
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "invites"
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
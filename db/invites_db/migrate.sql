@@ -0,0 +1,41 @@
+-- Brings a database initialized by an older init.sql up to date. Every step
+-- checks what is already there, so the script can be run again. Run it with
+-- db/migrate.sh.
+
+-- Table versions, kept in one slot per connection instead of a single row
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT FROM information_schema.columns
+        WHERE table_name = 'table_versions' AND column_name = 'slot'
+    ) THEN
+        -- Versions only validate cached listings, so they can start over
+        DROP TABLE IF EXISTS "table_versions";
+        CREATE TABLE "table_versions" (
+            "name" TEXT NOT NULL,
+            "slot" SMALLINT NOT NULL,
+            "version" BIGINT NOT NULL,
+            PRIMARY KEY ("name", "slot")
+        );
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS TRIGGER AS $$
+BEGIN
+    -- Seeded from the clock, so versions are not reused after a reset
+    INSERT INTO "table_versions" ("name", "slot", "version")
+    VALUES (
+        TG_TABLE_NAME,
+        pg_backend_pid() % 16,
+        (EXTRACT(EPOCH FROM clock_timestamp()) * 1000000)::BIGINT
+    )
+    ON CONFLICT ("name", "slot") DO UPDATE
+    SET "version" = GREATEST("table_versions"."version" + 1, EXCLUDED."version");
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER "invites_version"
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "invites"
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
@@ -0,0 +1,23 @@
+#! /bin/bash
+#
+# Brings the databases of an existing deployment up to date with init.sql, which
+# only runs on an empty volume. Run it while the services are up; it can be run
+# again.
+
+set -euo pipefail
+cd "$(dirname "$0")/.."
+source .env
+
+migrate() {
+    local database=$1 name=$2
+    echo "Migrating ${database}..."
+    podman compose exec -T "${database}-db" \
+        psql -v ON_ERROR_STOP=1 -U "$APP_DB_USER" -d "$name" \
+        < "db/${database}_db/migrate.sql"
+}
+
+migrate auth "$AUTH_DB_NAME"
+migrate events "$EVENTS_DB_NAME"
+migrate invites "$INVITES_DB_NAME"
+migrate rsvp "$RSVP_DB_NAME"
+migrate calendars "$CALENDARS_DB_NAME"
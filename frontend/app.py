@@ -4,6 +4,22 @@ from flask import Flask, redirect, render_template, request, url_for
 app = Flask(__name__)
 
 
+class BackendSession(requests.Session):
+    """
+    Requests to the backend, on behalf of the browser being served.
+
+    The backend rate limits each client by address, so every request tells it the
+    address of the browser. It only trusts the header from the frontend.
+    """
+
+    def request(self, method, url, headers=None, **kwargs):
+        headers = {"X-Forwarded-For": request.remote_addr, **(headers or {})}
+        return super().request(method, url, headers=headers, **kwargs)
+
+
+backend = BackendSession()
+
+
 # The Username & Password of the currently logged-in User, this is used as a pseudo-cookie, as such this is not session-specific.
 username = None
 password = None
@@ -59,7 +75,10 @@ def home():
         # =================================
         public_events = []
         try:
-            response = requests.get("http://backend:8000/api/events/public")
+            response = backend.get(
+                "http://backend:8000/api/events/public",
+                params={"fields": "title,date,organizer"},
+            )
         except requests.exceptions.ConnectionError:
             return render_template(
                 "home.html", username=username, password=password, events=public_events
@@ -95,7 +114,7 @@ def create_event():
 
     # Create the event
     try:
-        response = requests.post(
+        response = backend.post(
             "http://backend:8000/api/events",
             json={
                 "title": title,
@@ -109,30 +128,20 @@ def create_event():
         return redirect("/")
 
     if succesful_request(response):
-        # Send out the invites
+        # Send out the invites, adding yourself as participating (you are the
+        # organizer), all in one request
         event_id = response.json()["event"]["id"]
-        for invitee in invites.split(";"):
-            if not invitee:
-                continue
-            try:
-                requests.post(
-                    "http://backend:8000/api/invites",
-                    json={
-                        "eventId": event_id,
-                        "username": invitee,
-                        "status": "PENDING",
-                    },
-                )
-            except requests.exceptions.ConnectionError:
-                break  # If server is down, don't continue sending invites
         try:
-            # Add yourself as participating (you are the organizer)
-            requests.post(
-                "http://backend:8000/api/invites",
+            backend.post(
+                "http://backend:8000/api/invites/bulk",
                 json={
                     "eventId": event_id,
-                    "username": username,
-                    "status": "YES",
+                    "invites": [{"username": username, "status": "YES"}]
+                    + [
+                        {"username": invitee, "status": "PENDING"}
+                        for invitee in invites.split(";")
+                        if invitee
+                    ],
                 },
             )
         except requests.exceptions.ConnectionError:
@@ -154,82 +163,31 @@ def calendar():
     # Try to keep in mind failure of the underlying microservice
     # =================================
 
-    if calendar_user != username:
-        try:
-            response = requests.get(
-                f"http://backend:8000/api/shares/by/{calendar_user}/with/{username}"
-            )
-            success = succesful_request(response)
-        except requests.exceptions.ConnectionError:
-            success = False
-    else:
-        success = True
+    try:
+        response = backend.get(
+            f"http://backend:8000/api/calendar/{calendar_user}",
+            params={"viewer": username},
+        )
+        success = succesful_request(response)
+    except requests.exceptions.ConnectionError:
+        success = False
 
     if success:
-        calendar = []
-        try:
-            # Get the private events that the user is participating in
-            response = requests.get(
-                f"http://backend:8000/api/invites?username={calendar_user}"
-            )
-        except requests.exceptions.ConnectionError:
-            response = None
-
-        if response is not None and succesful_request(response):
-            events = [
-                invite["eventId"]
-                for invite in response.json()["invites"]
-                if invite["status"] in ["YES", "MAYBE"]
-            ]
-            for event in events:
-                try:
-                    response = requests.get(f"http://backend:8000/api/events/{event}")
-                except requests.exceptions.ConnectionError:
-                    break  # If server is down, don't continue fetching events
-
-                if succesful_request(response):
-                    event = response.json()["event"]
-                    calendar.append(
-                        (
-                            event["id"],
-                            event["title"],
-                            event["date"],
-                            event["organizer"],
-                            "Going",
-                            "Public" if event["isPublic"] else "Private",
-                        )
-                    )
-
-        try:
-            response = requests.get(
-                f"http://backend:8000/api/rsvp?username={calendar_user}"
+        calendar = [
+            (
+                event["id"],
+                event["title"],
+                event["date"],
+                event["organizer"],
+                (
+                    "Going"
+                    if event["source"] == "invite" or event["status"] == "YES"
+                    else "Maybe going"
+                ),
+                "Public" if event["isPublic"] else "Private",
             )
-        except requests.exceptions.ConnectionError:
-            response = None
-
-        if response is not None and succesful_request(response):
-            events = [
-                (rsvp["eventId"], rsvp["status"])
-                for rsvp in response.json()["responses"]
-                if rsvp["status"] in ["YES", "MAYBE"]
-            ]
-            for event, status in events:
-                try:
-                    response = requests.get(f"http://backend:8000/api/events/{event}")
-                except requests.exceptions.ConnectionError:
-                    break  # If server is down, don't continue fetching events
-                if succesful_request(response):
-                    event = response.json()["event"]
-                    calendar.append(
-                        (
-                            event["id"],
-                            event["title"],
-                            event["date"],
-                            event["organizer"],
-                            "Going" if status == "YES" else "Maybe going",
-                            "Public" if event["isPublic"] else "Private",
-                        )
-                    )
+            for event in response.json()["calendar"]
+        ]
     else:
         calendar = None
 
@@ -264,7 +222,7 @@ def share():
     global username
 
     try:
-        response = requests.post(
+        response = backend.post(
             "http://backend:8000/api/shares",
             json={"sharingUser": username, "receivingUser": share_user},
         )
@@ -291,74 +249,29 @@ def view_event(eventid):
     global username
 
     try:
-        response = requests.get(f"http://backend:8000/api/events/{eventid}")
-        if not succesful_request(response):
-            return "Event not found", 404
+        response = backend.get(
+            f"http://backend:8000/api/events/{eventid}/details",
+            params={"viewer": username},
+        )
     except requests.exceptions.ConnectionError:
         return "Event not found", 404
+    if response.status_code == 404:
+        return "Event not found", 404
 
-    event = response.json()["event"]
-
-    if event["isPublic"] or event["organizer"] == username:
-        success = True
-    else:
-        try:
-            # Check if the user is invited
-            response = requests.get(
-                f"http://backend:8000/api/invites?eventId={eventid}&username={username}"
-            )
-            success = succesful_request(response)
-        except requests.exceptions.ConnectionError:
-            success = False
-        if not success:
-            try:
-                # Check if the user shares their calendar with the organizer
-                response = requests.get(
-                    f"http://backend:8000/api/shares/by/{event['organizer']}/with/{username}"
-                )
-                success = succesful_request(response)
-            except requests.exceptions.ConnectionError:
-                success = False
+    success = succesful_request(response)
 
     if success:
-        try:
-            # Get the participants
-            response = requests.get(
-                f"http://backend:8000/api/invites?eventId={eventid}"
-            )
-
-            if not succesful_request(response):
-                return "Event not found", 404
-        except requests.exceptions.ConnectionError:
-            return "Event not found", 404
-
-        participants = [
-            [invite["username"], convert_status(invite["status"])]
-            for invite in response.json()["invites"]
-            if invite["status"] in ["YES", "MAYBE"]
-        ]
-
-        # If the event is public, get the RSVPs
-        if event["isPublic"]:
-            try:
-                response = requests.get(
-                    f"http://backend:8000/api/rsvp?eventId={eventid}"
-                )
-                if succesful_request(response):
-                    participants += [
-                        [rsvp["username"], convert_status(rsvp["status"])]
-                        for rsvp in response.json()["responses"]
-                        if rsvp["status"] in ["YES", "MAYBE"]
-                    ]
-            except requests.exceptions.ConnectionError:
-                pass
-
+        details = response.json()
+        event = details["event"]
         event = [
             event["title"],
             event["date"],
             event["organizer"],
             "Public" if event["isPublic"] else "Private",
-            participants,
+            [
+                [participant["username"], convert_status(participant["status"])]
+                for participant in details["participants"]
+            ],
             event["id"],
         ]
     else:
@@ -383,7 +296,7 @@ def login():
     # Also pay attention to the status code returned by the microservice.
     # ================================
     try:
-        response = requests.post(
+        response = backend.post(
             "http://backend:8000/api/auth/login",
             json={"username": req_username, "password": req_password},
         )
@@ -417,7 +330,7 @@ def register():
     # Registration is successful if a user with the same username doesn't exist yet.
     # ================================
     try:
-        response = requests.post(
+        response = backend.post(
             "http://backend:8000/api/auth/register",
             json={"username": req_username, "password": req_password},
         )
@@ -449,7 +362,7 @@ def invites():
     global username
 
     try:
-        response = requests.get(f"http://backend:8000/api/invites?username={username}")
+        response = backend.get(f"http://backend:8000/api/invites?username={username}")
     except requests.exceptions.ConnectionError:
         response = None
 
@@ -460,22 +373,30 @@ def invites():
             if invite["status"] == "PENDING"
         ]
 
-        for event in events:
+        # Fetch the events in lookups of up to 1000, one round trip each
+        for start in range(0, len(events), 1000):
             try:
-                response = requests.get(f"http://backend:8000/api/events/{event}")
-                if succesful_request(response):
-                    event = response.json()["event"]
-                    my_invites.append(
-                        (
-                            event["id"],
-                            event["title"],
-                            event["date"],
-                            event["organizer"],
-                            "Public" if event["isPublic"] else "Private",
-                        )
-                    )
+                response = backend.post(
+                    "http://backend:8000/api/events/lookup",
+                    json={
+                        "ids": events[start : start + 1000],
+                        "fields": "title,date,organizer,isPublic",
+                    },
+                )
             except requests.exceptions.ConnectionError:
                 break  # If server is down, don't continue fetching events
+            if not succesful_request(response):
+                break
+            for event in response.json()["events"]:
+                my_invites.append(
+                    (
+                        event["id"],
+                        event["title"],
+                        event["date"],
+                        event["organizer"],
+                        "Public" if event["isPublic"] else "Private",
+                    )
+                )
 
     return render_template(
         "invites.html", username=username, password=password, invites=my_invites
@@ -501,7 +422,7 @@ def process_invite():
     status = convert_status(status)
 
     try:
-        requests.put(
+        backend.put(
             "http://backend:8000/api/invites",
             json={"eventId": int(eventId), "username": username, "status": status},
         )
@@ -531,7 +452,7 @@ def rsvp():
 
     try:
         # Check if the user received a private invite before rsvp to public event
-        response = requests.get(
+        response = backend.get(
             f"http://backend:8000/api/invites?eventId={eventId}&username={username}"
         )
     except requests.exceptions.ConnectionError:
@@ -541,7 +462,7 @@ def rsvp():
     if response is not None and succesful_request(response):
         try:
             # If the user received an invite, update the invite
-            requests.put(
+            backend.put(
                 "http://backend:8000/api/invites",
                 json={"eventId": int(eventId), "username": username, "status": status},
             )
@@ -551,26 +472,12 @@ def rsvp():
             pass
 
     # No invite => User is RSVPing to a public event
-    # Check if the rsvp exists
+    # Create the rsvp, or update it if it exists
     try:
-        response = requests.get(
-            f"http://backend:8000/api/rsvp?eventId={eventId}&username={username}"
+        backend.put(
+            f"http://backend:8000/api/rsvp/{int(eventId)}/{username}",
+            json={"status": status},
         )
-    except requests.exceptions.ConnectionError:
-        response = None
-    try:
-        if response is not None and not succesful_request(response):
-            # If it doesn't exist, create it
-            requests.post(
-                "http://backend:8000/api/rsvp",
-                json={"eventId": int(eventId), "username": username, "status": status},
-            )
-        else:
-            # If it does exist, update it
-            requests.put(
-                "http://backend:8000/api/rsvp",
-                json={"eventId": int(eventId), "username": username, "status": status},
-            )
     except requests.exceptions.ConnectionError:
         pass
 